@@ -11,7 +11,11 @@ const char *controllerName = "MQTT_master";               // Unique device name
 const char *deviceName = "ESP32-1";                       // Unique device name for each ESP32
 const char *mqttPublishTopic = "ESP32bootcamp_com";       // Topic to publish messages
 const char *mqttSubscribeTopic = "ESP32bootcamp_control"; // Topic to subscribe to control messages
+const char *mqttPresencePrefix = "ESP32bootcamp_presence"; // Retained presence topic is <prefix>/<deviceName>
 const char *deviceStatus = "Connected";                   // Status message to be sent
+const int maxGroupDevices = 64;                           // Names a group command can list
+const int mqttBufferSize = 1280;                          // Group commands are up to 1024 bytes
+const char *commandFormats[] = {"json", "msgpack"};       // Command payload formats messageHandler() decodes
 
 // Define the PWM pin numbers for the RGB channels
 const int pinR = 4; // Red LED control pin
@@ -28,6 +32,9 @@ const int buttonPin = 10; // GPIO pin used for button input
 WiFiClient espClient;               // Create a WiFi client
 PubSubClient mqttClient(espClient); // Pass the WiFi client to the MQTT client
 
+// Presence topic, built from mqttPresencePrefix and deviceName in setupMQTT()
+char presenceTopic[64];
+
 // LED state variables
 bool ledsOn = false;         // Initial state of LEDs
 bool lastButtonState = HIGH; // Assume button starts unpressed
@@ -43,6 +50,50 @@ void setupLEDs()
     digitalWrite(pinB, LOW);
 }
 
+// Function to check whether bit (number - 1) of a hex mask is set, the
+// last hex digit holding devices 1 to 4
+bool maskHasDevice(const char *mask, int number)
+{
+    int bit = number - 1;
+    int digit = (int)strlen(mask) - 1 - bit / 4;
+    if (bit < 0 || digit < 0)
+        return false;
+    char c = tolower(mask[digit]);
+    int value = isdigit(c) ? c - '0' : (c >= 'a' && c <= 'f' ? c - 'a' + 10 : 0);
+    return (value >> (bit % 4)) & 1;
+}
+
+// Function to check whether a control command addresses this device:
+//   "device": "ALL" or deviceName                 as before
+//   "device": "GROUP", "devices": ["ESP32-1", ...]  listed by name
+//   "device": "GROUP", "mask": "<hex>"             bit n - 1 set for ESP32-n
+// Older sketches ignore group commands, no device is called "GROUP"
+bool isAddressed(JsonDocument &doc)
+{
+    const char *device = doc["device"];
+    if (device == nullptr)
+        return false;
+    if (strcmp(device, "ALL") == 0 || strcmp(device, deviceName) == 0)
+        return true;
+    if (strcmp(device, "GROUP") != 0)
+        return false;
+
+    JsonArray devices = doc["devices"];
+    if (!devices.isNull())
+    {
+        for (JsonVariant name : devices)
+        {
+            if (name.is<const char *>() && strcmp(name.as<const char *>(), deviceName) == 0)
+                return true;
+        }
+        return false;
+    }
+
+    const char *mask = doc["mask"];
+    const char *number = strrchr(deviceName, '-');
+    return mask != nullptr && number != nullptr && maskHasDevice(mask, atoi(number + 1));
+}
+
 // Function to handle incoming MQTT messages
 void messageHandler(char *topic, byte *payload, unsigned int length)
 {
@@ -54,19 +105,24 @@ void messageHandler(char *topic, byte *payload, unsigned int length)
     strncpy(message, (char *)payload, length);
     message[length] = '\0'; // Ensure null termination
 
+    // Commands are JSON objects, or MessagePack once the master picked it
+    // from the "formats" listed in our status replies
+    bool isJson = length > 0 && payload[0] == '{';
+
     // Print the message
     Serial.print("messageHandler(message): ");
-    Serial.println(message);
+    Serial.println(isJson ? message : "<msgpack>");
 
-    // Allocate the JSON document
-    const size_t capacity = JSON_OBJECT_SIZE(5) + 60; // Adjusted capacity for additional fields
+    // Allocate the JSON document, group commands carry a list of device names
+    const size_t capacity = JSON_OBJECT_SIZE(8) + JSON_ARRAY_SIZE(maxGroupDevices) + length;
     DynamicJsonDocument doc(capacity);
 
-    // Deserialize the JSON document
-    DeserializationError error = deserializeJson(doc, payload, length);
+    // Deserialize the JSON or MessagePack document
+    DeserializationError error = isJson ? deserializeJson(doc, payload, length)
+                                        : deserializeMsgPack(doc, payload, length);
     if (error)
     {
-        Serial.print(F("deserializeJson() failed: "));
+        Serial.print(isJson ? F("deserializeJson() failed: ") : F("deserializeMsgPack() failed: "));
         Serial.println(error.f_str());
         return;
     }
@@ -77,6 +133,10 @@ void messageHandler(char *topic, byte *payload, unsigned int length)
     const char *device = doc["device"];
     const char *status = doc["status"];
     const char *messageContent = doc["message"];
+    // Optional correlation ID from the master, echoed back so it can match replies (0 = none)
+    long commandId = doc["id"] | 0L;
+    // Whether the command is meant for this device, see isAddressed()
+    bool addressed = isAddressed(doc);
 
     Serial.print("Type: ");
     Serial.println(type);
@@ -106,8 +166,9 @@ void messageHandler(char *topic, byte *payload, unsigned int length)
         Serial.print("Message: ");
         Serial.println(messageContent);
 
-        // Respond with status if the controller requests it
-        if (strcmp(controller, controllerName) == 0 && strcmp(messageContent, "status") == 0)
+        // Respond with status if the controller requests it from this device or from all
+        if (addressed &&
+            strcmp(controller, controllerName) == 0 && strcmp(messageContent, "status") == 0)
         {
             Serial.print("Sending message on topic: ");
             Serial.println(mqttPublishTopic);
@@ -121,12 +182,18 @@ void messageHandler(char *topic, byte *payload, unsigned int length)
             Serial.print("Message: ");
             Serial.println("status_response");
 
-            DynamicJsonDocument responseDoc(200);
+            DynamicJsonDocument responseDoc(256);
             responseDoc["type"] = "control";
             responseDoc["device"] = deviceName;
             responseDoc["status"] = deviceStatus;
             responseDoc["state"] = ledsOn ? "ON" : "OFF";
             responseDoc["message"] = "status_response";
+            if (commandId)
+                responseDoc["id"] = commandId;
+            // Lets the master switch this device to a more compact command format
+            JsonArray formats = responseDoc.createNestedArray("formats");
+            for (const char *format : commandFormats)
+                formats.add(format);
 
             char responseBuffer[512];
             serializeJson(responseDoc, responseBuffer);
@@ -135,7 +202,7 @@ void messageHandler(char *topic, byte *payload, unsigned int length)
         }
 
         // Control the strip light based on the status
-        if ((strcmp(device, "ALL") == 0 || strcmp(device, deviceName) == 0) &&
+        if (addressed &&
             strcmp(controller, controllerName) == 0 &&
             strcmp(messageContent, "ON") == 0)
         {
@@ -162,6 +229,8 @@ void messageHandler(char *topic, byte *payload, unsigned int length)
             doc["status"] = deviceStatus;
             doc["state"] = ledsOn ? "ON" : "OFF";
             doc["message"] = "state has changed";
+            if (commandId)
+                doc["id"] = commandId;
 
             char jsonBuffer[512];
             serializeJson(doc, jsonBuffer);
@@ -169,7 +238,7 @@ void messageHandler(char *topic, byte *payload, unsigned int length)
             mqttClient.publish(mqttPublishTopic, jsonBuffer);
         }
 
-        if ((strcmp(device, "ALL") == 0 || strcmp(device, deviceName) == 0) &&
+        if (addressed &&
             strcmp(controller, controllerName) == 0 &&
             strcmp(messageContent, "OFF") == 0)
         {
@@ -196,6 +265,8 @@ void messageHandler(char *topic, byte *payload, unsigned int length)
             doc["status"] = deviceStatus;
             doc["state"] = ledsOn ? "ON" : "OFF";
             doc["message"] = "state has changed";
+            if (commandId)
+                doc["id"] = commandId;
 
             char jsonBuffer[512];
             serializeJson(doc, jsonBuffer);
@@ -244,8 +315,10 @@ void connectToWiFi()
 // Function to set up the MQTT client
 void setupMQTT()
 {
+    snprintf(presenceTopic, sizeof(presenceTopic), "%s/%s", mqttPresencePrefix, deviceName);
     mqttClient.setServer(mqttServer, mqttPort);
     mqttClient.setCallback(messageHandler);
+    mqttClient.setBufferSize(mqttBufferSize); // The 256 byte default is too small for group commands
     reconnectMQTT();
 }
 
@@ -255,9 +328,11 @@ void reconnectMQTT()
     while (!mqttClient.connected())
     {
         Serial.print("Attempting MQTT connection...");
-        if (mqttClient.connect(deviceName))
+        // The broker publishes the retained "offline" Will if the connection drops
+        if (mqttClient.connect(deviceName, presenceTopic, 1, true, "offline"))
         {
             Serial.println("connected");
+            mqttClient.publish(presenceTopic, "online", true); // Retained presence message
             mqttClient.subscribe(mqttSubscribeTopic); // Subscribe to the control topic
             digitalWrite(statusPin, HIGH);            // Set status pin high when MQTT is connected
         }
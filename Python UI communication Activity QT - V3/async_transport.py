@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import socket
+from aws_connection import Backoff
+
+# CONNACK return code reported when the broker could not be reached at all
+SERVER_UNAVAILABLE = 3
+
+
+class MqttError(Exception):
+    pass
+
+
+def asyncio_client_factory(loop):
+    # For ShardedClientPool(client_factory=...) and MQTTEngine
+    def factory(index):
+        return AsyncioMqttClient(loop)
+
+    return factory
+
+
+class AsyncioMqttClient:
+    # A paho client driven by an asyncio event loop instead of loop_start():
+    # the socket is watched with add_reader/add_writer and every callback
+    # runs on the loop's thread. With qasync that is the Qt thread, so
+    # broker traffic, coroutines and widgets share one thread.
+    #
+    # Offers the subset of the paho API that ShardedClientPool uses, plus
+    # awaitable connect and subscribe. Call everything but publish() from
+    # the loop's thread. Needs a selector based loop (add_reader), which
+    # qasync and the default loop outside Windows are.
+    def __init__(
+        self, loop, client=None, min_backoff=1.0, max_backoff=60.0, timeout=10.0
+    ):
+        if client is None:
+            import paho.mqtt.client as mqtt
+
+            client = mqtt.Client()
+        self.loop = loop
+        self.client = client
+        self.userdata = None
+        self.on_message = None
+        self.on_publish = None
+        self.on_connect = None
+        self.on_disconnect = None
+
+        self.host = None
+        self.port = None
+        self.keepalive = 60
+        self.timeout = timeout  # TCP connect timeout per address
+        self.want_connected = False
+        self.connect_future = None
+        self.connect_task = None
+        self.misc_task = None
+        self.backoff = Backoff(min_backoff, max_backoff)
+
+        # Awaited subscribe futures by message id. Acks are read on this
+        # same thread, so none can arrive between a request and its
+        # registration here.
+        self.pending = {}
+
+        client.on_connect = self.handle_connect
+        client.on_disconnect = self.handle_disconnect
+        client.on_message = self.handle_message
+        client.on_publish = self.handle_publish
+        client.on_subscribe = self.handle_subscribe
+        # publish() may come from the outbox drain thread and make paho
+        # register the socket for writing there, so watches go through the loop
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def user_data_set(self, userdata):
+        self.userdata = userdata
+
+    # paho-style API used by ShardedClientPool
+
+    def connect(self, host, port, keepalive=60):
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+
+    def loop_start(self):
+        # Connects in the background, the result arrives through on_connect
+        self.want_connected = True
+        self.start_connect()
+
+    def loop_stop(self):
+        self.want_connected = False
+        for task in (self.connect_task, self.misc_task):
+            if task is not None:
+                task.cancel()
+        self.connect_task = self.misc_task = None
+
+    def disconnect(self):
+        self.want_connected = False
+        self.client.disconnect()
+        self.fail_pending("disconnected")
+
+    def subscribe(self, topic, qos=0):
+        return self.client.subscribe(topic, qos)
+
+    def unsubscribe(self, topic):
+        return self.client.unsubscribe(topic)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        return self.client.publish(topic, payload, qos=qos, retain=retain)
+
+    # Awaitable API
+
+    async def connect_async(self, host, port, keepalive=60):
+        # Resolves with the CONNACK return code, raises MqttError when the
+        # broker cannot be reached
+        self.connect(host, port, keepalive)
+        self.want_connected = True
+        return await self.connect_once()
+
+    async def subscribe_async(self, topic, qos=0):
+        rc, mid = self.client.subscribe(topic, qos)
+        return await self.wait_for_ack(rc, mid)
+
+    def wait_for_ack(self, rc, mid):
+        future = self.loop.create_future()
+        if rc != 0:
+            future.set_exception(MqttError(f"Request failed with code {rc}"))
+        else:
+            self.pending[mid] = future
+        return future
+
+    def resolve(self, mid):
+        future = self.pending.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(mid)
+
+    def fail_pending(self, reason):
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(MqttError(reason))
+
+    # Connection handling
+
+    def start_connect(self):
+        if self.connect_task is None or self.connect_task.done():
+            self.connect_task = self.loop.create_task(self.connect_with_retry())
+
+    async def connect_with_retry(self):
+        while self.want_connected:
+            try:
+                rc = await self.connect_once()
+            except MqttError as e:
+                logging.error(f"MQTT connect to {self.host}:{self.port} failed: {e}")
+                if self.on_connect:
+                    self.on_connect(self, self.userdata, {}, SERVER_UNAVAILABLE)
+            else:
+                if rc == 0:
+                    return
+            await asyncio.sleep(self.backoff.next_delay())
+
+    async def connect_once(self):
+        self.connect_future = self.loop.create_future()
+        sock = await self.open_socket()
+        # paho has no public way to take a connected socket, so its socket
+        # factory is swapped for the call; reconnect() then only sends
+        # CONNECT, on this thread. Local clients do not use TLS, whose
+        # handshake reconnect() would still do blocking.
+        self.client.connect_async(self.host, int(self.port), self.keepalive)
+        self.client._create_socket_connection = lambda: sock
+        try:
+            self.client.reconnect()
+        except OSError as e:
+            raise MqttError(str(e)) from e
+        finally:
+            del self.client._create_socket_connection
+        if self.misc_task is None or self.misc_task.done():
+            self.misc_task = self.loop.create_task(self.run_misc())
+        return await self.connect_future
+
+    async def open_socket(self):
+        # Non-blocking resolve and TCP connect on the loop, trying each
+        # address in turn like socket.create_connection
+        try:
+            addresses = await self.loop.getaddrinfo(
+                self.host, int(self.port), type=socket.SOCK_STREAM
+            )
+        except OSError as e:
+            raise MqttError(str(e)) from e
+        error = None
+        for family, kind, proto, _, address in addresses:
+            sock = socket.socket(family, kind, proto)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(
+                    self.loop.sock_connect(sock, address), self.timeout
+                )
+                return sock
+            except (OSError, asyncio.TimeoutError) as e:
+                sock.close()
+                error = e
+        raise MqttError(str(error) or "connect timed out")
+
+    async def run_misc(self):
+        # Keepalive pings and retries, what paho's own thread does once a second
+        while True:
+            await asyncio.sleep(1.0)
+            self.client.loop_misc()
+
+    def call_on_loop(self, callback, *args):
+        # paho closes the socket right after on_socket_close returns, so
+        # watches are changed at once when already on the loop's thread or
+        # when the loop is not running (shutdown)
+        if self.loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop or not self.loop.is_running():
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self.call_on_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.call_on_loop(self.loop.remove_reader, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.call_on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.call_on_loop(self.loop.remove_writer, sock)
+
+    # paho callbacks, all on the loop's thread
+
+    def handle_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self.backoff.reset()
+        if self.connect_future is not None and not self.connect_future.done():
+            self.connect_future.set_result(rc)
+        if self.on_connect:
+            self.on_connect(self, self.userdata, flags, rc)
+
+    def handle_disconnect(self, client, userdata, rc):
+        self.fail_pending("disconnected")
+        if self.on_disconnect:
+            self.on_disconnect(self, self.userdata, rc)
+        if rc != 0 and self.want_connected:
+            # Lost the connection, paho's thread would reconnect by itself
+            self.start_connect()
+
+    def handle_message(self, client, userdata, msg):
+        if self.on_message:
+            self.on_message(self, self.userdata, msg)
+
+    def handle_publish(self, client, userdata, mid):
+        if self.on_publish:
+            self.on_publish(self, self.userdata, mid)
+
+    def handle_subscribe(self, client, userdata, mid, granted_qos):
+        self.resolve(mid)
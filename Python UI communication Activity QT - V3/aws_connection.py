@@ -0,0 +1,237 @@
+import logging
+import random
+import threading
+import time
+
+# Status values reported through on_status
+CONNECTING = "Connecting"
+CONNECTED = "Connected"
+RECONNECTING = "Reconnecting"
+DISCONNECTED = "Disconnected"
+FAILED = "Failed"
+# Not a connection state: the connection is up but a topic was refused
+RESUBSCRIBE_REJECTED = "Resubscribe rejected"
+
+
+class Backoff:
+    # Exponential backoff with full jitter between min_delay and the cap
+    def __init__(self, min_delay=1.0, max_delay=60.0, factor=2.0, rng=random.random):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.rng = rng
+        self.attempt = 0
+
+    def next_delay(self):
+        cap = min(self.max_delay, self.min_delay * self.factor**self.attempt)
+        self.attempt += 1
+        return self.min_delay + (cap - self.min_delay) * self.rng()
+
+    def reset(self):
+        self.attempt = 0
+
+
+class AwsConnectionManager:
+    # Owns the awscrt connection. connect() and disconnect() return at once;
+    # progress is reported through on_status(status, detail), which may be
+    # called from awscrt or timer threads.
+    def __init__(
+        self,
+        builder=None,
+        on_status=None,
+        max_attempts=None,
+        min_backoff=1.0,
+        max_backoff=60.0,
+        timer_factory=threading.Timer,
+        clock=time.monotonic,
+    ):
+        # awsiot/awscrt are only imported once a connection is attempted
+        self.builder = builder
+        self.on_status = on_status
+        self.max_attempts = max_attempts
+        self.backoff = Backoff(min_backoff, max_backoff)
+        self.timer_factory = timer_factory
+        self.clock = clock
+
+        self.connection = None
+        self.connection_kwargs = None
+        self.connected = False
+        self.want_connected = False
+        self.retry_timer = None
+        self.lock = threading.Lock()
+
+        self.attempts = 0
+        self.connect_started = None
+        self.attempt_started = None
+        self.resubscribe_started = None
+        self.metrics = {
+            "connect_seconds": None,
+            "handshake_seconds": None,
+            "resubscribe_seconds": None,
+            "attempts": 0,
+            "interruptions": 0,
+            "reconnects": 0,
+        }
+
+    def configure(self, endpoint, port, client_id, cert, key, ca):
+        kwargs = dict(
+            endpoint=endpoint,
+            port=port,
+            cert_filepath=cert,
+            pri_key_filepath=key,
+            ca_filepath=ca,
+            client_id=client_id,
+            clean_session=False,
+            keep_alive_secs=30,
+            reconnect_min_timeout_secs=max(1, int(self.backoff.min_delay)),
+            reconnect_max_timeout_secs=max(1, int(self.backoff.max_delay)),
+            on_connection_interrupted=self.on_connection_interrupted,
+            on_connection_resumed=self.on_connection_resumed,
+            on_connection_success=self.on_connection_success,
+            on_connection_failure=self.on_connection_failure,
+            on_connection_closed=self.on_connection_closed,
+        )
+        if kwargs != self.connection_kwargs:
+            self.connection_kwargs = kwargs
+            self.connection = None
+
+    def report(self, status, detail=""):
+        if self.on_status:
+            self.on_status(status, detail)
+
+    def connect(self):
+        with self.lock:
+            self.want_connected = True
+            self.cancel_retry()
+            self.backoff.reset()
+            self.attempts = 0
+            self.connect_started = self.clock()
+        self.report(CONNECTING, self.connection_kwargs["endpoint"])
+        self.start_attempt()
+
+    def start_attempt(self):
+        with self.lock:
+            if not self.want_connected:
+                return
+            self.retry_timer = None
+            self.attempts += 1
+            self.metrics["attempts"] += 1
+            self.attempt_started = self.clock()
+        try:
+            if self.connection is None:
+                if self.builder is None:
+                    from awsiot import mqtt_connection_builder
+
+                    self.builder = mqtt_connection_builder
+                self.connection = self.builder.mtls_from_path(**self.connection_kwargs)
+            future = self.connection.connect()
+        except Exception as e:
+            self.on_attempt_failed(e)
+            return
+        future.add_done_callback(self.on_connect_done)
+
+    def on_connect_done(self, future):
+        error = future.exception()
+        if error is not None:
+            self.on_attempt_failed(error)
+            return
+        with self.lock:
+            cancelled = not self.want_connected
+            if not cancelled:
+                now = self.clock()
+                self.connected = True
+                self.metrics["handshake_seconds"] = now - self.attempt_started
+                self.metrics["connect_seconds"] = now - self.connect_started
+                self.backoff.reset()
+        if cancelled:
+            # disconnect() was called while the handshake was in flight
+            self.connection.disconnect()
+            return
+        self.report(CONNECTED, self.connection_kwargs["endpoint"])
+
+    def on_attempt_failed(self, error):
+        logging.error(f"Failed to connect to AWS IoT Core: {error}")
+        with self.lock:
+            self.connected = False
+            if not self.want_connected:
+                return
+            if self.max_attempts is not None and self.attempts >= self.max_attempts:
+                self.want_connected = False
+                give_up = True
+            else:
+                give_up = False
+                delay = self.backoff.next_delay()
+                retry_timer = self.timer_factory(delay, self.start_attempt)
+                retry_timer.daemon = True
+                self.retry_timer = retry_timer
+        if give_up:
+            self.report(FAILED, str(error))
+        else:
+            self.report(RECONNECTING, f"{error}, retrying in {delay:.1f} s")
+            retry_timer.start()
+
+    def cancel_retry(self):
+        if self.retry_timer is not None:
+            self.retry_timer.cancel()
+            self.retry_timer = None
+
+    def disconnect(self):
+        with self.lock:
+            self.want_connected = False
+            self.cancel_retry()
+            connection = self.connection
+        if connection is None or not self.connected:
+            self.connected = False
+            self.report(DISCONNECTED)
+            return
+        try:
+            connection.disconnect().add_done_callback(self.on_disconnect_done)
+        except Exception as e:
+            self.on_disconnect_done(None, e)
+
+    def on_disconnect_done(self, future, error=None):
+        if future is not None:
+            error = future.exception()
+        if error is not None:
+            logging.error(f"Failed to disconnect from AWS IoT Core: {error}")
+        self.connected = False
+        self.report(DISCONNECTED, str(error) if error else "")
+
+    # awscrt connection callbacks, called on awscrt threads
+
+    def on_connection_interrupted(self, connection, error, **kwargs):
+        self.connected = False
+        self.metrics["interruptions"] += 1
+        # awscrt resumes on its own within the reconnect_*_timeout_secs range
+        self.report(RECONNECTING, f"connection interrupted: {error}")
+
+    def on_connection_resumed(self, connection, return_code, session_present, **kwargs):
+        from awscrt import mqtt as aws_mqtt
+
+        self.connected = True
+        self.metrics["reconnects"] += 1
+        self.report(CONNECTED, "connection resumed")
+        if return_code == aws_mqtt.ConnectReturnCode.ACCEPTED and not session_present:
+            self.resubscribe_started = self.clock()
+            resubscribe_future, _ = connection.resubscribe_existing_topics()
+            resubscribe_future.add_done_callback(self.on_resubscribe_complete)
+
+    def on_resubscribe_complete(self, resubscribe_future):
+        self.metrics["resubscribe_seconds"] = self.clock() - self.resubscribe_started
+        resubscribe_results = resubscribe_future.result()
+        for topic, qos in resubscribe_results["topics"]:
+            if qos is None:
+                self.report(RESUBSCRIBE_REJECTED, topic)
+
+    def on_connection_success(self, connection, callback_data):
+        logging.info(
+            f"AWS IoT Core connection successful, return code: "
+            f"{callback_data.return_code} session present: "
+            f"{callback_data.session_present}"
+        )
+
+    def on_connection_failure(self, connection, callback_data):
+        logging.warning(f"AWS IoT Core connection failed: {callback_data.error}")
+
+    def on_connection_closed(self, connection, callback_data):
+        self.connected = False
@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from decoder import PayloadDecoder, available_backends
+
+
+def make_frames(count, invalid_ratio):
+    frames = []
+    invalid_every = int(1 / invalid_ratio) if invalid_ratio > 0 else 0
+    for i in range(count):
+        if invalid_every and i % invalid_every == 0:
+            # Our own control frames echo back on a shared topic
+            frame = {
+                "type": "control",
+                "controller": "MQTT_master",
+                "device": "ALL",
+                "status": "connected",
+                "message": "status",
+            }
+        else:
+            frame = {
+                "type": "com",
+                "device": f"ESP32-{i % 1000 + 1}",
+                "status": "Connected",
+                "state": "ON" if i % 2 else "OFF",
+                "message": "state has changed",
+            }
+        frames.append(json.dumps(frame).encode())
+    return frames
+
+
+def run(backend, frames, repeat):
+    decoder = PayloadDecoder(backend)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            decoder.decode(frame)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "backend": backend,
+        "frames": len(frames),
+        "best_seconds": round(best, 6),
+        "frames_per_second": round(len(frames) / best),
+        "ns_per_frame": round(best / len(frames) * 1e9),
+        "invalid_per_run": decoder.invalid // repeat,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare payload decoder backends")
+    parser.add_argument("--frames", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--invalid-ratio", type=float, default=0.05)
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames, args.invalid_ratio)
+    results = [run(backend, frames, args.repeat) for backend in available_backends()]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(
+                f"{result['backend']:>8}: {result['frames_per_second']:>10} frames/s "
+                f"{result['ns_per_frame']:>6} ns/frame "
+                f"({result['invalid_per_run']} invalid)"
+            )
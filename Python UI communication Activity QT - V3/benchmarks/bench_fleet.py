@@ -0,0 +1,277 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import MQTTEngine
+from headless import HeadlessRunner
+from fleet import COM_TOPIC, CONTROL_TOPIC, LoopbackBroker, SimulatedFleet
+
+
+def rss_bytes():
+    # Current resident set size, Linux only
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class FleetBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.broker = LoopbackBroker()
+        self.fleet = SimulatedFleet(self.broker, args.devices, presence=args.presence)
+        self.fleet.dup_ratio = args.dup_ratio
+        self.engine = MQTTEngine(
+            local_pool_size=args.pool_size,
+            local_client_factory=self.broker.client_factory,
+            telemetry_path=args.telemetry,
+            metrics_enabled=not args.no_metrics,
+        )
+        self.engine.device_timeouts.default_timeout = args.timeout
+        self.engine.status_poller.stale_after = args.stale_after
+        self.engine.status_poller.discovery_interval = args.broadcast_interval
+        self.runner = HeadlessRunner(self.engine)
+
+        self.messages = 0
+        self.device_updates = 0
+        self.disconnects = 0
+        self.latencies = []
+        self.current_topic = None
+        self.max_depth = 0
+        self.engine.on("message", self.on_message)
+        self.engine.on("device", self.on_device)
+
+    def on_message(self, topic, payload):
+        # Emitted by process_ingest right before the message is handled
+        self.messages += 1
+        self.current_topic = topic
+
+    def on_device(self, device, status, state):
+        self.device_updates += 1
+        if status == "Disconnected":
+            self.disconnects += 1
+        elif self.current_topic == COM_TOPIC:
+            sent = self.fleet.sent.get(device)
+            if sent:
+                self.latencies.append(time.perf_counter() - sent.popleft())
+
+    def generate(self, stop):
+        # Unsolicited reports at a fixed total rate, round-robin over the
+        # devices that are not muted
+        names = self.fleet.names
+        if not self.args.rate:
+            return
+        interval = 0.01
+        per_tick = self.args.rate * interval
+        owed = 0.0
+        index = 0
+        next_tick = time.perf_counter()
+        while not stop.is_set():
+            owed += per_tick
+            if len(self.fleet.muted) >= len(names):
+                owed = 0
+            while owed >= 1:
+                name = names[index % len(names)]
+                index += 1
+                if name in self.fleet.muted:
+                    continue
+                self.fleet.report(name)
+                owed -= 1
+            next_tick += interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def run(self):
+        args = self.args
+        silent = int(len(self.fleet.names) * args.silent_ratio)
+
+        rss_before = rss_bytes()
+        if args.capture:
+            self.engine.start_capture(args.capture)
+        self.broker.start()
+        self.engine.connect_local("loopback", 1883)
+        self.engine.set_publish_topic_local(CONTROL_TOPIC)
+        self.engine.set_subscribe_topic_local(COM_TOPIC)
+        self.fleet.start()
+
+        runner_thread = threading.Thread(target=self.runner.run, name="engine")
+        runner_thread.start()
+        stop = threading.Event()
+        generator = threading.Thread(target=self.generate, args=(stop,))
+        started = time.perf_counter()
+        generator.start()
+
+        deadline = started + args.duration
+        # Halfway through, some devices drop off and have to time out
+        mute_at = started + args.duration / 2
+        while time.perf_counter() < deadline:
+            if silent and time.perf_counter() >= mute_at:
+                self.fleet.muted.update(self.fleet.names[:silent])
+                silent = 0
+            time.sleep(0.05)
+            self.max_depth = max(self.max_depth, self.engine.ingest_queue.depth)
+        stop.set()
+        generator.join()
+        offered = self.fleet.replies
+
+        # Let the engine catch up with what the broker already accepted
+        settle_deadline = time.perf_counter() + args.settle
+        while time.perf_counter() < settle_deadline:
+            if self.broker.inbox.empty() and not self.engine.ingest_queue.depth:
+                break
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        self.runner.stop()
+        runner_thread.join()
+        self.engine.disconnect_local()
+        self.broker.stop()
+        if self.engine.telemetry:
+            self.engine.telemetry.flush()
+        results = self.results(elapsed, offered, rss_before)
+        self.engine.close()
+        return results
+
+    def results(self, elapsed, offered, rss_before):
+        latencies = sorted(self.latencies)
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+
+        return {
+            "label": self.args.label,
+            "python": platform.python_version(),
+            "config": {
+                "devices": self.args.devices,
+                "rate": self.args.rate,
+                "duration": self.args.duration,
+                "pool_size": self.args.pool_size,
+                "presence": self.args.presence,
+                "silent_ratio": self.args.silent_ratio,
+                "dup_ratio": self.args.dup_ratio,
+                "timeout": self.args.timeout,
+                "stale_after": self.args.stale_after,
+                "broadcast_interval": self.args.broadcast_interval,
+                "telemetry": self.args.telemetry,
+                "metrics": not self.args.no_metrics,
+            },
+            "elapsed_seconds": round(elapsed, 3),
+            "messages_offered": offered,
+            "messages_processed": self.messages,
+            "messages_per_second": round(self.messages / elapsed),
+            "device_updates": self.device_updates,
+            "disconnects": self.disconnects,
+            "latency_ms": {
+                "samples": len(latencies),
+                "p50": ms(percentile(latencies, 0.50)),
+                "p99": ms(percentile(latencies, 0.99)),
+                "max": ms(latencies[-1] if latencies else None),
+            },
+            "max_ingest_depth": self.max_depth,
+            "fleet_commands": self.fleet.commands,
+            "redelivered": self.fleet.redelivered,
+            "rss_bytes": rss_bytes(),
+            "rss_growth_bytes": (
+                None if rss_before is None else rss_bytes() - rss_before
+            ),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "engine": self.engine.stats(),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive MQTTEngine with a simulated ESP32 fleet"
+    )
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument(
+        "--rate", type=float, default=2000, help="unsolicited reports per second"
+    )
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--pool-size", type=int, default=1)
+    parser.add_argument(
+        "--presence", action="store_true", help="devices publish retained presence"
+    )
+    parser.add_argument(
+        "--silent-ratio",
+        type=float,
+        default=0.0,
+        help="fraction of devices that go quiet halfway, to exercise timeouts",
+    )
+    parser.add_argument(
+        "--dup-ratio",
+        type=float,
+        default=0.0,
+        help="fraction of reports the broker redelivers with the DUP flag",
+    )
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--stale-after", type=float, default=5.0)
+    parser.add_argument("--broadcast-interval", type=float, default=60.0)
+    parser.add_argument(
+        "--settle", type=float, default=5.0, help="max seconds to drain at the end"
+    )
+    parser.add_argument(
+        "--telemetry", help="also write every message to a store in this directory"
+    )
+    parser.add_argument(
+        "--capture", help="record the traffic the engine received, for replays"
+    )
+    parser.add_argument(
+        "--no-metrics", action="store_true", help="turn off hot path timings"
+    )
+    parser.add_argument("--label", default="", help="free text stored in the results")
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    parser.add_argument("--output", help="also append the JSON results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = FleetBenchmark(args).run()
+
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(results) + "\n")
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        latency = results["latency_ms"]
+        print(
+            f"{results['config']['devices']} devices, "
+            f"{results['messages_processed']}/{results['messages_offered']} messages "
+            f"in {results['elapsed_seconds']} s: "
+            f"{results['messages_per_second']} msg/s"
+        )
+        print(
+            f"latency p50 {latency['p50']} ms, p99 {latency['p99']} ms, "
+            f"max {latency['max']} ms ({latency['samples']} samples)"
+        )
+        print(
+            f"disconnects {results['disconnects']}, "
+            f"max ingest depth {results['max_ingest_depth']}, "
+            f"rss {results['rss_bytes']} bytes (peak {results['peak_rss_bytes']})"
+        )
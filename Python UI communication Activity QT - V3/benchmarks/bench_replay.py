@@ -0,0 +1,74 @@
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import MQTTEngine
+from headless import HeadlessRunner, stop_after
+
+
+def run(args):
+    engine = MQTTEngine()
+    runner = HeadlessRunner(engine, poll=False)
+    devices = set()
+    engine.on("device", lambda device, status, state: devices.add(device))
+
+    replayer = engine.replay(args.capture, args.speed)
+    threading.Thread(target=stop_after, args=(replayer, runner), daemon=True).start()
+
+    profiler = cProfile.Profile() if args.profile else None
+    started = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    runner.run()
+    if profiler:
+        profiler.disable()
+    elapsed = time.perf_counter() - started
+    engine.close()
+
+    stats = engine.stats()
+    results = {
+        "capture": args.capture,
+        "speed": args.speed,
+        "replayed": replayer.replayed,
+        "elapsed_seconds": round(elapsed, 3),
+        "messages_per_second": round(replayer.replayed / elapsed),
+        "devices": len(devices),
+        "ingest": stats["ingest"],
+        "decoder": stats["decoder"],
+    }
+    return results, profiler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay a capture through the ingest path without a broker"
+    )
+    parser.add_argument("capture", help="file written by --capture")
+    parser.add_argument(
+        "--speed", type=float, default=0, help="speed factor, 0 (default) for max"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="print the top functions by time"
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    results, profiler = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(
+            f"{results['replayed']} messages from {results['devices']} devices "
+            f"in {results['elapsed_seconds']} s: "
+            f"{results['messages_per_second']} msg/s "
+            f"({results['ingest']['dropped']} dropped)"
+        )
+    if profiler:
+        pstats.Stats(profiler).sort_stats("tottime").print_stats(20)
@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from ui_cache import CACHE_DIR
+
+# Each sample runs in a fresh interpreter so nothing is already imported
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [name for name in ("paho", "awscrt", "awsiot") if name in sys.modules]
+print(json.dumps({{"seconds": elapsed, "loaded": heavy}}))
+"""
+
+WINDOW_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import QTimer
+from model import MQTTModel
+from view import MQTTView
+from controller import MQTTController
+imported = time.perf_counter()
+app = QtWidgets.QApplication(sys.argv)
+view = MQTTView(None)
+model = MQTTModel(view)
+controller = MQTTController(model, view)
+view.controller = controller
+view.show()
+built = time.perf_counter()
+
+def first_event():
+    shown = time.perf_counter()
+    print(json.dumps({
+        "import_seconds": imported - start,
+        "build_seconds": built - imported,
+        "first_window_seconds": shown - start,
+    }))
+    app.quit()
+
+# Runs once the event loop has processed the show/paint events
+QTimer.singleShot(0, first_event)
+app.exec_()
+"""
+
+
+def run_probe(source, env):
+    output = subprocess.run(
+        [sys.executable, "-c", source],
+        cwd=APP_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(samples, key):
+    values = [sample[key] for sample in samples]
+    return {
+        "median_ms": round(statistics.median(values) * 1000, 2),
+        "min_ms": round(min(values) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2),
+    }
+
+
+def bench_imports(modules, repeat, env):
+    results = []
+    for module in modules:
+        try:
+            samples = [
+                run_probe(IMPORT_PROBE.format(module=module), env)
+                for _ in range(repeat)
+            ]
+        except subprocess.CalledProcessError as e:
+            results.append({"module": module, "error": e.stderr.strip()[-200:]})
+            continue
+        result = {"module": module, **summarize(samples, "seconds")}
+        result["backends_loaded"] = samples[-1]["loaded"]
+        results.append(result)
+    return results
+
+
+def bench_window(repeat, cold, env):
+    samples = []
+    for _ in range(repeat):
+        if cold:
+            shutil.rmtree(os.path.join(APP_DIR, CACHE_DIR), ignore_errors=True)
+        samples.append(run_probe(WINDOW_PROBE, env))
+    return {
+        "cache": "cold" if cold else "warm",
+        "import": summarize(samples, "import_seconds"),
+        "build": summarize(samples, "build_seconds"),
+        "first_window": summarize(samples, "first_window_seconds"),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure import time and time to first window"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--modules",
+        default="engine,model,view,headless",
+        help="comma separated modules to time",
+    )
+    parser.add_argument(
+        "--no-window", action="store_true", help="skip the Qt window measurement"
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    results = {"imports": bench_imports(args.modules.split(","), args.repeat, env)}
+    if not args.no_window:
+        try:
+            results["window"] = [
+                bench_window(args.repeat, True, env),
+                bench_window(args.repeat, False, env),
+            ]
+        except subprocess.CalledProcessError as e:
+            results["window"] = {"error": e.stderr.strip()[-200:]}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results["imports"]:
+            if "error" in result:
+                print(f"import {result['module']:>9}: failed ({result['error']})")
+                continue
+            loaded = ", ".join(result["backends_loaded"]) or "none"
+            print(
+                f"import {result['module']:>9}: {result['median_ms']:>8} ms median "
+                f"(backends loaded: {loaded})"
+            )
+        window = results.get("window")
+        if isinstance(window, dict):
+            print(f"first window: failed ({window['error']})")
+        elif window:
+            for result in window:
+                print(
+                    f"first window ({result['cache']} .ui cache): "
+                    f"{result['first_window']['median_ms']} ms median, "
+                    f"build {result['build']['median_ms']} ms"
+                )
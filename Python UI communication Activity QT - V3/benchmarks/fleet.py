@@ -0,0 +1,281 @@
+import collections
+import itertools
+import json
+import queue
+import random
+import threading
+import time
+
+# In-process stand-in for the Mosquitto broker and a fleet of ESP32 boards
+# running MQTT_project_local/4_MQTT_Strip_light. The broker thread plays the
+# part of paho's network thread, so engine callbacks run off the caller's
+# thread just as they do against a real broker.
+
+CONTROL_TOPIC = "ESP32bootcamp_control"
+COM_TOPIC = "ESP32bootcamp_com"
+PRESENCE_PREFIX = "ESP32bootcamp_presence"
+CONTROLLER_NAME = "MQTT_master"
+
+LoopbackMessage = collections.namedtuple(
+    "LoopbackMessage", "topic payload retain dup", defaults=(False,)
+)
+MessageInfo = collections.namedtuple("MessageInfo", "rc mid")
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class LoopbackBroker:
+    # Routes publishes on one delivery thread. Subscribers are callables
+    # taking a LoopbackMessage; "$share/<group>/<filter>" subscriptions get
+    # round-robin delivery within the group like Mosquitto 2.
+    def __init__(self):
+        self.inbox = queue.SimpleQueue()
+        self.subscriptions = []  # (filter, group, subscriber)
+        self.share_cursors = collections.defaultdict(itertools.count)
+        self.retained = {}
+        self.lock = threading.Lock()
+        self.routed = 0
+        self.delivered = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="loopback-broker")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.inbox.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def client_factory(self, index):
+        return LoopbackClient(self, index)
+
+    def subscribe(self, topic_filter, subscriber):
+        group = None
+        if topic_filter.startswith("$share/"):
+            _, group, topic_filter = topic_filter.split("/", 2)
+        with self.lock:
+            # Subscribing again to the same filter replaces the subscription
+            entry = (topic_filter, group, subscriber)
+            if entry not in self.subscriptions:
+                self.subscriptions.append(entry)
+            retained = [
+                message
+                for topic, message in self.retained.items()
+                if topic_matches(topic_filter, topic)
+            ]
+        # Stored retained messages go out with the retain flag set
+        for message in retained:
+            self.inbox.put((message, None))
+
+    def unsubscribe(self, topic_filter, subscriber):
+        group = None
+        if topic_filter.startswith("$share/"):
+            _, group, topic_filter = topic_filter.split("/", 2)
+        with self.lock:
+            self.subscriptions = [
+                entry
+                for entry in self.subscriptions
+                if entry != (topic_filter, group, subscriber)
+            ]
+
+    def publish(self, topic, payload, retain=False, delivered=None, dup=False):
+        # dup=True delivers it the way a broker redelivers an unacked QoS 1
+        # message after a reconnect
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.inbox.put((LoopbackMessage(topic, payload, retain, dup), delivered))
+
+    def run(self):
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                return
+            message, delivered = item
+            self.route(message)
+            if delivered is not None:
+                delivered()
+
+    def route(self, message):
+        with self.lock:
+            if message.retain:
+                self.retained[message.topic] = message
+                # Live subscribers get it without the flag, as in MQTT 3.1.1
+                message = message._replace(retain=False)
+            matches = [
+                entry
+                for entry in self.subscriptions
+                if topic_matches(entry[0], message.topic)
+            ]
+        self.routed += 1
+        groups = collections.defaultdict(list)
+        for topic_filter, group, subscriber in matches:
+            if group is None:
+                subscriber(message)
+                self.delivered += 1
+            else:
+                groups[(group, topic_filter)].append(subscriber)
+        for key, members in groups.items():
+            members[next(self.share_cursors[key]) % len(members)](message)
+            self.delivered += 1
+
+
+class LoopbackClient:
+    # The subset of paho.mqtt.client.Client that ShardedClientPool uses
+    def __init__(self, broker, index):
+        self.broker = broker
+        self.index = index
+        self.userdata = None
+        self.on_message = None
+        self.on_publish = None
+        self.on_connect = None
+        self.mids = itertools.count(1)
+        self.connected = False
+
+    def user_data_set(self, userdata):
+        self.userdata = userdata
+
+    def connect(self, host, port, keepalive=60):
+        self.connected = True
+
+    def loop_start(self):
+        if self.on_connect:
+            self.broker.inbox.put(
+                (
+                    LoopbackMessage("$SYS/connect", b"", False),
+                    lambda: self.on_connect(self, self.userdata, {}, 0),
+                )
+            )
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        self.connected = False
+
+    def deliver(self, message):
+        if self.on_message:
+            self.on_message(self, self.userdata, message)
+
+    def subscribe(self, topic_filter, qos=0):
+        self.broker.subscribe(topic_filter, self.deliver)
+        return (0, next(self.mids))
+
+    def unsubscribe(self, topic_filter):
+        self.broker.unsubscribe(topic_filter, self.deliver)
+        return (0, next(self.mids))
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        mid = next(self.mids)
+
+        def delivered():
+            if self.on_publish:
+                self.on_publish(self, self.userdata, mid)
+
+        self.broker.publish(topic, payload, retain, delivered)
+        return MessageInfo(0, mid)
+
+
+class SimulatedFleet:
+    # N boards answering on COM_TOPIC exactly like 4_MQTT_Strip_light: ON/OFF
+    # replies with a "com" frame, status with a "control" status_response.
+    # sent[device] holds the send time of every reply not yet consumed, so the
+    # benchmark can measure end-to-end latency per device.
+    def __init__(self, broker, count, prefix="ESP32-", presence=False):
+        self.broker = broker
+        self.names = [f"{prefix}{i + 1}" for i in range(count)]
+        self.states = dict.fromkeys(self.names, False)
+        self.presence = presence
+        self.muted = set()  # powered off or out of range, answer nothing
+        self.dup_ratio = 0.0
+        self.rng = random.Random(1)
+        self.redelivered = 0
+        self.sent = collections.defaultdict(collections.deque)
+        self.replies = 0
+        self.commands = 0
+        self.ignored = 0
+
+    def start(self):
+        self.broker.subscribe(CONTROL_TOPIC, self.on_control)
+        if self.presence:
+            for name in self.names:
+                self.broker.publish(f"{PRESENCE_PREFIX}/{name}", b"online", True)
+
+    def on_control(self, message):
+        try:
+            doc = json.loads(message.payload)
+        except ValueError:
+            self.ignored += 1
+            return
+        if doc.get("type") != "control" or doc.get("controller") != CONTROLLER_NAME:
+            self.ignored += 1
+            return
+        self.commands += 1
+        targets = self.targets(doc)
+        action = doc.get("message")
+        command_id = doc.get("id")
+        for name in targets:
+            if name not in self.states or name in self.muted:
+                continue
+            if action == "status":
+                self.reply(name, "control", "status_response", command_id)
+            elif action in ("ON", "OFF"):
+                self.states[name] = action == "ON"
+                self.reply(name, "com", "state has changed", command_id)
+
+    def targets(self, doc):
+        # isAddressed() in the sketch
+        device = doc.get("device")
+        if device == "ALL":
+            return self.names
+        if device != "GROUP":
+            return [device]
+        if "devices" in doc:
+            return doc["devices"]
+        mask = int(doc.get("mask") or "0", 16)
+        return [
+            name for name in self.names if mask >> (int(name.rsplit("-", 1)[1]) - 1) & 1
+        ]
+
+    def reply(self, name, frame_type, text, command_id=None):
+        frame = {
+            "type": frame_type,
+            "device": name,
+            "status": "Connected",
+            "state": "ON" if self.states[name] else "OFF",
+            "message": text,
+        }
+        if command_id:
+            # The firmware echoes the correlation ID of the command
+            frame["id"] = command_id
+        self.send(name, json.dumps(frame).encode())
+
+    def report(self, name):
+        # Unsolicited report, as when someone flips the strip locally
+        self.states[name] = not self.states[name]
+        self.reply(name, "com", "state has changed")
+
+    def send(self, name, payload):
+        self.sent[name].append(time.perf_counter())
+        self.replies += 1
+        self.broker.publish(COM_TOPIC, payload)
+        if self.dup_ratio and self.rng.random() < self.dup_ratio:
+            self.redelivered += 1
+            self.broker.publish(COM_TOPIC, payload, dup=True)
+
+    def go_offline(self, name):
+        # What the broker does with the retained Last Will
+        self.broker.publish(f"{PRESENCE_PREFIX}/{name}", b"offline", True)
@@ -0,0 +1,185 @@
+import gzip
+import struct
+import threading
+import time
+
+# Capture file layout, all little endian:
+#   MAGIC
+#   b"T" <u16 topic id> <u16 length> <topic utf-8>    declares a topic once
+#   b"M" <f64 timestamp> <u16 topic id> <u32 length> <payload>
+#   b"I" <f64 timestamp> <u16 topic length> <u32 length> <topic> <payload>
+#        once all topic ids are taken, the topic goes with the message
+# Files ending in .gz are gzip compressed.
+MAGIC = b"MQCAP1\n"
+TOPIC_RECORD = b"T"
+MESSAGE_RECORD = b"M"
+INLINE_RECORD = b"I"
+TOPIC_HEADER = struct.Struct("<HH")
+MESSAGE_HEADER = struct.Struct("<dHI")
+INLINE_HEADER = struct.Struct("<dHI")
+MAX_TOPICS = 1 << 16
+
+
+def open_capture(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class CaptureWriter:
+    # Records raw broker traffic. write() is called on the broker threads, so
+    # it only packs into the file's buffer under a lock.
+    def __init__(self, path):
+        self.path = path
+        self.file = open_capture(path, "wb")
+        self.file.write(MAGIC)
+        self.topics = {}
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, topic, payload, ts):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self.lock:
+            if self.file is None:
+                return
+            topic_id = self.topics.get(topic)
+            if topic_id is None and len(self.topics) >= MAX_TOPICS:
+                encoded = topic.encode()
+                self.file.write(
+                    INLINE_RECORD
+                    + INLINE_HEADER.pack(ts, len(encoded), len(payload))
+                    + encoded
+                    + payload
+                )
+                self.count += 1
+                return
+            if topic_id is None:
+                topic_id = self.topics[topic] = len(self.topics)
+                encoded = topic.encode()
+                self.file.write(
+                    TOPIC_RECORD + TOPIC_HEADER.pack(topic_id, len(encoded)) + encoded
+                )
+            self.file.write(
+                MESSAGE_RECORD
+                + MESSAGE_HEADER.pack(ts, topic_id, len(payload))
+                + payload
+            )
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_capture(path):
+    # Yields (timestamp, topic, payload) in recorded order
+    with open_capture(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a capture file: {path}")
+        topics = {}
+        while True:
+            kind = f.read(1)
+            if not kind:
+                return
+            if kind == TOPIC_RECORD:
+                header = read_header(f, TOPIC_HEADER)
+                if header is None:
+                    return
+                topic_id, length = header
+                topics[topic_id] = f.read(length).decode()
+            elif kind == MESSAGE_RECORD:
+                header = read_header(f, MESSAGE_HEADER)
+                if header is None:
+                    return
+                ts, topic_id, length = header
+                payload = f.read(length)
+                if len(payload) != length:
+                    return  # truncated by a crash, keep what we have
+                yield ts, topics[topic_id], payload
+            elif kind == INLINE_RECORD:
+                header = read_header(f, INLINE_HEADER)
+                if header is None:
+                    return
+                ts, topic_length, length = header
+                topic = f.read(topic_length)
+                payload = f.read(length)
+                if len(payload) != length:
+                    return
+                yield ts, topic.decode(), payload
+            else:
+                raise ValueError(f"Corrupt capture file: {path}")
+
+
+def read_header(f, header):
+    # None at a header cut short by a crash
+    data = f.read(header.size)
+    if len(data) != header.size:
+        return None
+    return header.unpack(data)
+
+
+class CaptureReplayer:
+    # Feeds a capture back through IngestQueue.push, exactly where broker
+    # callbacks deliver, keeping the recorded spacing divided by speed. A
+    # speed of 0 replays as fast as the consumer keeps up.
+    def __init__(
+        self, path, ingest_queue, speed=1.0, on_done=None, clock=time.monotonic
+    ):
+        self.path = path
+        self.ingest_queue = ingest_queue
+        self.speed = speed
+        self.on_done = on_done
+        self.clock = clock
+        self.stopping = threading.Event()
+        self.replayed = 0
+        self.elapsed = 0.0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="capture-replay")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        started = self.clock()
+        first_ts = None
+        # Never push past half the queue, so max speed does not turn into drops
+        high_water = self.ingest_queue.max_depth // 2
+        error = None
+        try:
+            for ts, topic, payload in read_capture(self.path):
+                if self.stopping.is_set():
+                    break
+                if first_ts is None:
+                    first_ts = ts
+                if self.speed:
+                    delay = (ts - first_ts) / self.speed - (self.clock() - started)
+                    if delay > 0 and self.stopping.wait(delay):
+                        break
+                if not self.wait_for_room(high_water):
+                    break
+                self.ingest_queue.push(topic, payload, time.time())
+                self.replayed += 1
+        except (OSError, ValueError) as e:
+            error = e
+        self.elapsed = self.clock() - started
+        if self.on_done:
+            self.on_done(self, error)
+
+    def wait_for_room(self, high_water):
+        # False when stopped while the queue was still above the mark
+        while self.ingest_queue.depth >= high_water:
+            if self.stopping.wait(0.001):
+                return False
+        return True
@@ -0,0 +1,191 @@
+import asyncio
+import time
+import zlib
+from publisher import PahoAckTracker
+
+# paho.mqtt.client.MQTT_ERR_NO_CONN, without importing paho at startup
+MQTT_ERR_NO_CONN = 4
+
+
+def default_client_factory(index):
+    import paho.mqtt.client as mqtt
+
+    return mqtt.Client()
+
+
+class ShardStats:
+    __slots__ = (
+        "published",
+        "published_bytes",
+        "received",
+        "received_bytes",
+        "errors",
+        "last_published",
+        "last_received",
+    )
+
+    def __init__(self):
+        self.published = 0
+        self.published_bytes = 0
+        self.received = 0
+        self.received_bytes = 0
+        self.errors = 0
+        self.last_published = 0
+        self.last_received = 0
+
+
+class ShardedClientPool:
+    # N paho clients, each with its own socket and network thread. Publishes
+    # are routed by a stable hash of the device ID. Subscriptions use
+    # $share/<group>/<topic> so the broker spreads incoming traffic over all
+    # shards; without shared subscriptions only shard 0 subscribes. Brokers
+    # do not send retained messages to shared subscriptions, so topics that
+    # rely on them are subscribed with shared=False, on shard 0 only.
+    def __init__(
+        self,
+        size=1,
+        client_factory=default_client_factory,
+        on_message=None,
+        on_connect=None,
+        on_disconnect=None,
+        shared_subscriptions=True,
+        share_group="bootcamp",
+        clock=time.monotonic,
+    ):
+        self.size = size
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.shared_subscriptions = shared_subscriptions
+        self.share_group = share_group
+        self.clock = clock
+
+        self.clients = []
+        self.acks = []
+        self.stats = []
+        for index in range(size):
+            client = client_factory(index)
+            client.user_data_set(index)
+            acks = PahoAckTracker()
+            client.on_publish = acks.on_publish
+            client.on_message = self.handle_message
+            client.on_connect = self.handle_connect
+            client.on_disconnect = self.handle_disconnect
+            self.clients.append(client)
+            self.acks.append(acks)
+            self.stats.append(ShardStats())
+        self.subscriptions = {}  # topic -> (qos, shared)
+        self.last_stats_time = self.clock()
+
+    def shard_for(self, key):
+        # crc32 is stable across runs, unlike hash() on str
+        if key is None or self.size == 1:
+            return 0
+        return zlib.crc32(key.encode()) % self.size
+
+    def connect(self, host, port, keepalive=60):
+        for client in self.clients:
+            client.connect(host, port, keepalive)
+            client.loop_start()
+
+    async def connect_async(self, host, port, keepalive=60):
+        # For AsyncioMqttClient shards: the CONNACK return code of each
+        return await asyncio.gather(
+            *(client.connect_async(host, port, keepalive) for client in self.clients)
+        )
+
+    def disconnect(self):
+        for client, acks in zip(self.clients, self.acks):
+            client.loop_stop()
+            client.disconnect()
+            acks.fail_all("disconnected")
+
+    def is_shared(self, shared):
+        return shared and self.size > 1 and self.shared_subscriptions
+
+    def subscription_topic(self, topic, shared=True):
+        if self.is_shared(shared):
+            return f"$share/{self.share_group}/{topic}"
+        return topic
+
+    def subscribed_clients(self, shared=True):
+        if self.is_shared(shared):
+            return self.clients
+        return self.clients[:1]
+
+    def subscribe(self, topic, qos=0, shared=True):
+        self.subscriptions[topic] = (qos, shared)
+        for client in self.subscribed_clients(shared):
+            client.subscribe(self.subscription_topic(topic, shared), qos)
+
+    async def subscribe_async(self, topic, qos=0, shared=True):
+        # subscribe() that returns once every shard got its SUBACK
+        self.subscriptions[topic] = (qos, shared)
+        await asyncio.gather(
+            *(
+                client.subscribe_async(self.subscription_topic(topic, shared), qos)
+                for client in self.subscribed_clients(shared)
+            )
+        )
+
+    def unsubscribe(self, topic):
+        qos, shared = self.subscriptions.pop(topic, (0, True))
+        for client in self.subscribed_clients(shared):
+            client.unsubscribe(self.subscription_topic(topic, shared))
+
+    def publish(self, key, topic, payload, qos, done):
+        shard = self.shard_for(key)
+        info = self.clients[shard].publish(topic, payload, qos=qos)
+        stats = self.stats[shard]
+        # While disconnected paho keeps QoS 1 and 2 messages and sends them
+        # after the reconnect, so those wait for their ack like any other
+        if info.rc != 0 and not (info.rc == MQTT_ERR_NO_CONN and qos > 0):
+            stats.errors += 1
+            done(info.rc)
+            return
+        stats.published += 1
+        stats.published_bytes += len(payload)
+        self.acks[shard].register(info.mid, done)
+
+    def handle_connect(self, client, shard, flags, rc):
+        if rc == 0:
+            # Subscriptions made before this shard (re)connected
+            for topic, (qos, shared) in self.subscriptions.items():
+                if client in self.subscribed_clients(shared):
+                    client.subscribe(self.subscription_topic(topic, shared), qos)
+        if self.on_connect:
+            self.on_connect(shard, rc)
+
+    def handle_disconnect(self, client, shard, rc):
+        if self.on_disconnect:
+            self.on_disconnect(shard, rc)
+
+    def handle_message(self, client, shard, msg):
+        stats = self.stats[shard]
+        stats.received += 1
+        stats.received_bytes += len(msg.payload)
+        if self.on_message:
+            self.on_message(client, shard, msg)
+
+    def throughput(self):
+        # Per-shard message rates since the previous call
+        now = self.clock()
+        elapsed = max(now - self.last_stats_time, 1e-9)
+        self.last_stats_time = now
+        shards = []
+        for index, stats in enumerate(self.stats):
+            shards.append(
+                {
+                    "shard": index,
+                    "published": stats.published,
+                    "received": stats.received,
+                    "published_bytes": stats.published_bytes,
+                    "received_bytes": stats.received_bytes,
+                    "errors": stats.errors,
+                    "publish_rate": (stats.published - stats.last_published) / elapsed,
+                    "receive_rate": (stats.received - stats.last_received) / elapsed,
+                }
+            )
+            stats.last_published = stats.published
+            stats.last_received = stats.received
+        return shards
@@ -0,0 +1,217 @@
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+CONTROLLER_NAME = "MQTT_master"
+BROADCAST_DEVICE = "ALL"
+DEFAULT_FORMAT = "json"
+
+# Group commands go to "device": GROUP_DEVICE, which older firmware ignores,
+# and name their targets in "mask" or "devices". The sketch's MQTT buffer
+# and JSON document are sized for these limits.
+GROUP_DEVICE = "GROUP"
+MASK_PREFIX = "ESP32-"
+MAX_GROUP_PAYLOAD = 1024
+MAX_GROUP_DEVICES = 64
+
+
+def available_formats():
+    formats = ["json"]
+    if msgpack is not None:
+        formats.append("msgpack")
+    if cbor2 is not None:
+        formats.append("cbor")
+    return formats
+
+
+def build_command(device, action, command_id=None):
+    command = {
+        "type": "control",
+        "controller": CONTROLLER_NAME,
+        "device": device,
+        "status": "connected",  # assuming 'connected' is the intended status
+        "message": action,
+    }
+    if command_id is not None:
+        # Correlation ID, echoed back by the firmware in its reply
+        command["id"] = command_id
+    return command
+
+
+def build_group_command(group, action, devices=None, mask=None, command_id=None):
+    command = build_command(GROUP_DEVICE, action)
+    command["group"] = group
+    if mask is not None:
+        command["mask"] = mask
+    else:
+        command["devices"] = devices
+    if command_id is not None:
+        command["id"] = command_id
+    return command
+
+
+def device_mask(devices, prefix=MASK_PREFIX):
+    # Hex bitmask with bit n - 1 set for <prefix>n, None when a name does
+    # not follow that pattern
+    mask = 0
+    for device in devices:
+        number = device[len(prefix) :]
+        if not device.startswith(prefix) or not number.isdigit() or number[0] == "0":
+            return None
+        mask |= 1 << (int(number) - 1)
+    return format(mask, "x")
+
+
+def serialize(command, wire_format):
+    if wire_format == "msgpack":
+        return msgpack.packb(command)
+    if wire_format == "cbor":
+        return cbor2.dumps(command)
+    return json.dumps(command).encode()
+
+
+# Unsigned integer headers by size: (limit, prefix, struct format). Values
+# below the first limit fit in the header byte itself.
+MSGPACK_UINTS = ((0x80, 0x00, ""), (1 << 8, 0xCC, ">B"), (1 << 16, 0xCD, ">H"))
+MSGPACK_UINTS += ((1 << 32, 0xCE, ">I"), (1 << 64, 0xCF, ">Q"))
+CBOR_UINTS = ((24, 0x00, ""), (1 << 8, 0x18, ">B"), (1 << 16, 0x19, ">H"))
+CBOR_UINTS += ((1 << 32, 0x1A, ">I"), (1 << 64, 0x1B, ">Q"))
+# "id" as a MessagePack fixstr and a CBOR text string
+MSGPACK_ID_KEY = b"\xa2id"
+CBOR_ID_KEY = b"\x62id"
+
+
+def pack_uint(value, sizes):
+    for limit, prefix, fmt in sizes:
+        if value < limit:
+            if not fmt:
+                return bytes((prefix + value,))
+            return bytes((prefix,)) + struct.pack(fmt, value)
+    raise ValueError(f"Command ID out of range: {value}")
+
+
+def splice_id(payload, wire_format, command_id):
+    # Adds "id" to a serialized command map without decoding it. Commands
+    # have five keys, so the map header is one byte in every format: JSON
+    # ends in "}", MessagePack fixmaps are 0x80 + n and CBOR maps 0xa0 + n.
+    if wire_format == "json":
+        return b'%s, "id": %d}' % (payload[:-1], command_id)
+    if wire_format == "msgpack":
+        key, value = MSGPACK_ID_KEY, pack_uint(command_id, MSGPACK_UINTS)
+    else:
+        key, value = CBOR_ID_KEY, pack_uint(command_id, CBOR_UINTS)
+    return bytes((payload[0] + 1,)) + payload[1:] + key + value
+
+
+class CommandEncoder:
+    # Command payloads only depend on (device, action, format), so each one
+    # is serialized once and served from the cache afterwards.
+    def __init__(self):
+        self.cache = {}
+        self.device_formats = {}
+        self.hits = 0
+        self.misses = 0
+
+    def negotiate(self, device, supported_formats):
+        # Pick the most compact format both sides understand
+        ours = available_formats()
+        for wire_format in ("msgpack", "cbor", "json"):
+            if wire_format in ours and wire_format in supported_formats:
+                self.set_device_format(device, wire_format)
+                return wire_format
+        self.set_device_format(device, DEFAULT_FORMAT)
+        return DEFAULT_FORMAT
+
+    def set_device_format(self, device, wire_format):
+        if wire_format not in available_formats():
+            raise ValueError(f"Wire format not available: {wire_format}")
+        self.device_formats[device] = wire_format
+
+    def format_for(self, device):
+        # Broadcasts must be readable by every device, so they stay JSON
+        if device == BROADCAST_DEVICE:
+            return DEFAULT_FORMAT
+        return self.device_formats.get(device, DEFAULT_FORMAT)
+
+    def encode(self, device, action, command_id=None):
+        wire_format = self.format_for(device)
+        key = (device, action, wire_format)
+        payload = self.cache.get(key)
+        if payload is None:
+            self.misses += 1
+            payload = self.cache[key] = serialize(
+                build_command(device, action), wire_format
+            )
+        else:
+            self.hits += 1
+        if command_id is None:
+            return payload
+        # The cached payload gets the ID spliced in instead of re-serializing
+        return splice_id(payload, wire_format, command_id)
+
+    def encode_group(
+        self,
+        group,
+        devices,
+        action,
+        command_id=None,
+        max_payload=MAX_GROUP_PAYLOAD,
+        max_devices=MAX_GROUP_DEVICES,
+    ):
+        # Fewest payloads that address all devices: one bitmask when every
+        # name is ESP32-<n> and the mask fits, device lists split by size
+        # otherwise. Returns [(payload, devices)]. Every device reads these,
+        # so they are JSON, and all of them share the one correlation ID.
+        devices = list(dict.fromkeys(devices))
+        if not devices:
+            return []
+        mask = device_mask(devices)
+        if mask is not None:
+            payload = serialize(
+                build_group_command(group, action, mask=mask, command_id=command_id),
+                DEFAULT_FORMAT,
+            )
+            if len(payload) <= max_payload:
+                return [(payload, devices)]
+
+        empty = len(
+            serialize(
+                build_group_command(group, action, [], command_id=command_id),
+                DEFAULT_FORMAT,
+            )
+        )
+        chunks = []
+        chunk = []
+        size = empty
+        for device in devices:
+            # Quotes, comma and space around each name
+            length = len(json.dumps(device)) + 2
+            if chunk and (size + length > max_payload or len(chunk) >= max_devices):
+                chunks.append(chunk)
+                chunk = []
+                size = empty
+            chunk.append(device)
+            size += length
+        chunks.append(chunk)
+        return [
+            (
+                serialize(
+                    build_group_command(group, action, chunk, command_id=command_id),
+                    DEFAULT_FORMAT,
+                ),
+                chunk,
+            )
+            for chunk in chunks
+        ]
+
+    def clear(self):
+        self.cache.clear()
@@ -1,4 +1,5 @@
 from PyQt5.QtCore import QTimer, QObject, pyqtSlot
+from groups import GROUP_COMMAND_TIMEOUT
 
 
 class MQTTController(QObject):
@@ -14,20 +15,35 @@ class MQTTController(QObject):
         # Connect the timer to the schedule_status_request method
         self.timer.timeout.connect(self.schedule_status_request)
 
+        # Round-trip figures are refreshed in batches, not on every reply
+        self.round_trip_devices = set()
+        self.round_trip_timer = QTimer(self.view)
+        self.round_trip_timer.setSingleShot(True)
+        self.round_trip_timer.setInterval(500)
+        self.round_trip_timer.timeout.connect(self.refresh_round_trips)
+
         # Connect model signals to slots
         self.model.message_received.connect(self.on_message_received)
         self.model.connection_status_changed.connect(self.on_connection_status_changed)
+        self.model.log_event.connect(self.log_message)
+
+        # View > Statistics shows the engine's metrics registry
+        self.view.setup_stats_panel(self.model.metrics)
+
+        # Groups > ... sends to the groups and scenes the engine knows
+        self.update_groups_menu()
+
+        # Show the known devices before the first report arrives
+        for device, info in self.model.devices.items():
+            self.view.update_device_status(device, info["status"], info["state"])
 
     def control_mqtt(self, action):
-        print("Action on control mqtt", action)
         if action == "ON":
             if self.view.local_radioButton.isChecked():
-                print("Local entry")
                 server = self.view.mqtt_server_input.text()
                 port = self.view.mqtt_port_input.text()
 
                 if server and port:
-                    print("I am here control_mqtt")
                     result_connect = self.model.connect_local(server, port)
                     if result_connect == 100:
                         self.view.button_states["mqtt_connection"] = "ON"
@@ -36,29 +52,21 @@ class MQTTController(QObject):
                         self.view.button_states["mqtt_connection"] = "OFF"
                         self.update_mqtt_connection_button("OFF")
                 else:
-                    print("I am here control_mqtt no inputs")
                     self.log_message(
                         "MQTT server IP or port is required to establish the connection"
                     )
                     self.view.button_states["mqtt_connection"] = "OFF"
                     self.update_mqtt_connection_button("OFF")
             if self.view.aws_radioButton.isChecked():
-                print("AWS entry")
                 server = self.view.mqtt_server_input.text()
                 port = self.view.mqtt_port_input.text()
                 client_id = self.view.client_id_input.text()
 
                 if server and port and client_id:
-                    print("Pass first if")
-                    result_connect = self.model.connect_aws(server, port, client_id)
-                    if result_connect == 100:
-                        self.view.button_states["mqtt_connection"] = "ON"
-                        self.update_mqtt_connection_button("ON")
-                    else:  # Covers result_connect == 50 and any other return code
-                        self.view.button_states["mqtt_connection"] = "OFF"
-                        self.update_mqtt_connection_button("OFF")
+                    # The button follows connection_status_changed from here on
+                    self.view.button_states["mqtt_connection"] = "ON"
+                    self.model.connect_aws(server, port, client_id)
                 else:
-                    print("I am here control_mqtt no inputs")
                     self.log_message(
                         "MQTT server IP or port or client id is required to establish the connection"
                     )
@@ -72,18 +80,15 @@ class MQTTController(QObject):
 
             if self.view.aws_radioButton.isChecked():
                 self.model.disconnect_aws()
-                self.view.button_states["mqtt_connection"] = "OFF"
-                self.update_mqtt_connection_button("OFF")
 
     def update_mqtt_connection_button(self, state):
         self.view.update_button_state(self.view.mqtt_connection_pushButton, state)
 
     def log_message(self, message):
-        print(" I am log message")
         self.view.log_message(message)
 
-    def update_topic_log(self, message, topic_type):
-        self.view.update_topic_log(message, topic_type)
+    def update_topic_log(self, message, topic_type, topic=None):
+        self.view.update_topic_log(message, topic_type, topic)
 
     def update_publish_topic(self, topic):
         if self.view.local_radioButton.isChecked():
@@ -94,12 +99,17 @@ class MQTTController(QObject):
             self.log_message(f"Publish to topic on AWS: {topic}")
 
     def update_subscribe_topic(self, topic):
-        if self.view.local_radioButton.isChecked():
-            self.model.set_subscribe_topic_local(topic)
-            self.log_message(f"Subscribed to topic on local: {topic}")
-        else:
-            self.model.set_subscribe_topic_aws(topic)
-            self.log_message(f"Subscribed to topic on AWS: {topic}")
+        # Several filters can be given separated by commas, "+" and "#" work
+        topics = [t.strip() for t in topic.split(",") if t.strip()]
+        try:
+            if self.view.local_radioButton.isChecked():
+                self.model.set_subscribe_topics_local(topics)
+                self.log_message(f"Subscribed to topic on local: {', '.join(topics)}")
+            else:
+                self.model.set_subscribe_topics_aws(topics)
+                self.log_message(f"Subscribed to topic on AWS: {', '.join(topics)}")
+        except ValueError as e:
+            self.log_message(f"Error: {e}")
 
     def send_message(self, message):
         if self.view.local_radioButton.isChecked():
@@ -107,17 +117,21 @@ class MQTTController(QObject):
         else:
             self.model.publish_message_aws(message)
 
-    def schedule_status_request(self):
-        json_message = self.model.control_master("status")
+    def select_transport(self):
         if self.view.local_radioButton.isChecked():
-            self.model.publish_message_local(json_message)
+            self.model.engine.transport = "local"
         else:
-            self.model.publish_message_aws(json_message)
-        self.model.check_device_timeouts()  # Check for device timeouts
+            self.model.engine.transport = "aws"
+
+    def schedule_status_request(self):
+        self.select_transport()
+        # Targeted status requests, then check for device timeouts
+        self.model.run_status_cycle()
 
     def start_status_request(self):
         self.schedule_status_request()
-        self.timer.start(5000)  # Schedule next status request after 5 seconds
+        # Short ticks let the poller spread requests over its interval
+        self.timer.start(int(self.model.status_poller.tick * 1000))
 
     def stop_status_request(self):
         self.timer.stop()
@@ -131,28 +145,77 @@ class MQTTController(QObject):
         self.view.update_button_state(self.view.task_schedule_pushButton, action)
 
     def on_message_received(self, topic, message):
-        self.update_topic_log(message, "subscribed")
-        self.model.update_device_status(topic, message)
+        # The engine already updated the devices, only the log is left
+        self.update_topic_log(message, "subscribed", topic)
 
     def on_connection_status_changed(self, status):
-        if status == "Connected":
-            self.update_mqtt_connection_button("ON")
-        else:
+        # Connecting and Reconnecting keep the button ON so a click cancels them
+        if status in ("Disconnected", "Failed"):
+            self.view.button_states["mqtt_connection"] = "OFF"
             self.update_mqtt_connection_button("OFF")
+        else:
+            self.view.button_states["mqtt_connection"] = "ON"
+            self.update_mqtt_connection_button("ON")
+
+    def publisher_stats(self):
+        return self.model.publisher_stats()
 
     def update_device_status(self, device, status, state):
         self.view.update_device_status(device, status, state)
 
+    def update_round_trip(self, device, latency):
+        self.round_trip_devices.add(device)
+        if not self.round_trip_timer.isActive():
+            self.round_trip_timer.start()
+
+    def refresh_round_trips(self):
+        round_trips = self.model.round_trips
+        for device in self.round_trip_devices:
+            self.view.update_round_trip(device, round_trips.device_summary(device))
+        self.round_trip_devices.clear()
+        self.view.update_fleet_round_trip(round_trips.stats())
+
     def control_master(self, action):
-        json_message = self.model.control_master(action)
-        if self.view.local_radioButton.isChecked():
-            self.model.publish_message_local(json_message)
-        else:
-            self.model.publish_message_aws(json_message)
+        self.select_transport()
+        self.model.send_control("ALL", action)
 
     def control_device(self, device, action):
-        json_message = self.model.control_device(device, action)
-        if self.view.local_radioButton.isChecked():
-            self.model.publish_message_local(json_message)
-        else:
-            self.model.publish_message_aws(json_message)
+        self.select_transport()
+        self.model.send_control(device, action)
+
+    def control_devices(self, devices, action):
+        # One group command for the selected rows, not one publish each
+        if len(devices) == 1:
+            self.control_device(devices[0], action)
+            return
+        self.select_transport()
+        self.model.send_devices(devices, action)
+        self.expire_group_commands_later()
+
+    def control_group(self, group, action):
+        self.select_transport()
+        self.model.send_group(group, action)
+        self.expire_group_commands_later()
+
+    def apply_scene(self, scene):
+        self.select_transport()
+        self.model.apply_scene(scene)
+        self.expire_group_commands_later()
+
+    def expire_group_commands_later(self):
+        # Unanswered members are reported even with the schedule stopped
+        timeout_ms = int(GROUP_COMMAND_TIMEOUT * 1000) + 100
+        QTimer.singleShot(timeout_ms, self.model.expire_group_commands)
+
+    def define_group(self, name, devices):
+        self.model.define_group(name, devices)
+        self.log_message(f"Group {name}: {', '.join(devices)}")
+        self.update_groups_menu()
+
+    def remove_group(self, name):
+        self.model.remove_group(name)
+        self.update_groups_menu()
+
+    def update_groups_menu(self):
+        groups = self.model.groups
+        self.view.update_groups_menu(groups.groups, groups.scenes)
@@ -0,0 +1,139 @@
+import json
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Frames sent by the 4_MQTT_Strip_light firmware, e.g.
+# {"type": "com", "device": "ESP32-1", "status": "Connected",
+#  "state": "ON", "message": "state has changed"}
+# Replies to a command also echo its correlation ID as "id", status replies
+# list the command payload formats the firmware reads as "formats".
+if msgspec is not None:
+    from typing import List, Optional
+
+    class DeviceReport(msgspec.Struct):
+        device: str
+        status: str
+        state: str
+        type: str = ""
+        message: str = ""
+        id: Optional[int] = None
+        formats: Optional[List[str]] = None
+
+else:
+
+    class DeviceReport:
+        __slots__ = ("device", "status", "state", "type", "message", "id", "formats")
+
+        def __init__(
+            self, device, status, state, type="", message="", id=None, formats=None
+        ):
+            self.device = device
+            self.status = status
+            self.state = state
+            self.type = type
+            self.message = message
+            self.id = id
+            self.formats = formats
+
+        def __repr__(self):
+            return (
+                f"DeviceReport(device={self.device!r}, status={self.status!r}, "
+                f"state={self.state!r}, type={self.type!r}, message={self.message!r}, "
+                f"id={self.id!r}, formats={self.formats!r})"
+            )
+
+
+BACKENDS = ("msgspec", "orjson", "json")
+
+
+def available_backends():
+    available = []
+    if msgspec is not None:
+        available.append("msgspec")
+    if orjson is not None:
+        available.append("orjson")
+    available.append("json")
+    return available
+
+
+class PayloadDecoder:
+    # Decodes raw payload bytes straight into DeviceReport. Frames that do
+    # not match the schema are counted and returned as None.
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = available_backends()[0]
+        if backend not in available_backends():
+            raise ValueError(f"Decoder backend not available: {backend}")
+        self.backend = backend
+        self.decoded = 0
+        self.invalid = 0
+
+        if backend == "msgspec":
+            self.decode_frame = self.decode_msgspec
+            self.typed_decoder = msgspec.json.Decoder(DeviceReport)
+        elif backend == "orjson":
+            self.decode_frame = self.decode_mapping
+            self.loads = orjson.loads
+        else:
+            self.decode_frame = self.decode_mapping
+            self.loads = json.loads
+
+    def decode(self, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        report = self.decode_frame(payload)
+        if report is None or not (report.device and report.status and report.state):
+            self.invalid += 1
+            return None
+        self.decoded += 1
+        return report
+
+    def decode_msgspec(self, payload):
+        try:
+            return self.typed_decoder.decode(payload)
+        except msgspec.MsgspecError:
+            return None
+
+    def decode_mapping(self, payload):
+        # Only malformed JSON raises here, schema checks are plain tests
+        try:
+            frame = self.loads(payload)
+        except ValueError:
+            return None
+        if type(frame) is not dict:
+            return None
+        device = frame.get("device")
+        status = frame.get("status")
+        state = frame.get("state")
+        if type(device) is not str or type(status) is not str or type(state) is not str:
+            return None
+        frame_type = frame.get("type", "")
+        message = frame.get("message", "")
+        command_id = frame.get("id")
+        formats = frame.get("formats")
+        if type(formats) is not list or not all(type(f) is str for f in formats):
+            formats = None
+        return DeviceReport(
+            device,
+            status,
+            state,
+            frame_type if type(frame_type) is str else "",
+            message if type(message) is str else "",
+            command_id if type(command_id) is int else None,
+            formats,
+        )
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "decoded": self.decoded,
+            "invalid": self.invalid,
+        }
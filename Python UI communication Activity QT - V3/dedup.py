@@ -0,0 +1,56 @@
+import collections
+import threading
+import time
+
+
+class DedupCache:
+    # Remembers a fingerprint of every message seen in the last window
+    # seconds, at most capacity of them, oldest evicted first. Only messages
+    # the broker marks as redelivered (DUP) or replays as retained are
+    # dropped when their fingerprint is known; a device legitimately sending
+    # the same report twice still gets through.
+    def __init__(self, capacity=8192, window=60.0, clock=time.monotonic):
+        self.capacity = capacity
+        self.window = window
+        self.clock = clock
+        self.entries = collections.OrderedDict()  # fingerprint -> first seen
+        self.lock = threading.Lock()  # called from every shard's thread
+        self.checked = 0
+        self.flagged = 0
+        self.hits = 0
+
+    def is_duplicate(self, topic, payload, dup=False, retain=False):
+        key = hash((topic, payload))
+        now = self.clock()
+        with self.lock:
+            self.checked += 1
+            if dup or retain:
+                self.flagged += 1
+                seen = self.entries.get(key)
+                if seen is not None and now - seen <= self.window:
+                    self.hits += 1
+                    return True
+            self.entries[key] = now
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            # Entries are in insertion time order
+            horizon = now - self.window
+            while self.entries:
+                oldest = next(iter(self.entries.values()))
+                if oldest >= horizon:
+                    break
+                self.entries.popitem(last=False)
+        return False
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "checked": self.checked,
+            "flagged": self.flagged,
+            "hits": self.hits,
+        }
@@ -0,0 +1,173 @@
+import time
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer
+from PyQt5.QtGui import QColor
+
+COLUMNS = ("Device", "Status", "Light", "Round trip")
+DEVICE_COLUMN = 0
+STATUS_COLUMN = 1
+LIGHT_COLUMN = 2
+ROUND_TRIP_COLUMN = 3
+
+STATUS_COLORS = {"Connected": QColor("green")}
+DISCONNECTED_COLOR = QColor("red")
+LIGHT_COLORS = {
+    "ON": (QColor("cyan"), QColor("black")),
+    "OFF": (QColor("red"), QColor("white")),
+}
+
+
+class DeviceTableModel(QAbstractTableModel):
+    def __init__(self, flush_interval_ms=16):
+        super().__init__()
+        self.rows = []  # [device, status, state]
+        self.row_of = {}  # device -> row
+        self.pending_rows = []
+        self.dirty_rows = set()
+        self.round_trips = {}  # device -> RoundTripTracker.device_summary()
+        self.skipped = 0
+        self.metrics = None  # see instrument()
+
+        # Updates are applied immediately but announced to the view in
+        # batches, at most once per frame
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(flush_interval_ms)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def update_device(self, device, status, state):
+        row = self.row_of.get(device)
+        if row is None:
+            self.row_of[device] = len(self.rows) + len(self.pending_rows)
+            self.pending_rows.append([device, status, state])
+        elif row >= len(self.rows):
+            self.pending_rows[row - len(self.rows)][1:] = [status, state]
+        else:
+            values = self.rows[row]
+            # Periodic reports mostly repeat what is already shown
+            if values[1] == status and values[2] == state:
+                self.skipped += 1
+                return
+            values[1:] = [status, state]
+            self.dirty_rows.add(row)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def update_round_trip(self, device, summary):
+        previous = self.round_trips.get(device)
+        self.round_trips[device] = summary
+        if previous is not None and self.round_trip_text(
+            previous
+        ) == self.round_trip_text(summary):
+            self.skipped += 1
+            return
+        row = self.row_of.get(device)
+        if row is not None and row < len(self.rows):
+            self.dirty_rows.add(row)
+            if not self.flush_timer.isActive():
+                self.flush_timer.start()
+
+    def instrument(self, metrics):
+        self.metrics = metrics
+        self.flush_seconds = metrics.histogram(
+            "mqtt_ui_table_flush_seconds",
+            "Announcing a batch of device rows to the table view",
+        )
+
+    def flush(self):
+        # At most one flush per frame, cheap enough to time every one
+        if self.metrics is None or not self.metrics.enabled:
+            self.flush_rows()
+            return
+        started = time.perf_counter()
+        self.flush_rows()
+        self.flush_seconds.observe(time.perf_counter() - started)
+
+    def flush_rows(self):
+        if self.pending_rows:
+            first = len(self.rows)
+            self.beginInsertRows(
+                QModelIndex(), first, first + len(self.pending_rows) - 1
+            )
+            self.rows.extend(self.pending_rows)
+            self.pending_rows = []
+            self.endInsertRows()
+
+        if self.dirty_rows:
+            # Emit one dataChanged per contiguous run of dirty rows
+            dirty = sorted(self.dirty_rows)
+            self.dirty_rows = set()
+            last_column = len(COLUMNS) - 1
+            start = previous = dirty[0]
+            for row in dirty[1:] + [None]:
+                if row is not None and row == previous + 1:
+                    previous = row
+                    continue
+                self.dataChanged.emit(
+                    self.index(start, 0), self.index(previous, last_column)
+                )
+                if row is not None:
+                    start = previous = row
+
+    @staticmethod
+    def round_trip_text(summary):
+        if not summary or not summary["count"]:
+            return ""
+        return f"{summary['p50'] * 1000:.0f} / {summary['p99'] * 1000:.0f} ms"
+
+    def state_of(self, device):
+        row = self.row_of.get(device)
+        if row is None:
+            return "OFF"
+        if row >= len(self.rows):
+            return self.pending_rows[row - len(self.rows)][2]
+        return self.rows[row][2]
+
+    def device_at(self, row):
+        return self.rows[row][0]
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        device, status, state = self.rows[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == DEVICE_COLUMN:
+                return device
+            if column == STATUS_COLUMN:
+                return status
+            if column == ROUND_TRIP_COLUMN:
+                return self.round_trip_text(self.round_trips.get(device))
+            return state
+        if role == Qt.ToolTipRole and column == ROUND_TRIP_COLUMN:
+            summary = self.round_trips.get(device)
+            if not summary or not summary["count"]:
+                return None
+            return (
+                f"p50 / p99 of {summary['count']} replies\n"
+                f"min {summary['min'] * 1000:.1f} ms, max {summary['max'] * 1000:.1f} ms\n"
+                f"{summary['lost']} commands without reply"
+            )
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        if column == STATUS_COLUMN and role == Qt.ForegroundRole:
+            return STATUS_COLORS.get(status, DISCONNECTED_COLOR)
+        if column == LIGHT_COLUMN and role == Qt.BackgroundRole:
+            return LIGHT_COLORS.get(state, LIGHT_COLORS["OFF"])[0]
+        if column == LIGHT_COLUMN and role == Qt.ForegroundRole:
+            return LIGHT_COLORS.get(state, LIGHT_COLORS["OFF"])[1]
+        return None
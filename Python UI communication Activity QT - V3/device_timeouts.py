@@ -0,0 +1,86 @@
+import time
+
+
+class ExpiryWheel:
+    # Hashed timing wheel keyed on absolute tick number. A device lives in
+    # exactly one slot, so refreshing it is O(1) and expire() only visits
+    # the slots that elapsed since the previous call.
+    def __init__(self, default_timeout=10.0, tick=1.0, clock=time.monotonic):
+        self.default_timeout = default_timeout
+        self.tick = tick
+        self.clock = clock
+        self.slots = {}  # tick number -> set of devices
+        self.slot_of = {}  # device -> tick number
+        self.device_timeouts = {}
+        self.group_timeouts = {}
+        self.group_of = {}
+        self.next_slot = int(self.clock() // self.tick)
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self, device):
+        return device in self.slot_of
+
+    def set_timeout(self, device, seconds):
+        self.device_timeouts[device] = seconds
+
+    def set_group_timeout(self, group, seconds):
+        self.group_timeouts[group] = seconds
+
+    def assign_group(self, device, group):
+        self.group_of[device] = group
+
+    def timeout_for(self, device):
+        timeout = self.device_timeouts.get(device)
+        if timeout is None:
+            group = self.group_of.get(device)
+            timeout = self.group_timeouts.get(group, self.default_timeout)
+        return timeout
+
+    def touch(self, device, now=None):
+        if now is None:
+            now = self.clock()
+        # Slot t holds deadlines in [t * tick, (t + 1) * tick)
+        slot = max(int((now + self.timeout_for(device)) // self.tick), self.next_slot)
+        old_slot = self.slot_of.get(device)
+        if old_slot == slot:
+            return
+        if old_slot is not None:
+            self.discard_from_slot(device, old_slot)
+        self.slot_of[device] = slot
+        self.slots.setdefault(slot, set()).add(device)
+
+    def remove(self, device):
+        slot = self.slot_of.pop(device, None)
+        if slot is not None:
+            self.discard_from_slot(device, slot)
+
+    def discard_from_slot(self, device, slot):
+        devices = self.slots[slot]
+        devices.discard(device)
+        if not devices:
+            del self.slots[slot]
+
+    def expire(self, now=None):
+        if now is None:
+            now = self.clock()
+        # A slot is due once its whole deadline range lies in the past
+        end_slot = int(now // self.tick)
+        if end_slot <= self.next_slot:
+            return []
+
+        if end_slot - self.next_slot > len(self.slots):
+            due = [slot for slot in self.slots if slot < end_slot]
+        else:
+            due = [
+                slot for slot in range(self.next_slot, end_slot) if slot in self.slots
+            ]
+        self.next_slot = end_slot
+
+        expired = []
+        for slot in due:
+            for device in self.slots.pop(slot):
+                del self.slot_of[device]
+                expired.append(device)
+        return expired
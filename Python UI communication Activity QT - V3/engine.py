@@ -0,0 +1,1041 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from aws_connection import AwsConnectionManager, CONNECTED, RESUBSCRIBE_REJECTED
+from publisher import OutboundPublisher, BLOCK, DROP_OLDEST
+from client_pool import ShardedClientPool, default_client_factory
+from status_poller import StatusPoller
+from ingest import IngestQueue
+from device_timeouts import ExpiryWheel
+from decoder import PayloadDecoder
+from commands import CommandEncoder
+from groups import DeviceGroups, GroupAckTracker
+from latency import RoundTripTracker
+from telemetry import TelemetryStore, INBOUND, OUTBOUND
+from capture import CaptureWriter, CaptureReplayer
+from topic_router import TopicRouter
+from dedup import DedupCache
+from metrics import MetricsRegistry
+from outbox import StoreAndForward
+
+
+class MQTTEngine:
+    # Connections, ingest, device registry and commands without any Qt.
+    # Frontends subscribe to events with on(event, callback):
+    #   "wakeup" ()                      ingest queue has data, may fire on
+    #                                    broker threads
+    #   "log" (message)                  may fire on broker threads
+    #   "connection_status" (status)     may fire on broker threads
+    #   "message" (topic, payload)       incoming message, from process_ingest
+    #   "publish" (topic, payload)       outgoing message
+    #   "device" (device, status, state) device row changed
+    #   "round_trip" (device, seconds)   reply matched to its command
+    #   "group_done" (name, summary)     group or scene command answered by
+    #                                    every member, or timed out
+    def __init__(
+        self,
+        local_pool_size=1,
+        local_client_factory=None,
+        telemetry_path=None,
+        metrics_enabled=True,
+        metrics_sample_every=64,
+        asyncio_loop=None,
+        groups_path=None,
+        outbox_path=None,
+        outbox_drain_rate=50.0,
+        publish_policy=DROP_OLDEST,
+    ):
+        self.listeners = defaultdict(list)
+
+        # Counters and sampled stage timings, see register_metrics
+        self.metrics = MetricsRegistry(metrics_enabled, metrics_sample_every)
+        self.device_updates = 0
+
+        # Broker callbacks only enqueue raw messages, the frontend drains them
+        self.ingest_batch_size = 500
+        self.ingest_queue = IngestQueue(max_depth=50000, on_ready=self.on_ingest_ready)
+
+        # QoS 1 redeliveries after a reconnect are dropped before decoding
+        self.dedup = DedupCache(capacity=8192, window=60.0)
+
+        # Local MQTT broker configuration
+        self.local_server = None
+        self.local_port = None
+        self.publish_topic = ""
+        self.local_subscriptions = {}  # topic filter -> handler
+
+        # One or more client connections, devices are sharded across them.
+        # Created on first use so paho is not imported for AWS-only sessions.
+        self.local_pool_size = local_pool_size
+        if local_client_factory is None and asyncio_loop is not None:
+            # paho driven by the event loop, callbacks on the loop's thread
+            from async_transport import asyncio_client_factory
+
+            local_client_factory = asyncio_client_factory(asyncio_loop)
+        self.local_client_factory = local_client_factory or default_client_factory
+        self.asyncio_loop = asyncio_loop
+        self._local_pool = None
+
+        # Outbound publishes go through a bounded queue with an in-flight window
+        self.local_publish_qos = 1
+        self.local_publisher = OutboundPublisher(
+            self.send_local,
+            window=32,
+            policy=publish_policy,
+            on_ack=lambda latency: self.observe_publish_ack("local", latency),
+            on_drop=self.on_command_drop,
+        )
+
+        # AWS IoT Core configuration
+        self.aws_endpoint = ""
+        self.aws_port = 0
+        self.aws_cert_filepath = r"connect_device_package/device-certificate.pem.crt"
+        self.aws_pri_key_filepath = r"connect_device_package/key-private.pem.key"
+        self.aws_ca_filepath = r"connect_device_package/AmazonRootCA1.pem"
+        self.aws_client_id = "device_2"
+        self.aws_publish_topic = ""
+        self.aws_subscriptions = {}  # topic filter -> handler
+
+        # AWS connection runs asynchronously and reconnects with backoff
+        self.aws_manager = AwsConnectionManager(on_status=self.on_aws_status)
+        self.aws_publisher = OutboundPublisher(
+            self.send_aws,
+            window=32,
+            policy=publish_policy,
+            on_ack=lambda latency: self.observe_publish_ack("aws", latency),
+            on_drop=self.on_command_drop,
+        )
+
+        # "local" or "aws", used by publish_message and the status cycle
+        self.transport = "local"
+
+        # Publishes wait in a store-and-forward outbox while their transport
+        # is down, spilling to outbox_path, and drain at a steady rate once
+        # it is back. Commands and status requests expire and only the
+        # latest one per device is kept. A BLOCK publisher must not wait on
+        # the GUI thread, so then every publish goes through the drain
+        # thread, paced by the publisher's window instead of a fixed rate.
+        self.command_ttl = 300.0
+        self.status_request_ttl = 30.0
+        self.local_shards_connected = set()
+        direct = publish_policy != BLOCK
+        self.local_outbox = StoreAndForward(
+            self.local_publisher.submit,
+            spill_path=outbox_path and os.path.join(outbox_path, "local.spill"),
+            drain_rate=outbox_drain_rate if direct else 0,
+            name="local-outbox",
+            on_drop=self.on_command_drop,
+            direct=direct,
+        )
+        self.aws_outbox = StoreAndForward(
+            self.aws_publisher.submit,
+            spill_path=outbox_path and os.path.join(outbox_path, "aws.spill"),
+            drain_rate=outbox_drain_rate if direct else 0,
+            name="aws-outbox",
+            on_drop=self.on_command_drop,
+            direct=direct,
+        )
+
+        self.devices = {
+            f"ESP32-{i+1}": {"status": "Disconnected", "last_seen": 0, "state": "OFF"}
+            for i in range(6)
+        }
+
+        # Device reports are decoded from raw bytes with the fastest backend
+        self.decoder = PayloadDecoder()
+
+        # Command payloads are serialized once per (device, action, format)
+        self.commands = CommandEncoder()
+
+        # Commands carry a correlation ID that devices echo back, so replies
+        # can be matched and their round trip recorded
+        self.correlate_commands = True
+        self.round_trips = RoundTripTracker(timeout=30.0)
+
+        # Group and scene commands fan out in as few publishes as possible,
+        # their replies are counted per command
+        self.groups = DeviceGroups(groups_path)
+        self.group_acks = GroupAckTracker(self.on_group_done)
+
+        # Devices that stop reporting are marked Disconnected after their timeout
+        self.device_timeouts = ExpiryWheel(default_timeout=10.0, tick=1.0)
+
+        # Status requests go only to devices whose last report is stale
+        self.status_poller = StatusPoller(stale_after=5.0)
+        self.presence_topic = "ESP32bootcamp_presence"
+        self.presence_prefix = self.presence_topic + "/"
+        self.presence_online = set()
+
+        # Incoming topics are dispatched to handlers through a topic trie,
+        # presence/<device> is always routed
+        self.router = TopicRouter()
+        self.router.add(self.presence_prefix + "+", self.on_presence_message)
+
+        # Raw traffic capture and offline replay
+        self.capture = None
+        self.replayer = None
+
+        # Every received and published message is kept on disk when enabled
+        self.telemetry = None
+        if telemetry_path:
+            self.telemetry = TelemetryStore(
+                telemetry_path, presence_prefix=self.presence_prefix
+            )
+
+        self.register_metrics()
+
+    @property
+    def local_pool(self):
+        if self._local_pool is None:
+            self._local_pool = ShardedClientPool(
+                size=self.local_pool_size,
+                client_factory=self.local_client_factory,
+                on_message=self.on_local_message,
+                on_connect=self.on_local_connect,
+                on_disconnect=self.on_local_disconnect,
+            )
+        return self._local_pool
+
+    @property
+    def aws_qos(self):
+        from awscrt import mqtt as aws_mqtt
+
+        return aws_mqtt.QoS.AT_LEAST_ONCE
+
+    def on(self, event, callback):
+        self.listeners[event].append(callback)
+
+    def emit(self, event, *args):
+        for callback in self.listeners[event]:
+            callback(*args)
+
+    def on_ingest_ready(self):
+        self.emit("wakeup")
+
+    # Local MQTT connection methods...
+
+    def connect_local(self, server, port):
+        self.local_server = server
+        self.local_port = port
+        try:
+            self.local_pool.connect(self.local_server, int(self.local_port), 60)
+            return 100  # Success code
+        except Exception as e:
+            logging.error(f"Failed to connect: {e}")
+            self.emit(
+                "log",
+                f"Failed to connect to the MQTT server: {e}. Please check inputs!",
+            )
+            return 50  # Error code
+
+    async def connect_local_async(self, server, port, timeout=30.0):
+        # connect_local() for clients on asyncio_loop, returns once every
+        # shard has its CONNACK
+        self.local_server = server
+        self.local_port = port
+        try:
+            codes = await asyncio.wait_for(
+                self.local_pool.connect_async(server, int(port), 60), timeout
+            )
+        except Exception as e:
+            logging.error(f"Failed to connect: {e}")
+            self.emit("log", f"Failed to connect to the MQTT server: {e}")
+            return 50
+        if any(codes):
+            self.emit("log", f"MQTT server refused the connection, codes {codes}")
+            return 50
+        return 100
+
+    def disconnect_local(self):
+        self.local_shards_connected.clear()
+        self.local_outbox.set_online(False)
+        try:
+            self.local_pool.disconnect()
+            self.emit(
+                "log",
+                f"MQTT server Disconnected at {self.local_server}:{self.local_port}",
+            )
+        except Exception as e:
+            logging.error(f"Failed to disconnect: {e}")
+            self.emit("log", f"Failed to disconnect from the MQTT server: {e}")
+
+    def on_local_connect(self, shard, rc):
+        # Runs on the paho network thread of that shard
+        connection = f"shard {shard} " if self.local_pool.size > 1 else ""
+        if rc == 0:
+            self.local_shards_connected.add(shard)
+            if len(self.local_shards_connected) == self.local_pool.size:
+                self.local_outbox.set_online(True)
+            self.emit(
+                "log",
+                f"Connected {connection}to MQTT server at "
+                f"{self.local_server}:{self.local_port}",
+            )
+        else:
+            self.emit(
+                "log", f"Failed to connect {connection}to MQTT server, return code {rc}"
+            )
+
+    def on_local_disconnect(self, shard, rc):
+        # Runs on the paho network thread of that shard
+        self.local_shards_connected.discard(shard)
+        self.local_outbox.set_online(False)
+        if rc != 0:
+            self.emit("log", f"Lost the connection to the MQTT server, code {rc}")
+
+    def set_publish_topic_local(self, topic):
+        self.publish_topic = topic
+
+    def subscribe_local(self, topic, handler=None, qos=0):
+        # Any number of filters, "+" and "#" included. Messages go to
+        # update_device_status unless another handler(topic, payload) is given.
+        for args in self.add_local_subscription(topic, handler, qos):
+            self.local_pool.subscribe(*args)
+
+    async def subscribe_local_async(self, topic, handler=None, qos=0):
+        # subscribe_local() that returns once the broker granted it
+        for args in self.add_local_subscription(topic, handler, qos):
+            await self.local_pool.subscribe_async(*args)
+
+    def add_local_subscription(self, topic, handler, qos):
+        # Records the subscription, returns the pool subscriptions to make
+        handler = handler or self.update_device_status
+        # Raises ValueError for malformed filters before anything changes
+        self.router.add(topic, handler)
+        previous = self.local_subscriptions.get(topic)
+        subscriptions = []
+        if not self.local_subscriptions:
+            # Retained presence and Last Will messages, one topic per device.
+            # Not shared: brokers send no retained messages to $share.
+            subscriptions.append((self.presence_prefix + "+", 1, False))
+        self.local_subscriptions[topic] = handler
+        if previous is not None and previous is not handler:
+            self.release_handler(topic, previous)
+        subscriptions.append((topic, qos))
+        return subscriptions
+
+    def unsubscribe_local(self, topic):
+        handler = self.local_subscriptions.pop(topic, None)
+        if handler is None:
+            return
+        self.local_pool.unsubscribe(topic)
+        self.release_handler(topic, handler)
+
+    def set_subscribe_topics_local(self, topics):
+        # Make the subscriptions match topics, leaving unchanged ones alone
+        for topic in list(self.local_subscriptions):
+            if topic not in topics:
+                self.unsubscribe_local(topic)
+        for topic in topics:
+            if topic not in self.local_subscriptions:
+                self.subscribe_local(topic)
+
+    async def set_subscribe_topics_local_async(self, topics):
+        for topic in list(self.local_subscriptions):
+            if topic not in topics:
+                self.unsubscribe_local(topic)
+        for topic in topics:
+            if topic not in self.local_subscriptions:
+                await self.subscribe_local_async(topic)
+
+    def set_subscribe_topic_local(self, topic):
+        self.set_subscribe_topics_local([topic])
+
+    def release_handler(self, topic, handler):
+        # The other transport may still route this filter to the handler
+        if (
+            self.local_subscriptions.get(topic) is not handler
+            and self.aws_subscriptions.get(topic) is not handler
+        ):
+            self.router.remove(topic, handler)
+
+    def subscribe_device_topic(self, pattern, qos=0):
+        # Per-device topics such as "fleet/+/state": the "+" level names the
+        # device and the payload is a report or a bare "ON"/"OFF"
+        index = pattern.split("/").index("+")
+
+        def handler(topic, payload):
+            levels = topic.split("/")
+            if index < len(levels):
+                self.update_device_from_topic(levels[index], topic, payload)
+
+        if self.transport == "aws":
+            self.subscribe_aws(pattern, handler)
+        else:
+            self.subscribe_local(pattern, handler, qos)
+
+    def on_local_message(self, local_client, userdata, msg):
+        # Runs on the paho network thread
+        self.receive(msg.topic, msg.payload, msg.dup, msg.retain)
+
+    def receive(self, topic, payload, dup=False, retain=False):
+        # Broker thread entry point of both transports
+        recv_ts = time.time()
+        if self.capture:
+            # Raw traffic, redeliveries included
+            self.capture.write(topic, payload, recv_ts)
+        if self.dedup.is_duplicate(topic, payload, dup, retain):
+            return
+        self.ingest_queue.push(topic, payload, recv_ts)
+        if self.telemetry:
+            self.telemetry.append(INBOUND, topic, payload, recv_ts)
+
+    def process_ingest(self, max_batch=None):
+        # Handle one batch on the calling thread, returns how many are left
+        batch = self.ingest_queue.drain(max_batch or self.ingest_batch_size)
+        if batch and self.metrics.sample():
+            return self.process_ingest_timed(batch)
+        for topic, payload, recv_ts in batch:
+            self.emit("message", topic, payload)
+            self.handle_message(topic, payload)
+        return self.ingest_queue.depth
+
+    def process_ingest_timed(self, batch):
+        # Sampled twin of process_ingest. The first message of a batch is
+        # the one that waited longest in the queue.
+        self.ingest_wait_seconds.observe(max(0.0, time.time() - batch[0][2]))
+        self.ingest_batch_messages.observe(len(batch))
+        started = time.perf_counter()
+        for topic, payload, recv_ts in batch:
+            self.emit("message", topic, payload)
+            self.handle_message(topic, payload)
+        self.ingest_batch_seconds.observe(time.perf_counter() - started)
+        return self.ingest_queue.depth
+
+    def ingest_stats(self):
+        return self.ingest_queue.stats()
+
+    def handle_message(self, topic, message):
+        self.router.dispatch(topic, message)
+
+    def on_presence_message(self, topic, message):
+        self.update_device_presence(topic[len(self.presence_prefix) :], message)
+
+    def update_device_presence(self, device, message):
+        # Firmware publishes a retained "online" and leaves "offline" as its Will
+        online = message == b"online"
+        if message not in (b"online", b"offline"):
+            return
+        self.status_poller.on_presence(device, online)
+        info = self.devices.get(device)
+        if info is None:
+            info = self.devices[device] = {
+                "status": None,
+                "last_seen": None,
+                "state": "OFF",
+            }
+        if online:
+            # The broker reports the drop, so no timeout is needed
+            self.presence_online.add(device)
+            self.device_timeouts.remove(device)
+            info["status"] = "Connected"
+        else:
+            self.presence_online.discard(device)
+            self.device_timeouts.remove(device)
+            info["status"] = "Disconnected"
+            info["state"] = "OFF"
+        self.emit("device", device, info["status"], info["state"])
+
+    def status_requests(self):
+        # Broadcast now and then to discover new devices, otherwise only
+        # ask the devices whose last report is getting stale
+        if self.status_poller.discovery_due():
+            return [(None, *self.encode_control("ALL", "status"))]
+        return [
+            (device, *self.encode_control(device, "status"))
+            for device in self.status_poller.due()
+        ]
+
+    def update_device_status(self, topic, message):
+        report = self.decode(message)
+        if report is None:
+            # Not a device report, counted in decoder.invalid
+            return
+        self.apply_device_report(
+            report.device, report.status, report.state, report.id, report.formats
+        )
+
+    def update_device_from_topic(self, device, topic, message):
+        if message in (b"ON", b"OFF"):
+            self.apply_device_report(device, "Connected", message.decode())
+            return
+        report = self.decode(message)
+        if report is None:
+            return
+        self.apply_device_report(
+            device, report.status, report.state, report.id, report.formats
+        )
+
+    def decode(self, message):
+        if not self.metrics.sample():
+            return self.decoder.decode(message)
+        started = time.perf_counter()
+        report = self.decoder.decode(message)
+        self.decode_seconds.observe(time.perf_counter() - started)
+        return report
+
+    def apply_device_report(self, device, status, state, command_id=None, formats=None):
+        info = self.devices.get(device)
+        if info is None:
+            info = self.devices[device] = {
+                "status": None,
+                "last_seen": None,
+                "state": "OFF",
+            }
+        info["status"] = status
+        info["last_seen"] = time.time()
+        info["state"] = state
+        if device not in self.presence_online:
+            self.device_timeouts.touch(device)
+        self.status_poller.on_report(device)
+        if formats:
+            # Status replies list what the firmware decodes, later commands
+            # to the device use the most compact of those
+            self.commands.negotiate(device, formats)
+        self.device_updates += 1
+        if self.metrics.sample():
+            # Includes the frontends' handlers, the table model for the GUI
+            started = time.perf_counter()
+            self.emit("device", device, status, state)
+            self.device_update_seconds.observe(time.perf_counter() - started)
+        else:
+            self.emit("device", device, status, state)
+        if command_id is not None:
+            if command_id in self.group_acks:
+                latency = self.group_acks.on_reply(device, command_id)
+                if latency is not None:
+                    self.round_trips.record(device, latency)
+            else:
+                latency = self.round_trips.on_reply(device, command_id)
+            if latency is not None:
+                self.emit("round_trip", device, latency)
+
+    def publish_message_local(
+        self, message, device=None, ttl=None, coalesce=None, command_id=None
+    ):
+        self.local_outbox.submit(
+            self.publish_topic, message, device, ttl, coalesce, command_id
+        )
+        if self.telemetry:
+            self.telemetry.append(OUTBOUND, self.publish_topic, message, device=device)
+        self.emit("publish", self.publish_topic, message)
+
+    def on_command_drop(self, topic, payload, device, command_id):
+        # A command replaced by a newer one, expired in the outbox or pushed
+        # out of a full publish queue never reached the device, so its round
+        # trip is not counted as lost. Runs on the outbox, publisher or
+        # caller thread, RoundTripTracker locks.
+        if command_id is not None:
+            self.round_trips.cancel(command_id)
+
+    def send_local(self, topic, payload, device, done):
+        # Called by local_publisher, routed to the shard that owns the device
+        self.local_pool.publish(device, topic, payload, self.local_publish_qos, done)
+
+    def local_pool_stats(self):
+        if self._local_pool is None:
+            return []
+        return self._local_pool.throughput()
+
+    def control_master(self, action):
+        return self.control_device("ALL", action)
+
+    def control_device(self, device, action):
+        return self.encode_control(device, action)[0]
+
+    def encode_control(self, device, action):
+        # (payload, correlation ID or None); the ID travels with the publish
+        # so a dropped command can be cancelled without decoding it
+        if not self.correlate_commands:
+            return self.commands.encode(device, action), None
+        command_id = self.round_trips.send(device, action)
+        return self.commands.encode(device, action, command_id), command_id
+
+    def send_control(self, device, action):
+        # Encode and publish on the current transport, "ALL" broadcasts. A
+        # newer command for the device replaces one still in the outbox.
+        payload, command_id = self.encode_control(device, action)
+        self.publish_message(
+            payload,
+            None if device == "ALL" else device,
+            ttl=self.command_ttl,
+            coalesce=f"control:{device}",
+            command_id=command_id,
+        )
+
+    def send_group_command(self, name, targets, on_done=None):
+        # targets maps device -> action. One payload per action unless the
+        # device lists outgrow a publish, one correlation ID for all of them.
+        # Returns the GroupCommand; on_done and "group_done" report it.
+        command_id = self.round_trips.next_id() if self.correlate_commands else None
+        by_action = defaultdict(list)
+        for device, action in targets.items():
+            by_action[action].append(device)
+        label = next(iter(by_action)) if len(by_action) == 1 else "scene"
+        command = self.group_acks.start(name, label, targets, command_id, on_done)
+        for action, devices in by_action.items():
+            for payload, chunk in self.commands.encode_group(
+                name, devices, action, command_id
+            ):
+                self.publish_message(payload, ttl=self.command_ttl)
+                command.publishes += 1
+        return command
+
+    def send_group(self, group, action, on_done=None):
+        members = self.groups.members(group)
+        return self.send_group_command(group, dict.fromkeys(members, action), on_done)
+
+    def send_devices(self, devices, action, name="selection", on_done=None):
+        return self.send_group_command(name, dict.fromkeys(devices, action), on_done)
+
+    def apply_scene(self, scene, on_done=None):
+        return self.send_group_command(scene, self.groups.resolve_scene(scene), on_done)
+
+    def expire_group_commands(self):
+        self.group_acks.expire()
+
+    def on_group_done(self, command):
+        summary = command.summary()
+        if command.timed_out:
+            self.emit(
+                "log",
+                f"{command.name} {command.action}: {summary['acked']} of "
+                f"{summary['devices']} devices answered, missing "
+                f"{', '.join(summary['missing'])}",
+            )
+        else:
+            self.emit(
+                "log",
+                f"{command.name} {command.action}: all {summary['devices']} devices "
+                f"answered in {command.elapsed:.2f} s",
+            )
+        self.emit("group_done", command.name, summary)
+
+    def define_group(self, name, devices):
+        self.groups.define_group(name, devices)
+
+    def remove_group(self, name):
+        self.groups.remove_group(name)
+
+    def define_scene(self, name, actions):
+        self.groups.define_scene(name, actions)
+
+    def remove_scene(self, name):
+        self.groups.remove_scene(name)
+
+    def set_device_timeout(self, device, seconds):
+        self.device_timeouts.set_timeout(device, seconds)
+
+    def set_group_timeout(self, group, devices, seconds):
+        self.device_timeouts.set_group_timeout(group, seconds)
+        for device in devices:
+            self.device_timeouts.assign_group(device, group)
+
+    def check_device_timeouts(self):
+        # Only devices whose deadline passed are visited
+        for device in self.device_timeouts.expire():
+            info = self.devices[device]
+            if info["status"] != "Disconnected":
+                info["status"] = "Disconnected"
+                info["state"] = "OFF"
+                self.emit("device", device, "Disconnected", "OFF")
+        # Group commands time out on the same tick
+        self.expire_group_commands()
+
+    def publish_message(
+        self, message, device=None, ttl=None, coalesce=None, command_id=None
+    ):
+        if self.transport == "aws":
+            self.publish_message_aws(message, device, ttl, coalesce, command_id)
+        else:
+            self.publish_message_local(message, device, ttl, coalesce, command_id)
+
+    def run_status_cycle(self):
+        # One scheduler tick: targeted status requests, then timeouts
+        for device, json_message, command_id in self.status_requests():
+            # One pending request per device is enough during an outage
+            self.publish_message(
+                json_message,
+                device,
+                ttl=self.status_request_ttl,
+                coalesce=f"status:{device or 'ALL'}",
+                command_id=command_id,
+            )
+        self.check_device_timeouts()
+        self.round_trips.expire()
+
+    # AWS IoT Core methods...
+
+    def connect_aws(self, server, port, client_id):
+        self.aws_endpoint = server
+        self.aws_port = int(port)
+        self.aws_client_id = client_id
+        self.aws_manager.configure(
+            self.aws_endpoint,
+            self.aws_port,
+            self.aws_client_id,
+            self.aws_cert_filepath,
+            self.aws_pri_key_filepath,
+            self.aws_ca_filepath,
+        )
+        # Returns at once, progress arrives through connection_status_changed
+        self.aws_manager.connect()
+
+    def disconnect_aws(self):
+        self.aws_manager.disconnect()
+
+    @property
+    def aws_connection(self):
+        return self.aws_manager.connection
+
+    @property
+    def aws_connected(self):
+        return self.aws_manager.connected
+
+    def on_aws_status(self, status, detail):
+        # Called from awscrt and retry timer threads
+        if detail:
+            self.emit("log", f"AWS IoT Core {status.lower()}: {detail}")
+        else:
+            self.emit("log", f"AWS IoT Core {status.lower()}")
+        # The manager's flag decides, a status may only describe one topic
+        connected = self.aws_manager.connected
+        self.aws_outbox.set_online(connected)
+        if status == RESUBSCRIBE_REJECTED:
+            return
+        self.emit("connection_status", CONNECTED if connected else status)
+
+    def aws_connection_metrics(self):
+        return dict(self.aws_manager.metrics)
+
+    def on_aws_message_received(self, topic, payload, dup, qos, retain, **kwargs):
+        # Runs on an awscrt event loop thread
+        self.receive(topic, payload, dup, retain)
+
+    def set_publish_topic_aws(self, topic):
+        self.aws_publish_topic = topic
+
+    def subscribe_aws(self, topic, handler=None):
+        handler = handler or self.update_device_status
+        # Raises ValueError for malformed filters before anything changes
+        self.router.add(topic, handler)
+        previous = self.aws_subscriptions.get(topic)
+        if not self.aws_subscriptions:
+            self.aws_connection.subscribe(
+                topic=self.presence_prefix + "+",
+                qos=self.aws_qos,
+                callback=self.on_aws_message_received,
+            )
+        self.aws_subscriptions[topic] = handler
+        if previous is not None and previous is not handler:
+            self.release_handler(topic, previous)
+        self.aws_connection.subscribe(
+            topic=topic,
+            qos=self.aws_qos,
+            callback=self.on_aws_message_received,
+        )
+
+    def unsubscribe_aws(self, topic):
+        handler = self.aws_subscriptions.pop(topic, None)
+        if handler is None:
+            return
+        self.aws_connection.unsubscribe(topic)
+        self.release_handler(topic, handler)
+
+    def set_subscribe_topics_aws(self, topics):
+        for topic in list(self.aws_subscriptions):
+            if topic not in topics:
+                self.unsubscribe_aws(topic)
+        for topic in topics:
+            if topic not in self.aws_subscriptions:
+                self.subscribe_aws(topic)
+
+    def set_subscribe_topic_aws(self, topic):
+        self.set_subscribe_topics_aws([topic])
+
+    def publish_message_aws(
+        self, message, device=None, ttl=None, coalesce=None, command_id=None
+    ):
+        self.aws_outbox.submit(
+            self.aws_publish_topic, message, device, ttl, coalesce, command_id
+        )
+        if self.telemetry:
+            self.telemetry.append(
+                OUTBOUND, self.aws_publish_topic, message, device=device
+            )
+        self.emit("publish", self.aws_publish_topic, message)
+
+    def send_aws(self, topic, payload, device, done):
+        # Called by aws_publisher, done() fires when the PUBACK arrives
+        future, _ = self.aws_connection.publish(
+            topic=topic, payload=payload, qos=self.aws_qos
+        )
+
+        def on_complete(future):
+            error = future.exception()
+            if error is not None:
+                logging.error(f"Failed to publish message to AWS IoT Core: {error}")
+            done(error)
+
+        future.add_done_callback(on_complete)
+
+    def observe_publish_ack(self, transport, latency):
+        # Runs on the thread that saw the ack, publishes are rare enough to
+        # time every one
+        if self.metrics.enabled:
+            self.publish_ack_seconds[transport].observe(latency)
+
+    def register_metrics(self):
+        # Counts the engine keeps anyway are read when scraped, only the
+        # histograms below are fed from the hot path
+        m = self.metrics
+        queue = self.ingest_queue
+        m.counter(
+            "mqtt_ingest_received_total",
+            "Messages handed to the ingest queue",
+            fn=lambda: queue.received,
+        )
+        m.counter(
+            "mqtt_ingest_dropped_total",
+            "Messages dropped because the ingest queue was full",
+            fn=lambda: queue.dropped,
+        )
+        m.counter(
+            "mqtt_ingest_processed_total",
+            "Messages taken off the ingest queue",
+            fn=lambda: queue.drained,
+        )
+        m.gauge(
+            "mqtt_ingest_queue_depth",
+            "Messages waiting in the ingest queue",
+            fn=lambda: queue.depth,
+        )
+        m.counter(
+            "mqtt_dedup_dropped_total",
+            "Redelivered messages dropped before decoding",
+            fn=lambda: self.dedup.hits,
+        )
+        m.counter(
+            "mqtt_decoded_total",
+            "Device reports decoded",
+            fn=lambda: self.decoder.decoded,
+        )
+        m.counter(
+            "mqtt_decode_invalid_total",
+            "Payloads that were not device reports",
+            fn=lambda: self.decoder.invalid,
+        )
+        m.counter(
+            "mqtt_unrouted_total",
+            "Messages no subscription handled",
+            fn=lambda: self.router.unrouted,
+        )
+        m.counter(
+            "mqtt_device_updates_total",
+            "Device reports applied to the registry",
+            fn=lambda: self.device_updates,
+        )
+        m.gauge(
+            "mqtt_devices",
+            "Known devices",
+            fn=lambda: len(self.devices),
+        )
+        m.gauge(
+            "mqtt_devices_connected",
+            "Devices currently Connected",
+            fn=lambda: sum(
+                1
+                for info in list(self.devices.values())
+                if info["status"] == "Connected"
+            ),
+        )
+        m.counter(
+            "mqtt_commands_lost_total",
+            "Commands whose reply never arrived",
+            fn=lambda: self.round_trips.lost,
+        )
+        m.counter(
+            "mqtt_group_commands_completed_total",
+            "Group and scene commands every member answered",
+            fn=lambda: self.group_acks.completed,
+        )
+        m.counter(
+            "mqtt_group_commands_timed_out_total",
+            "Group and scene commands with members that never answered",
+            fn=lambda: self.group_acks.timed_out,
+        )
+        self.publish_ack_seconds = {}
+        for transport, publisher, outbox in (
+            ("local", self.local_publisher, self.local_outbox),
+            ("aws", self.aws_publisher, self.aws_outbox),
+        ):
+            labels = {"transport": transport}
+            for name, help, attribute in (
+                ("mqtt_publish_submitted_total", "Publishes queued", "submitted"),
+                ("mqtt_publish_acked_total", "Publishes acknowledged", "acked"),
+                ("mqtt_publish_failed_total", "Publishes rejected", "failed"),
+                ("mqtt_publish_dropped_total", "Publishes dropped", "dropped"),
+            ):
+                m.counter(
+                    name,
+                    help,
+                    labels,
+                    fn=lambda p=publisher, a=attribute: getattr(p, a),
+                )
+            m.gauge(
+                "mqtt_publish_in_flight",
+                "Publishes waiting for their ack",
+                labels,
+                fn=lambda p=publisher: p.in_flight,
+            )
+            m.gauge(
+                "mqtt_publish_queue_depth",
+                "Publishes waiting for a window slot",
+                labels,
+                fn=lambda p=publisher: len(p.queue),
+            )
+            self.publish_ack_seconds[transport] = m.histogram(
+                "mqtt_publish_ack_seconds", "Publish to broker ack", labels
+            )
+            m.gauge(
+                "mqtt_outbox_depth",
+                "Publishes held while the transport is down, spilled included",
+                labels,
+                fn=lambda o=outbox: len(o),
+            )
+            for name, help, attribute in (
+                ("mqtt_outbox_queued_total", "Publishes held back", "queued"),
+                (
+                    "mqtt_outbox_coalesced_total",
+                    "Held publishes replaced by a newer one",
+                    "coalesced",
+                ),
+                (
+                    "mqtt_outbox_expired_total",
+                    "Held publishes past their TTL",
+                    "expired",
+                ),
+                (
+                    "mqtt_outbox_spilled_total",
+                    "Publishes spilled to disk",
+                    "spilled_total",
+                ),
+            ):
+                m.counter(
+                    name,
+                    help,
+                    labels,
+                    fn=lambda o=outbox, a=attribute: getattr(o, a),
+                )
+        m.gauge(
+            "mqtt_telemetry_backlog",
+            "Messages waiting to be written to the store",
+            fn=lambda: len(self.telemetry.backlog) if self.telemetry else None,
+        )
+
+        self.ingest_wait_seconds = m.histogram(
+            "mqtt_ingest_wait_seconds",
+            "Broker callback to processing, oldest message of a sampled batch",
+        )
+        self.ingest_batch_seconds = m.histogram(
+            "mqtt_ingest_batch_seconds", "Processing time of a sampled batch"
+        )
+        self.ingest_batch_messages = m.histogram(
+            "mqtt_ingest_batch_size",
+            "Messages in a sampled batch",
+            buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+        )
+        self.decode_seconds = m.histogram(
+            "mqtt_decode_seconds", "Decoding of a sampled device report"
+        )
+        self.device_update_seconds = m.histogram(
+            "mqtt_device_update_seconds",
+            "Applying a sampled device report, frontend handlers included",
+        )
+
+    def stats(self):
+        return {
+            "ingest": self.ingest_stats(),
+            "dedup": self.dedup.stats(),
+            "decoder": self.decoder.stats(),
+            "round_trips": self.round_trips.stats(),
+            "groups": self.group_acks.stats(),
+            "router": self.router.stats(),
+            "publishers": self.publisher_stats(),
+            "outbox": {
+                "local": self.local_outbox.stats(),
+                "aws": self.aws_outbox.stats(),
+            },
+            "poller": self.status_poller.stats(),
+            "tracked_devices": len(self.device_timeouts),
+            "telemetry": self.telemetry.stats() if self.telemetry else None,
+        }
+
+    def query_telemetry(self, device=None, since=None, until=None, direction=None):
+        if not self.telemetry:
+            return []
+        return self.telemetry.query(device, since, until, direction)
+
+    def start_capture(self, path):
+        self.stop_capture()
+        self.capture = CaptureWriter(path)
+        self.emit("log", f"Capturing broker traffic to {path}")
+
+    def stop_capture(self):
+        if self.capture:
+            capture, self.capture = self.capture, None
+            capture.close()
+            self.emit("log", f"Captured {capture.count} messages to {capture.path}")
+
+    def replay(self, path, speed=1.0):
+        # Replays a capture through the ingest path, no broker needed
+        self.stop_replay()
+        self.emit("log", f"Replaying {path} at {f'{speed}x' if speed else 'max'} speed")
+        self.replayer = CaptureReplayer(
+            path, self.ingest_queue, speed, on_done=self.on_replay_done
+        ).start()
+        return self.replayer
+
+    def stop_replay(self):
+        if self.replayer:
+            self.replayer.stop()
+            self.replayer.join()
+            self.replayer = None
+
+    def on_replay_done(self, replayer, error):
+        # Runs on the replay thread
+        if error:
+            self.emit("log", f"Replay of {replayer.path} failed: {error}")
+        else:
+            rate = replayer.replayed / max(replayer.elapsed, 1e-9)
+            self.emit(
+                "log",
+                f"Replayed {replayer.replayed} messages in {replayer.elapsed:.2f} s "
+                f"({rate:.0f} msg/s)",
+            )
+
+    def close(self):
+        # Flushes the capture and telemetry backlog, call once on shutdown
+        self.stop_replay()
+        self.stop_capture()
+        self.local_outbox.close()
+        self.aws_outbox.close()
+        if self.telemetry:
+            self.telemetry.close()
+            self.telemetry = None
+
+    def publisher_stats(self):
+        return {
+            "local": self.local_publisher.stats(),
+            "aws": self.aws_publisher.stats(),
+        }
+
+    def control_device_aws(self, device, action):
+        payload, command_id = self.encode_control(device, action)
+        self.publish_message_aws(payload, device, command_id=command_id)
+
+    def control_master_aws(self, action):
+        payload, command_id = self.encode_control("ALL", action)
+        self.publish_message_aws(payload, command_id=command_id)
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import time
+
+# Seconds a group command waits for its slowest member
+GROUP_COMMAND_TIMEOUT = 10.0
+
+
+class DeviceGroups:
+    # Named device groups and scenes, optionally kept in a JSON file. A
+    # scene maps groups or single devices to an action; a device named
+    # directly wins over the groups it is in.
+    def __init__(self, path=None):
+        self.path = path
+        self.groups = {}  # name -> [device]
+        self.scenes = {}  # name -> {group or device: action}
+        if path and os.path.exists(path):
+            self.load()
+
+    def define_group(self, name, devices):
+        self.groups[name] = list(dict.fromkeys(devices))
+        self.save()
+
+    def remove_group(self, name):
+        self.groups.pop(name, None)
+        self.save()
+
+    def members(self, name):
+        devices = self.groups.get(name)
+        if devices is None:
+            raise ValueError(f"Unknown group: {name}")
+        return devices
+
+    def define_scene(self, name, actions):
+        self.scenes[name] = dict(actions)
+        self.save()
+
+    def remove_scene(self, name):
+        self.scenes.pop(name, None)
+        self.save()
+
+    def resolve_scene(self, name):
+        # device -> action
+        actions = self.scenes.get(name)
+        if actions is None:
+            raise ValueError(f"Unknown scene: {name}")
+        resolved = {}
+        for target, action in actions.items():
+            if target in self.groups:
+                for device in self.groups[target]:
+                    resolved.setdefault(device, action)
+        for target, action in actions.items():
+            if target not in self.groups:
+                resolved[target] = action
+        return resolved
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read groups from {self.path}: {e}")
+            return
+        self.groups = {name: list(devices) for name, devices in data["groups"].items()}
+        self.scenes = {name: dict(actions) for name, actions in data["scenes"].items()}
+
+    def save(self):
+        if not self.path:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"groups": self.groups, "scenes": self.scenes}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+
+class GroupCommand:
+    # One group or scene command, however many publishes it took
+    def __init__(self, name, action, devices, command_id, sent, on_done=None):
+        self.name = name
+        self.action = action
+        self.devices = devices
+        self.remaining = set(devices)
+        self.command_id = command_id
+        self.sent = sent
+        self.on_done = on_done
+        self.publishes = 0
+        self.elapsed = None
+        self.timed_out = False
+
+    @property
+    def done(self):
+        return self.elapsed is not None
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "action": self.action,
+            "devices": len(self.devices),
+            "acked": len(self.devices) - len(self.remaining),
+            "missing": sorted(self.remaining),
+            "publishes": self.publishes,
+            "seconds": self.elapsed,
+            "timed_out": self.timed_out,
+        }
+
+
+class GroupAckTracker:
+    # Aggregates the replies to group commands. All publishes of one command
+    # carry the same correlation ID, the command completes when the last
+    # member echoed it or when it times out.
+    def __init__(self, on_done, timeout=GROUP_COMMAND_TIMEOUT, clock=time.monotonic):
+        self.on_done = on_done
+        self.timeout = timeout
+        self.clock = clock
+        self.pending = {}  # id -> GroupCommand, oldest first
+        self.completed = 0
+        self.timed_out = 0
+
+    def __contains__(self, command_id):
+        return command_id in self.pending
+
+    def start(self, name, action, devices, command_id, on_done=None):
+        self.expire()
+        command = GroupCommand(
+            name, action, list(devices), command_id, self.clock(), on_done
+        )
+        if command_id is not None and command.devices:
+            self.pending[command_id] = command
+        return command
+
+    def on_reply(self, device, command_id):
+        # Returns the device's round trip, None for a repeat or a stranger
+        command = self.pending.get(command_id)
+        if command is None or device not in command.remaining:
+            return None
+        command.remaining.discard(device)
+        latency = self.clock() - command.sent
+        if not command.remaining:
+            self.finish(command)
+        return latency
+
+    def finish(self, command, timed_out=False):
+        del self.pending[command.command_id]
+        command.elapsed = self.clock() - command.sent
+        command.timed_out = timed_out
+        if timed_out:
+            self.timed_out += 1
+        else:
+            self.completed += 1
+        if command.on_done:
+            command.on_done(command)
+        self.on_done(command)
+
+    def expire(self):
+        deadline = self.clock() - self.timeout
+        while self.pending:
+            command = self.pending[next(iter(self.pending))]
+            if command.sent > deadline:
+                break
+            self.finish(command, timed_out=True)
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "completed": self.completed,
+            "timed_out": self.timed_out,
+        }
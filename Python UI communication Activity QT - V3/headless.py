@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import signal
+import threading
+import time
+from engine import MQTTEngine
+from metrics import MetricsServer
+
+
+class HeadlessRunner:
+    # Drives MQTTEngine without Qt: drains the ingest queue when woken up and
+    # runs the status scheduler and timeout checks on a fixed tick
+    def __init__(
+        self,
+        engine,
+        poll=True,
+        stats_interval=0,
+        aws_subscribe_topics=(),
+        after_batch=None,
+        log_devices=True,
+        startup_commands=(),
+    ):
+        self.engine = engine
+        self.aws_subscribe_topics = aws_subscribe_topics
+        # (engine method, args) sent once the connection is up
+        self.startup_commands = startup_commands
+        self.poll = poll
+        self.stats_interval = stats_interval
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.async_wake = None  # set by run_async
+        # Called on the runner's thread after every drain
+        self.after_batch = after_batch
+        # Work handed over from other threads, run between batches
+        self.calls = collections.deque()
+
+        engine.on("wakeup", self.wakeup.set)
+        engine.on("log", logging.info)
+        if log_devices:
+            engine.on("device", self.on_device)
+        engine.on("connection_status", self.on_connection_status)
+
+    def on_device(self, device, status, state):
+        logging.info(f"{device}: {status} {state}")
+
+    def on_connection_status(self, status):
+        # awscrt subscriptions need a live connection. This runs on the
+        # awscrt callback thread, so the engine call goes to the runner.
+        if status == "Connected" and self.aws_subscribe_topics:
+            topics, self.aws_subscribe_topics = self.aws_subscribe_topics, ()
+            self.call_soon(self.engine.set_subscribe_topics_aws, topics)
+        if status == "Connected":
+            self.send_startup_commands()
+
+    def send_startup_commands(self):
+        # Only once, not again after a reconnect
+        commands, self.startup_commands = self.startup_commands, ()
+        for method, args in commands:
+            self.call_soon(getattr(self.engine, method), *args)
+
+    def run(self):
+        self.start_ticks()
+        while not self.stopping.is_set():
+            self.wakeup.wait(self.time_to_tick())
+            self.wakeup.clear()
+            self.run_calls()
+            while self.engine.process_ingest():
+                pass
+            self.housekeeping()
+        # Whatever arrived before stop() still gets handled
+        while self.engine.process_ingest():
+            pass
+
+    async def run_async(self):
+        # run() as a coroutine, for an engine whose transport lives on the
+        # same event loop. Wakeups may still come from other threads.
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def wake():
+            loop.call_soon_threadsafe(wakeup.set)
+
+        self.async_wake = wake
+        self.engine.on("wakeup", wake)
+        self.start_ticks()
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(wakeup.wait(), self.time_to_tick())
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            self.run_calls()
+            # Yield between batches so the sockets keep being read
+            while self.engine.process_ingest():
+                await asyncio.sleep(0)
+            self.housekeeping()
+        while self.engine.process_ingest():
+            pass
+
+    def call_soon(self, callback, *args):
+        # Thread-safe, the engine is only touched from the runner's thread
+        self.calls.append((callback, args))
+        self.wakeup.set()
+        if self.async_wake:
+            self.async_wake()
+
+    def run_calls(self):
+        while self.calls:
+            callback, args = self.calls.popleft()
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.error(f"{getattr(callback, '__name__', callback)} failed: {e}")
+
+    def start_ticks(self):
+        self.next_tick = time.monotonic()
+        self.next_stats = self.next_tick + self.stats_interval
+
+    def time_to_tick(self):
+        return max(0.0, self.next_tick - time.monotonic())
+
+    def housekeeping(self):
+        if self.after_batch:
+            self.after_batch()
+        now = time.monotonic()
+        if now >= self.next_tick:
+            if self.poll:
+                self.engine.run_status_cycle()
+            else:
+                self.engine.check_device_timeouts()
+            self.next_tick = now + self.engine.status_poller.tick
+        if self.stats_interval and now >= self.next_stats:
+            logging.info(json.dumps(self.engine.stats()))
+            self.next_stats = now + self.stats_interval
+
+    def stop(self, *_):
+        self.stopping.set()
+        self.wakeup.set()
+        if self.async_wake:
+            self.async_wake()
+
+
+def stop_after(replayer, runner):
+    # The runner drains what is still queued before it returns
+    replayer.join()
+    runner.stop()
+
+
+async def start_local_async(engine, args, topics):
+    # On the event loop the startup commands wait for the CONNACKs and
+    # SUBACKs, so replies to them cannot arrive before the subscriptions
+    if await engine.connect_local_async(args.server, args.port) != 100:
+        return False
+    try:
+        await engine.set_subscribe_topics_local_async(topics)
+    except Exception as e:
+        logging.error(f"Subscribing to {', '.join(topics)} failed: {e}")
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the MQTT master without a GUI")
+    parser.add_argument("--server", help="local MQTT broker host")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--aws-endpoint", help="AWS IoT Core endpoint")
+    parser.add_argument("--aws-port", type=int, default=8883)
+    parser.add_argument("--client-id", default="device_2")
+    parser.add_argument("--publish-topic", default="ESP32bootcamp_control")
+    parser.add_argument(
+        "--subscribe-topic",
+        default="ESP32bootcamp_com",
+        help="comma separated topic filters, + and # allowed",
+    )
+    parser.add_argument("--pool-size", type=int, default=1)
+    parser.add_argument(
+        "--no-poll", action="store_true", help="only check timeouts, never poll"
+    )
+    parser.add_argument(
+        "--stats-interval", type=float, default=0, help="log engine stats every N s"
+    )
+    parser.add_argument(
+        "--telemetry",
+        default="telemetry",
+        help="directory for the message store, empty to disable",
+    )
+    parser.add_argument("--capture", help="record incoming traffic to this file")
+    parser.add_argument(
+        "--replay", help="replay a capture file instead of connecting to a broker"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="replay speed factor, 0 for max"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, help="serve Prometheus metrics on this port"
+    )
+    parser.add_argument(
+        "--no-metrics", action="store_true", help="turn off hot path timings"
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="drive the local MQTT clients from one asyncio event loop",
+    )
+    parser.add_argument(
+        "--groups", default="groups.json", help="device groups and scenes file"
+    )
+    parser.add_argument(
+        "--outbox",
+        default="outbox",
+        help="spill directory for publishes held during outages, empty for memory only",
+    )
+    parser.add_argument(
+        "--drain-rate",
+        type=float,
+        default=50.0,
+        help="publishes per second sent from the outbox after a reconnect",
+    )
+    parser.add_argument(
+        "--send-group",
+        nargs=2,
+        metavar=("GROUP", "ACTION"),
+        help="send ACTION to a group once connected, then keep running",
+    )
+    parser.add_argument(
+        "--apply-scene", metavar="SCENE", help="apply a scene once connected"
+    )
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s"
+    )
+    if not args.server and not args.aws_endpoint and not args.replay:
+        parser.error("one of --server, --aws-endpoint or --replay is required")
+
+    topics = [topic.strip() for topic in args.subscribe_topic.split(",")]
+    startup_commands = []
+    if args.send_group:
+        startup_commands.append(("send_group", tuple(args.send_group)))
+    if args.apply_scene:
+        startup_commands.append(("apply_scene", (args.apply_scene,)))
+    loop = asyncio.new_event_loop() if args.asyncio else None
+    engine = MQTTEngine(
+        local_pool_size=args.pool_size,
+        telemetry_path=args.telemetry,
+        metrics_enabled=not args.no_metrics,
+        asyncio_loop=loop,
+        groups_path=args.groups,
+        outbox_path=args.outbox or None,
+        outbox_drain_rate=args.drain_rate,
+    )
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = MetricsServer(engine.metrics, args.metrics_port).start()
+        logging.info(f"Serving metrics on {metrics_server.address}")
+    runner = HeadlessRunner(
+        engine,
+        # A replay has nobody to answer status requests
+        poll=not args.no_poll and not args.replay,
+        stats_interval=args.stats_interval,
+        # Subscribed from on_connection_status once the connection is up
+        aws_subscribe_topics=topics if args.aws_endpoint else (),
+        startup_commands=startup_commands,
+    )
+    signal.signal(signal.SIGINT, runner.stop)
+    signal.signal(signal.SIGTERM, runner.stop)
+
+    if args.capture:
+        engine.start_capture(args.capture)
+
+    if args.replay:
+        replayer = engine.replay(args.replay, args.speed)
+        threading.Thread(
+            target=stop_after, args=(replayer, runner), daemon=True
+        ).start()
+    elif args.aws_endpoint:
+        engine.transport = "aws"
+        engine.set_publish_topic_aws(args.publish_topic)
+        engine.connect_aws(args.aws_endpoint, args.aws_port, args.client_id)
+    elif loop is not None:
+        engine.transport = "local"
+        engine.set_publish_topic_local(args.publish_topic)
+        if not loop.run_until_complete(start_local_async(engine, args, topics)):
+            return 1
+        runner.send_startup_commands()
+    else:
+        engine.transport = "local"
+        if engine.connect_local(args.server, args.port) != 100:
+            return 1
+        engine.set_publish_topic_local(args.publish_topic)
+        engine.set_subscribe_topics_local(topics)
+        # paho queues publishes until its connection is up
+        runner.send_startup_commands()
+
+    try:
+        if loop is not None:
+            loop.run_until_complete(runner.run_async())
+        else:
+            runner.run()
+    finally:
+        if args.aws_endpoint and not args.replay:
+            engine.disconnect_aws()
+        elif args.server and not args.replay:
+            engine.disconnect_local()
+        engine.close()
+        if metrics_server:
+            metrics_server.stop()
+        if loop is not None:
+            # Let the cancelled connection tasks unwind before closing
+            loop.run_until_complete(asyncio.sleep(0))
+            loop.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
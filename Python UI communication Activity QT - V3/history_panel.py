@@ -0,0 +1,117 @@
+from datetime import datetime
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QTimer, Qt
+from log_model import LogListModel
+
+QUERY_HELP = (
+    "Words are ANDed. key:value looks at one field, a bare word at all of\n"
+    "them, a trailing * matches a prefix.\n"
+    "Keys: device, type, state, status, topic, dir (in or out)\n"
+    "e.g.  device:ESP32-7 state:ON    dir:out ESP32-1*"
+)
+
+
+class HistoryResultsModel(QAbstractListModel):
+    # Sequence numbers from MessageIndex.search, formatted when painted
+    def __init__(self, message_index, parent=None):
+        super().__init__(parent)
+        self.message_index = message_index
+        self.seqs = []
+
+    def set_results(self, seqs):
+        self.beginResetModel()
+        self.seqs = seqs
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.seqs)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        entry = self.message_index.entry(self.seqs[index.row()])
+        if entry is None:
+            return "(evicted)" if role == Qt.DisplayRole else None
+        timestamp, direction, topic, payload = entry
+        when = datetime.fromtimestamp(timestamp)
+        if role == Qt.ToolTipRole:
+            return (
+                f"{when:%Y-%m-%d %H:%M:%S}  {topic or ''}\n"
+                f"{LogListModel.pretty(payload)}"
+            )
+        return f"{when:%H:%M:%S}  {direction:3}  {LogListModel.compact(payload)}"
+
+
+class HistoryPanel(QtWidgets.QDockWidget):
+    # Filter box over the message index, re-run while visible as new
+    # messages come in
+    def __init__(self, message_index, parent=None, refresh_ms=1000, limit=1000):
+        super().__init__("Message history", parent)
+        self.setObjectName("history_panel")
+        self.message_index = message_index
+        self.limit = limit
+        self.searched_seq = None
+
+        widget = QtWidgets.QWidget(self)
+        layout = QtWidgets.QVBoxLayout(widget)
+        self.filter_input = QtWidgets.QLineEdit(widget)
+        self.filter_input.setPlaceholderText("Filter, e.g. device:ESP32-7 state:ON")
+        self.filter_input.setToolTip(QUERY_HELP)
+        self.filter_input.setClearButtonEnabled(True)
+        layout.addWidget(self.filter_input)
+
+        self.results_model = HistoryResultsModel(message_index, self)
+        self.results_listView = QtWidgets.QListView(widget)
+        self.results_listView.setModel(self.results_model)
+        self.results_listView.setUniformItemSizes(True)
+        self.results_listView.setEditTriggers(
+            QtWidgets.QAbstractItemView.NoEditTriggers
+        )
+        layout.addWidget(self.results_listView)
+
+        self.count_label = QtWidgets.QLabel(widget)
+        layout.addWidget(self.count_label)
+        self.setWidget(widget)
+
+        # Typing restarts the timer, so a search runs once the user pauses
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.search)
+        self.filter_input.textChanged.connect(self.search_timer.start)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(refresh_ms)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+
+    def on_visibility_changed(self, visible):
+        if visible:
+            self.search()
+            self.filter_input.setFocus()
+            self.refresh_timer.start()
+        else:
+            self.refresh_timer.stop()
+
+    def refresh(self):
+        if self.message_index.next_seq != self.searched_seq:
+            self.search()
+
+    def search(self):
+        query = self.filter_input.text()
+        self.searched_seq = self.message_index.next_seq
+        if not query.strip():
+            self.results_model.set_results([])
+            self.count_label.setText(f"{len(self.message_index)} messages in history")
+            return
+        seqs, total = self.message_index.search(query, self.limit)
+        self.results_model.set_results(seqs)
+        if total is None:
+            self.count_label.setText(f"Newest {len(seqs)} matches")
+        else:
+            self.count_label.setText(
+                f"{total} matches"
+                + (f", newest {len(seqs)} shown" if total > len(seqs) else "")
+            )
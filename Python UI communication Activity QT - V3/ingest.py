@@ -0,0 +1,57 @@
+import collections
+import threading
+
+
+class IngestQueue:
+    # Hand-off between broker network threads and the consumer thread.
+    # deque.append/popleft are atomic in CPython, so producers never take a lock.
+    def __init__(self, max_depth=50000, on_ready=None):
+        self.max_depth = max_depth
+        self.on_ready = on_ready
+        self.queue = collections.deque()
+        self.received = 0
+        self.dropped = 0
+        self.drained = 0
+        self.wakeup_pending = False
+        self.stats_lock = threading.Lock()
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def push(self, topic, payload, recv_ts):
+        if len(self.queue) >= self.max_depth:
+            with self.stats_lock:
+                self.dropped += 1
+            return False
+        self.queue.append((topic, payload, recv_ts))
+        with self.stats_lock:
+            self.received += 1
+
+        # Only the first message after a drain wakes the consumer up
+        if not self.wakeup_pending:
+            self.wakeup_pending = True
+            if self.on_ready:
+                self.on_ready()
+        return True
+
+    def drain(self, max_batch):
+        # Clear the flag first so a push racing with the drain re-arms the wakeup
+        self.wakeup_pending = False
+        batch = []
+        popleft = self.queue.popleft
+        try:
+            for _ in range(max_batch):
+                batch.append(popleft())
+        except IndexError:
+            pass
+        self.drained += len(batch)
+        return batch
+
+    def stats(self):
+        return {
+            "depth": len(self.queue),
+            "received": self.received,
+            "dropped": self.dropped,
+            "drained": self.drained,
+        }
@@ -0,0 +1,473 @@
+import collections
+import logging
+import multiprocessing
+import threading
+import time
+from aws_connection import FAILED
+from groups import DeviceGroups
+from latency import RoundTripTracker
+from metrics import MetricsRegistry
+from shm_ring import (
+    DeviceStateRing,
+    DEVICE,
+    ROUND_TRIP,
+    STATUS_CODES,
+    STATE_CODES,
+    STATUSES,
+    STATES,
+    name_fits,
+)
+from status_poller import StatusPoller
+from topic_router import split_filter
+
+# Pipe messages, worker -> GUI:
+#   ("wake",)                          ring has records
+#   ("log", message)
+#   ("connection_status", status)
+#   ("message", topic, payload)        for the subscribed log, rate limited
+#   ("publish", topic, payload)
+#   ("group_done", name, summary)
+#   ("device", device, status, state)  values the ring has no code for,
+#                                      or a name too long for a record
+#   ("round_trip", device, latency)    name too long for a record
+#   ("stats", engine stats)            about once a second
+# GUI -> worker:
+#   ("call", method, args)             MQTTEngine method, result discarded
+#   ("set", attribute, value)
+#   ("stop",)
+
+
+class RingWriter:
+    # Worker side. Device rows that do not fit while the ring is full are
+    # kept per device, latest state only, and written once there is room.
+    def __init__(self, ring, send):
+        self.ring = ring
+        self.send = send
+        self.pending = collections.OrderedDict()  # device -> (status, state)
+        self.written = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def device(self, device, status, state):
+        status_code = STATUS_CODES.get(status)
+        state_code = STATE_CODES.get(state)
+        if status_code is None or state_code is None or not name_fits(device):
+            self.send(("device", device, status, state))
+            return
+        if self.pending:
+            self.flush_pending()
+        if self.pending or not self.write(DEVICE, device, status_code, state_code):
+            if device in self.pending:
+                self.coalesced += 1
+            self.pending[device] = (status_code, state_code)
+            self.pending.move_to_end(device)
+
+    def round_trip(self, device, latency):
+        # Figures, not state: losing one under a flood is acceptable
+        if not name_fits(device):
+            self.send(("round_trip", device, latency))
+        elif not self.write(ROUND_TRIP, device, value=latency):
+            self.dropped += 1
+
+    def write(self, kind, device, status=0, state=0, value=0.0):
+        if not self.ring.write(kind, device, status, state, value, time.time()):
+            return False
+        self.written += 1
+        if self.ring.arm_wakeup():
+            self.send(("wake",))
+        return True
+
+    def flush_pending(self):
+        while self.pending:
+            device, (status, state) = next(iter(self.pending.items()))
+            if not self.write(DEVICE, device, status, state):
+                return
+            del self.pending[device]
+
+    def stats(self):
+        return {
+            "depth": self.ring.depth,
+            "capacity": self.ring.capacity,
+            "written": self.written,
+            "pending": len(self.pending),
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
+
+
+def worker_main(conn, ring_name, options):
+    # Entry point of the worker process: owns the broker connections and
+    # the engine, the GUI only sees the ring and the pipe
+    from engine import MQTTEngine
+    from headless import HeadlessRunner
+
+    logging.basicConfig(level=options.get("log_level", "WARNING"))
+    ring = DeviceStateRing.attach(ring_name)
+    send_lock = threading.Lock()
+
+    def send(message):
+        # Called from broker threads as well as the runner
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, EOFError):
+                pass
+
+    engine = MQTTEngine(
+        local_pool_size=options.get("local_pool_size", 1),
+        telemetry_path=options.get("telemetry_path"),
+        outbox_path=options.get("outbox_path"),
+    )
+    # The GUI keeps the groups file, the worker gets its contents
+    engine.groups.groups = options.get("groups", {})
+    engine.groups.scenes = options.get("scenes", {})
+    writer = RingWriter(ring, send)
+    max_messages = options.get("message_log_rate", 100)
+    message_window = [int(time.monotonic()), 0, 0]  # second, forwarded, skipped
+
+    def forward_message(topic, payload):
+        # The subscribed log is for people, a flood would only fill the pipe
+        second = int(time.monotonic())
+        if second != message_window[0]:
+            if message_window[2]:
+                send(("log", f"{message_window[2]} messages not shown in the log"))
+            message_window[:] = [second, 0, 0]
+        if message_window[1] >= max_messages:
+            message_window[2] += 1
+            return
+        message_window[1] += 1
+        send(("message", topic, bytes(payload)))
+
+    last_stats = [0.0]
+
+    def after_batch():
+        writer.flush_pending()
+        now = time.monotonic()
+        if now - last_stats[0] >= 1.0:
+            last_stats[0] = now
+            stats = engine.stats()
+            stats["ring"] = writer.stats()
+            send(("stats", stats))
+
+    engine.on("device", writer.device)
+    engine.on("round_trip", writer.round_trip)
+    engine.on("log", lambda message: send(("log", message)))
+    engine.on("connection_status", lambda status: send(("connection_status", status)))
+    engine.on("message", forward_message)
+    engine.on("publish", lambda topic, payload: send(("publish", topic, payload)))
+    engine.on("group_done", lambda name, summary: send(("group_done", name, summary)))
+
+    # Status requests only go out when the GUI's schedule asks for them
+    runner = HeadlessRunner(
+        engine, poll=False, after_batch=after_batch, log_devices=False
+    )
+
+    def handle(message):
+        if message[0] == "call":
+            getattr(engine, message[1])(*message[2])
+        elif message[0] == "set":
+            setattr(engine, message[1], message[2])
+
+    def read_commands():
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break  # the GUI went away
+            if message[0] == "stop":
+                break
+            runner.call_soon(handle, message)
+        runner.stop()
+
+    threading.Thread(target=read_commands, name="worker-commands", daemon=True).start()
+    try:
+        runner.run()
+        after_batch()
+    finally:
+        engine.close()
+        ring.close()
+        conn.close()
+
+
+class WorkerEngine:
+    # Stands in for MQTTEngine in the GUI process while the real engine runs
+    # in a worker process. Same event API, so MQTTModel works unchanged:
+    # "wakeup" fires on the pipe reader thread, process_ingest() then runs on
+    # the Qt thread and emits "device", "round_trip", "message" and friends.
+    def __init__(
+        self,
+        local_pool_size=1,
+        telemetry_path=None,
+        ring_capacity=4096,
+        message_log_rate=100,
+        groups_path=None,
+        outbox_path=None,
+    ):
+        self.listeners = collections.defaultdict(list)
+        self.ring = DeviceStateRing.create(ring_capacity)
+        self.inbox = collections.deque()
+        self.names = {}  # raw name bytes -> str
+        self.devices = {
+            f"ESP32-{i+1}": {"status": "Disconnected", "last_seen": 0, "state": "OFF"}
+            for i in range(6)
+        }
+        self.round_trips = RoundTripTracker()
+        self.groups = DeviceGroups(groups_path)
+        self.status_poller = StatusPoller()  # only its tick is used here
+        self.worker_stats = {}
+        self.records = 0
+        self._transport = "local"
+        self.worker_gone = False
+
+        self.metrics = MetricsRegistry()
+        self.metrics.gauge(
+            "mqtt_worker_ring_depth",
+            "Records waiting in the worker ring",
+            fn=lambda: self.ring.depth if self.ring.buf is not None else None,
+        )
+        self.metrics.counter(
+            "mqtt_worker_records_total",
+            "Records read from the worker ring",
+            fn=lambda: self.records,
+        )
+        self.metrics.counter(
+            "mqtt_worker_received_total",
+            "Messages the worker took from the broker",
+            fn=lambda: self.worker_stats.get("ingest", {}).get("received"),
+        )
+        self.metrics.counter(
+            "mqtt_worker_dropped_total",
+            "Messages the worker dropped with a full ingest queue",
+            fn=lambda: self.worker_stats.get("ingest", {}).get("dropped"),
+        )
+        self.metrics.counter(
+            "mqtt_worker_coalesced_total",
+            "Device rows merged while the ring was full",
+            fn=lambda: self.worker_stats.get("ring", {}).get("coalesced"),
+        )
+
+        # spawn, as forking a process with Qt in it is not safe
+        context = multiprocessing.get_context("spawn")
+        self.conn, worker_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(
+                worker_conn,
+                self.ring.name,
+                {
+                    "local_pool_size": local_pool_size,
+                    "telemetry_path": telemetry_path,
+                    "outbox_path": outbox_path,
+                    "message_log_rate": message_log_rate,
+                    "groups": self.groups.groups,
+                    "scenes": self.groups.scenes,
+                    "log_level": logging.getLogger().getEffectiveLevel(),
+                },
+            ),
+            name="mqtt-ingest-worker",
+            daemon=True,
+        )
+        self.process.start()
+        worker_conn.close()
+        self.reader = threading.Thread(
+            target=self.read_events, name="worker-events", daemon=True
+        )
+        self.reader.start()
+
+    def on(self, event, callback):
+        self.listeners[event].append(callback)
+
+    def emit(self, event, *args):
+        for callback in self.listeners[event]:
+            callback(*args)
+
+    def read_events(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] != "wake":
+                self.inbox.append(message)
+            self.emit("wakeup")
+        self.inbox.append(("worker_gone", "Ingest worker stopped"))
+        self.emit("wakeup")
+
+    def process_ingest(self, max_batch=500):
+        # Same contract as MQTTEngine.process_ingest, on the Qt thread
+        for _ in range(min(len(self.inbox), max_batch)):
+            self.handle_event(self.inbox.popleft())
+        if self.ring.buf is None:
+            return 0
+        names = self.names
+        now = time.time()
+        for kind, raw, status, state, value, ts in self.ring.read(max_batch):
+            device = names.get(raw)
+            if device is None:
+                device = names[raw] = raw.decode()
+            self.records += 1
+            if kind == DEVICE:
+                self.apply_device(device, STATUSES[status], STATES[state], now)
+            elif kind == ROUND_TRIP:
+                self.round_trips.record(device, value)
+                self.emit("round_trip", device, value)
+        return self.ring.depth + len(self.inbox)
+
+    def apply_device(self, device, status, state, now):
+        info = self.devices.get(device)
+        if info is None:
+            info = self.devices[device] = {}
+        info["status"] = status
+        info["state"] = state
+        info["last_seen"] = now
+        self.emit("device", device, status, state)
+
+    def handle_event(self, message):
+        kind = message[0]
+        if kind == "device":
+            self.apply_device(*message[1:], time.time())
+        elif kind == "round_trip":
+            self.round_trips.record(*message[1:])
+            self.emit(*message)
+        elif kind == "worker_gone":
+            self.on_worker_gone(message[1])
+        elif kind == "stats":
+            self.worker_stats = message[1]
+            round_trips = message[1]["round_trips"]
+            self.round_trips.sent = round_trips["sent"]
+            self.round_trips.lost = round_trips["lost"]
+            self.round_trips.unmatched = round_trips["unmatched"]
+            self.round_trips.cancelled = round_trips["cancelled"]
+        else:
+            self.emit(*message)
+
+    def send(self, message):
+        # Runs in Qt slots, so a dead worker's broken pipe is reported
+        # instead of raised
+        if self.worker_gone:
+            return
+        try:
+            self.conn.send(message)
+        except (OSError, EOFError) as e:
+            self.on_worker_gone(f"Ingest worker unavailable: {e}")
+
+    def on_worker_gone(self, reason):
+        # Once, whichever of the reader and a failed send notices first
+        if self.worker_gone:
+            return
+        self.worker_gone = True
+        self.emit("log", reason)
+        self.emit("connection_status", FAILED)
+
+    def call(self, method, *args):
+        self.send(("call", method, args))
+
+    @property
+    def transport(self):
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport):
+        if transport != self._transport:
+            self._transport = transport
+            self.send(("set", "transport", transport))
+
+    # The MQTTEngine methods the controller uses, forwarded to the worker.
+    # Results arrive as events; connect returns at once like connect_aws.
+
+    def connect_local(self, server, port):
+        self.call("connect_local", server, port)
+        return 100
+
+    def disconnect_local(self):
+        self.call("disconnect_local")
+
+    def connect_aws(self, server, port, client_id):
+        self.call("connect_aws", server, port, client_id)
+
+    def disconnect_aws(self):
+        self.call("disconnect_aws")
+
+    def set_publish_topic_local(self, topic):
+        self.call("set_publish_topic_local", topic)
+
+    def set_publish_topic_aws(self, topic):
+        self.call("set_publish_topic_aws", topic)
+
+    def set_subscribe_topics_local(self, topics):
+        # Malformed filters raise here, as they would in the engine
+        for topic in topics:
+            split_filter(topic)
+        self.call("set_subscribe_topics_local", list(topics))
+
+    def set_subscribe_topics_aws(self, topics):
+        for topic in topics:
+            split_filter(topic)
+        self.call("set_subscribe_topics_aws", list(topics))
+
+    def publish_message_local(self, message, device=None):
+        self.call("publish_message_local", message, device)
+
+    def publish_message_aws(self, message, device=None):
+        self.call("publish_message_aws", message, device)
+
+    def send_control(self, device, action):
+        self.call("send_control", device, action)
+
+    def send_group(self, group, action):
+        self.groups.members(group)  # unknown groups raise here
+        self.call("send_group", group, action)
+
+    def send_devices(self, devices, action, name="selection"):
+        self.call("send_devices", list(devices), action, name)
+
+    def apply_scene(self, scene):
+        self.groups.resolve_scene(scene)
+        self.call("apply_scene", scene)
+
+    def expire_group_commands(self):
+        self.call("expire_group_commands")
+
+    def define_group(self, name, devices):
+        self.groups.define_group(name, devices)
+        self.call("define_group", name, self.groups.groups[name])
+
+    def remove_group(self, name):
+        self.groups.remove_group(name)
+        self.call("remove_group", name)
+
+    def define_scene(self, name, actions):
+        self.groups.define_scene(name, actions)
+        self.call("define_scene", name, self.groups.scenes[name])
+
+    def remove_scene(self, name):
+        self.groups.remove_scene(name)
+        self.call("remove_scene", name)
+
+    def run_status_cycle(self):
+        self.call("run_status_cycle")
+
+    def start_capture(self, path):
+        self.call("start_capture", path)
+
+    def replay(self, path, speed=1.0):
+        self.call("replay", path, speed)
+
+    def publisher_stats(self):
+        return self.worker_stats.get("publishers", {})
+
+    def stats(self):
+        stats = dict(self.worker_stats)
+        stats["records"] = self.records
+        return stats
+
+    def close(self, timeout=5.0):
+        self.send(("stop",))
+        # The reader's end of pipe event is expected from here on
+        self.worker_gone = True
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+        self.ring.close()
@@ -0,0 +1,204 @@
+import array
+import itertools
+import math
+import threading
+import time
+from commands import BROADCAST_DEVICE
+
+
+class LatencyHistogram:
+    # HDR-style log-linear histogram over integer microseconds. Every power
+    # of two range is split into 2**(significant_bits - 1) buckets, so values
+    # are kept to within 1 / 2**(significant_bits - 1) relative error and
+    # memory stays fixed no matter how many samples are recorded.
+    def __init__(self, max_seconds=60.0, significant_bits=5):
+        self.sub_bits = significant_bits
+        self.sub_count = 1 << significant_bits
+        self.half = self.sub_count >> 1
+        self.max_value = int(max_seconds * 1e6)
+        self.reset()
+
+    def reset(self):
+        self.counts = array.array("I", bytes(4 * (self.index_of(self.max_value) + 1)))
+        self.count = 0
+        self.total = 0
+        self.min_value = None
+        self.max_recorded = 0
+
+    def index_of(self, value):
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bits
+        return shift * self.half + (value >> shift)
+
+    def highest_value_at(self, index):
+        # Largest value that lands in this bucket
+        if index < self.sub_count:
+            return index
+        shift = index // self.half - 1
+        return ((index - shift * self.half + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1e6), 0), self.max_value)
+        self.counts[self.index_of(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+        if value > self.max_recorded:
+            self.max_recorded = value
+
+    def percentile(self, percent):
+        # In seconds, None until something was recorded
+        if not self.count:
+            return None
+        target = max(1, math.ceil(self.count * percent / 100.0))
+        seen = 0
+        for index, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= target:
+                return min(self.highest_value_at(index), self.max_recorded) / 1e6
+        return self.max_recorded / 1e6
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count / 1e6
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "min": None if self.min_value is None else self.min_value / 1e6,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max_recorded / 1e6 if self.count else None,
+        }
+
+
+class RoundTripTracker:
+    # Pending-command table. send() hands out the correlation ID that goes
+    # into the command payload; on_reply() matches the echoed ID and records
+    # the round trip per device and fleet-wide. Broadcasts stay pending until
+    # they time out because every device may answer them. Commands are also
+    # cancelled from the outbox and publisher threads, hence the lock.
+    def __init__(self, timeout=30.0, max_pending=10000, clock=time.monotonic):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.clock = clock
+        self.lock = threading.RLock()
+
+        self.ids = itertools.count(1)
+        self.pending = {}  # id -> (device, action, sent), oldest first
+        self.fleet = LatencyHistogram(significant_bits=7)
+        self.devices = {}
+        self.lost_by_device = {}
+
+        self.sent = 0
+        self.matched = 0
+        self.unmatched = 0
+        self.lost = 0
+        self.cancelled = 0
+
+    def next_id(self):
+        # Also hands out the IDs of group commands, tracked elsewhere
+        with self.lock:
+            command_id = next(self.ids)
+            if command_id > 0x7FFFFFFF:
+                # The firmware echoes a signed 32-bit long
+                self.ids = itertools.count(2)
+                command_id = 1
+            return command_id
+
+    def send(self, device, action):
+        with self.lock:
+            command_id = self.next_id()
+            if len(self.pending) >= self.max_pending:
+                self.drop_oldest()
+            self.pending[command_id] = (device, action, self.clock())
+            self.sent += 1
+            return command_id
+
+    def cancel(self, command_id):
+        # The command was never published, so no reply is missing
+        with self.lock:
+            if self.pending.pop(command_id, None) is not None:
+                self.cancelled += 1
+
+    def on_reply(self, device, command_id):
+        # Returns the round trip in seconds, or None if nothing was waiting
+        with self.lock:
+            entry = self.pending.get(command_id)
+            if entry is None or (entry[0] != device and entry[0] != BROADCAST_DEVICE):
+                self.unmatched += 1
+                return None
+            if entry[0] == device:
+                del self.pending[command_id]
+            latency = self.clock() - entry[2]
+            self.record(device, latency)
+            self.matched += 1
+            return latency
+
+    def record(self, device, latency):
+        # Also used to mirror round trips measured in another process
+        with self.lock:
+            self.fleet.record(latency)
+            histogram = self.devices.get(device)
+            if histogram is None:
+                histogram = self.devices[device] = LatencyHistogram()
+            histogram.record(latency)
+
+    def drop_oldest(self):
+        with self.lock:
+            command_id = next(iter(self.pending))
+            device = self.pending.pop(command_id)[0]
+            if device != BROADCAST_DEVICE:
+                self.lost += 1
+                self.lost_by_device[device] = self.lost_by_device.get(device, 0) + 1
+
+    def expire(self):
+        # Entries are in send order, so stop at the first one still in time
+        with self.lock:
+            deadline = self.clock() - self.timeout
+            while self.pending:
+                sent = self.pending[next(iter(self.pending))][2]
+                if sent > deadline:
+                    break
+                self.drop_oldest()
+
+    def device_summary(self, device):
+        with self.lock:
+            histogram = self.devices.get(device)
+            if histogram is None:
+                summary = dict.fromkeys(("min", "mean", "p50", "p90", "p99", "max"))
+                summary["count"] = 0
+            else:
+                summary = histogram.summary()
+            summary["lost"] = self.lost_by_device.get(device, 0)
+            return summary
+
+    def slowest(self, count=5):
+        # Devices with the worst p99 round trip
+        with self.lock:
+            ranked = sorted(
+                self.devices.items(),
+                key=lambda item: item[1].percentile(99),
+                reverse=True,
+            )
+            return [
+                (device, histogram.percentile(99))
+                for device, histogram in ranked[:count]
+            ]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pending": len(self.pending),
+                "sent": self.sent,
+                "matched": self.matched,
+                "unmatched": self.unmatched,
+                "lost": self.lost,
+                "cancelled": self.cancelled,
+                "fleet": self.fleet.summary(),
+            }
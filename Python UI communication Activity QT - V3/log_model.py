@@ -0,0 +1,126 @@
+import json
+from datetime import datetime
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt, QTimer
+
+
+class RingBuffer:
+    # Fixed-capacity buffer; the oldest entries are overwritten once full
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = [None] * capacity
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self.size:
+            raise IndexError(index)
+        return self.items[(self.start + index) % self.capacity]
+
+    def extend(self, entries):
+        for entry in entries:
+            self.items[(self.start + self.size) % self.capacity] = entry
+            self.size += 1
+
+    def drop_oldest(self, count):
+        for i in range(count):
+            self.items[(self.start + i) % self.capacity] = None
+        self.start = (self.start + count) % self.capacity
+        self.size -= count
+
+    def clear(self):
+        self.items = [None] * self.capacity
+        self.start = 0
+        self.size = 0
+
+
+class LogListModel(QAbstractListModel):
+    def __init__(self, capacity=5000, flush_interval_ms=100, date_format="%H:%M:%S"):
+        super().__init__()
+        self.buffer = RingBuffer(capacity)
+        self.pending = []
+        self.date_format = date_format
+
+        # New entries are collected and inserted in one batch per timer tick
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(flush_interval_ms)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def append(self, message, timestamp=None):
+        # Store the raw entry only, formatting happens in data() for visible rows
+        if timestamp is None:
+            timestamp = datetime.now().timestamp()
+        self.pending.append((timestamp, message))
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        if not self.pending:
+            return
+        capacity = self.buffer.capacity
+        batch = self.pending[-capacity:]
+        self.pending = []
+
+        overflow = len(self.buffer) + len(batch) - capacity
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            self.buffer.drop_oldest(overflow)
+            self.endRemoveRows()
+
+        first = len(self.buffer)
+        self.beginInsertRows(QModelIndex(), first, first + len(batch) - 1)
+        self.buffer.extend(batch)
+        self.endInsertRows()
+
+    def clear(self):
+        self.pending = []
+        self.beginResetModel()
+        self.buffer.clear()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.buffer)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            timestamp, message = self.buffer[index.row()]
+            formatted_time = datetime.fromtimestamp(timestamp).strftime(
+                self.date_format
+            )
+            return f"{formatted_time}  {self.compact(message)}"
+        if role == Qt.ToolTipRole:
+            timestamp, message = self.buffer[index.row()]
+            formatted_time = datetime.fromtimestamp(timestamp).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            )
+            return f"{formatted_time}\n{self.pretty(message)}"
+        return None
+
+    @staticmethod
+    def as_text(message):
+        if isinstance(message, bytes):
+            try:
+                return message.decode()
+            except UnicodeDecodeError:
+                # Compact binary commands (MessagePack/CBOR)
+                return f"<{len(message)} bytes> {message.hex(' ')}"
+        return message
+
+    @staticmethod
+    def compact(message):
+        return " ".join(LogListModel.as_text(message).split())
+
+    @staticmethod
+    def pretty(message):
+        message = LogListModel.as_text(message)
+        try:
+            return json.dumps(json.loads(message), indent=4)
+        except ValueError:
+            return message
@@ -1,19 +1,89 @@
+import argparse
+import asyncio
 import sys
 from PyQt5 import QtWidgets
 from model import MQTTModel
 from view import MQTTView
 from controller import MQTTController
+from metrics import MetricsServer
 import logging
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--capture", help="record incoming traffic to this file")
+    parser.add_argument("--replay", help="replay a capture file into the UI")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="replay speed factor, 0 for max"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, help="serve Prometheus metrics on this port"
+    )
+    parser.add_argument(
+        "--no-metrics", action="store_true", help="start with instrumentation off"
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="run the local MQTT transport on the Qt thread (needs qasync)",
+    )
+    parser.add_argument(
+        "--history-size",
+        type=int,
+        default=100000,
+        help="messages kept in the searchable history",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="run the broker connection and ingest in a separate process",
+    )
+    # Everything else is left for Qt
+    args, qt_args = parser.parse_known_args()
+
     try:
-        app = QtWidgets.QApplication(sys.argv)
+        app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+
+        # One thread for widgets, coroutines and broker traffic
+        loop = None
+        if args.asyncio:
+            try:
+                import qasync
+            except ImportError:
+                logging.error("qasync is not installed, using the threaded transport")
+            else:
+                loop = qasync.QEventLoop(app)
+                asyncio.set_event_loop(loop)
 
         # Initialize the view
-        view = MQTTView(None)  # Create the view without controller initially
+        # Create the view without controller initially
+        view = MQTTView(None, history_size=args.history_size)
 
         # Initialize the model, passing the view
-        model = MQTTModel(view)
+        if args.worker:
+            # Devices arrive through a shared memory ring from the worker,
+            # imported here so a normal start does not pay for it
+            from ingest_worker import WorkerEngine
+
+            model = MQTTModel(
+                view,
+                engine=WorkerEngine(
+                    telemetry_path="telemetry",
+                    groups_path="groups.json",
+                    outbox_path="outbox",
+                ),
+            )
+        else:
+            model = MQTTModel(
+                view,
+                telemetry_path="telemetry",
+                asyncio_loop=loop,
+                groups_path="groups.json",
+                outbox_path="outbox",
+            )
+        app.aboutToQuit.connect(model.close)
+
+        if args.no_metrics:
+            model.metrics.enabled = False
 
         # Initialize the controller
         controller = MQTTController(model, view)
@@ -21,7 +91,21 @@ if __name__ == "__main__":
         # Bind the view to the controller
         view.controller = controller
 
+        if args.capture:
+            model.start_capture(args.capture)
+        if args.replay:
+            model.replay(args.replay, args.speed)
+        if args.metrics_port:
+            metrics_server = MetricsServer(model.metrics, args.metrics_port).start()
+            app.aboutToQuit.connect(metrics_server.stop)
+            view.stats_panel.set_endpoint(metrics_server.address)
+
         view.show()
+        if loop is not None:
+            # qasync runs app.exec_() and returns when the app quits
+            with loop:
+                loop.run_forever()
+            sys.exit(0)
         sys.exit(app.exec_())
     except Exception as e:
         logging.error(f"Failed application: {e}")
@@ -0,0 +1,246 @@
+import array
+import heapq
+import json
+import time
+from bisect import bisect_left
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+INBOUND = "in"
+OUTBOUND = "out"
+
+# Payload fields that become search terms, next to topic and direction
+FIELDS = ("device", "type", "state", "status")
+KEYS = ("dir", "topic") + FIELDS
+
+# Rough per-message cost beyond the payload: slot references, the bytes
+# object header and a handful of postings
+ENTRY_OVERHEAD = 128
+
+
+def parse_payload(payload):
+    if not payload.startswith(b"{"):
+        return None
+    try:
+        doc = orjson.loads(payload) if orjson is not None else json.loads(payload)
+    except ValueError:
+        return None
+    return doc if isinstance(doc, dict) else None
+
+
+def message_terms(direction, topic, payload):
+    terms = {"dir:" + direction}
+    if topic:
+        terms.add("topic:" + topic.lower())
+    doc = parse_payload(payload)
+    if doc is None:
+        return terms
+    for field in FIELDS:
+        value = doc.get(field)
+        if isinstance(value, str):
+            terms.add(f"{field}:{value.lower()}")
+    devices = doc.get("devices")
+    if isinstance(devices, list):
+        # Group commands list their members
+        for device in devices:
+            if isinstance(device, str):
+                terms.add("device:" + device.lower())
+    return terms
+
+
+class MessageIndex:
+    # Recent messages in a ring with an inverted index from terms like
+    # "device:esp32-7" or "state:on" to the sequence numbers carrying them.
+    # Sequence numbers only grow, so every posting list is sorted and
+    # evicted messages are a prefix of it; postings are trimmed in a sweep
+    # once the ring turned over a quarter of its capacity, queries skip the
+    # stale prefix with a bisect until then. The slots are allocated as
+    # messages arrive, doubling up to capacity.
+    def __init__(self, capacity=1000000, max_bytes=256 * 1024 * 1024, initial=4096):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.allocated = 0
+        self.payloads = []
+        self.topics = []
+        self.directions = []
+        self.timestamps = array.array("d")
+        self.sizes = array.array("I")
+        self.grow(min(initial, capacity))
+        self.postings = {}  # term -> array of sequence numbers
+        self.oldest = 0
+        self.next_seq = 0
+        self.bytes = 0
+        self.evicted = 0
+        self.sweep_every = max(1, capacity // 4)
+        self.until_sweep = self.sweep_every
+
+    def __len__(self):
+        return self.next_seq - self.oldest
+
+    def add(self, direction, topic, payload, timestamp=None):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if timestamp is None:
+            timestamp = time.time()
+        size = len(payload) + ENTRY_OVERHEAD
+        while len(self) and (
+            len(self) >= self.capacity or self.bytes + size > self.max_bytes
+        ):
+            self.evict_oldest()
+
+        seq = self.next_seq
+        slot = seq % self.capacity
+        if slot >= self.allocated:
+            # Only before the first wrap, when slot == allocated
+            self.grow(min(self.allocated * 2, self.capacity) - self.allocated)
+        self.payloads[slot] = payload
+        self.topics[slot] = topic
+        self.directions[slot] = direction
+        self.timestamps[slot] = timestamp
+        self.sizes[slot] = size
+        self.bytes += size
+        self.next_seq = seq + 1
+
+        postings = self.postings
+        for term in message_terms(direction, topic, payload):
+            posting = postings.get(term)
+            if posting is None:
+                posting = postings[term] = array.array("q")
+            posting.append(seq)
+        return seq
+
+    def grow(self, count):
+        self.payloads.extend([None] * count)
+        self.topics.extend([None] * count)
+        self.directions.extend([None] * count)
+        self.timestamps.frombytes(bytes(8 * count))
+        self.sizes.frombytes(bytes(4 * count))
+        self.allocated += count
+
+    def evict_oldest(self):
+        slot = self.oldest % self.capacity
+        self.bytes -= self.sizes[slot]
+        self.payloads[slot] = None
+        self.topics[slot] = None
+        self.oldest += 1
+        self.evicted += 1
+        self.until_sweep -= 1
+        if not self.until_sweep:
+            self.sweep()
+
+    def sweep(self):
+        # Drops postings of evicted messages and terms that have none left
+        self.until_sweep = self.sweep_every
+        oldest = self.oldest
+        for term in list(self.postings):
+            posting = self.postings[term]
+            cut = bisect_left(posting, oldest)
+            if cut == len(posting):
+                del self.postings[term]
+            elif cut:
+                del posting[:cut]
+
+    def entry(self, seq):
+        # (timestamp, direction, topic, payload), None once evicted
+        if not self.oldest <= seq < self.next_seq:
+            return None
+        slot = seq % self.capacity
+        return (
+            self.timestamps[slot],
+            self.directions[slot],
+            self.topics[slot],
+            self.payloads[slot],
+        )
+
+    def clause(self, token):
+        # Posting lists for one query word: "key:value" looks at that key,
+        # a bare word at every key, a trailing * matches a prefix
+        key, sep, value = token.partition(":")
+        if sep and key in KEYS:
+            keys = (key,)
+        else:
+            keys, value = KEYS, token
+        if value.endswith("*"):
+            prefixes = tuple(f"{key}:{value[:-1]}" for key in keys)
+            return [
+                posting
+                for term, posting in self.postings.items()
+                if term.startswith(prefixes)
+            ]
+        terms = (f"{key}:{value}" for key in keys)
+        return [self.postings[term] for term in terms if term in self.postings]
+
+    def live(self, posting):
+        return len(posting) - bisect_left(posting, self.oldest)
+
+    def search(self, query, limit=1000, scan_limit=50000):
+        # Newest first. Returns (sequence numbers, total) where total is
+        # None when there may be more than were returned. Words are ANDed;
+        # the clause with the fewest postings drives the scan and the
+        # others are probed with a bisect. Terms that rarely meet cost a
+        # scan, scan_limit bounds it.
+        tokens = query.lower().split()
+        if not tokens:
+            return [], 0
+        clauses = []
+        for token in tokens:
+            postings = self.clause(token)
+            if not postings:
+                return [], 0
+            clauses.append((sum(self.live(posting) for posting in postings), postings))
+        clauses.sort(key=lambda clause: clause[0])
+        driving = clauses[0][1]
+        others = [postings for _, postings in clauses[1:]]
+
+        if len(driving) == 1:
+            posting = driving[0]
+            start = bisect_left(posting, self.oldest)
+            if not others:
+                newest = posting[max(start, len(posting) - limit) :]
+                return newest[::-1].tolist(), len(posting) - start
+            candidates = (posting[i] for i in range(len(posting) - 1, start - 1, -1))
+        else:
+            # Bare words and prefixes can hit several terms of one message
+            candidates = unique(
+                heapq.merge(*(reversed(posting) for posting in driving), reverse=True)
+            )
+
+        matches = []
+        scanned = 0
+        oldest = self.oldest
+        for seq in candidates:
+            if seq < oldest:
+                break
+            scanned += 1
+            if all(any(contains(p, seq) for p in postings) for postings in others):
+                matches.append(seq)
+                if len(matches) >= limit:
+                    return matches, None
+            if scanned >= scan_limit:
+                return matches, None
+        return matches, len(matches)
+
+    def stats(self):
+        return {
+            "messages": len(self),
+            "bytes": self.bytes,
+            "terms": len(self.postings),
+            "postings": sum(len(posting) for posting in self.postings.values()),
+            "evicted": self.evicted,
+        }
+
+
+def contains(posting, seq):
+    i = bisect_left(posting, seq)
+    return i < len(posting) and posting[i] == seq
+
+
+def unique(sequence):
+    last = None
+    for item in sequence:
+        if item != last:
+            yield item
+            last = item
@@ -0,0 +1,273 @@
+import bisect
+import http.server
+import logging
+import math
+import threading
+
+# Seconds, from 50 us to 5 s
+LATENCY_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def bucket_quantile(snapshot, q):
+    # From a Histogram.get() snapshot, interpolating linearly inside the
+    # bucket as Prometheus does
+    count = snapshot["count"]
+    if not count:
+        return None
+    rank = q * count
+    lower, below = 0.0, 0
+    for bound, cumulative in snapshot["buckets"]:
+        if cumulative >= rank:
+            if bound == math.inf:
+                return lower
+            inside = cumulative - below
+            return lower + (bound - lower) * (rank - below) / max(inside, 1)
+        lower, below = bound, cumulative
+    return lower
+
+
+class Counter:
+    # Either incremented directly or backed by fn, which reads a count the
+    # code already keeps, so existing counters cost nothing extra
+    kind = "counter"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.fn = fn
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        return self.fn() if self.fn else self.value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    # Fixed upper bounds, counts per bucket are cumulated only when rendered
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def get(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for bound, bucket in zip(self.bounds + (math.inf,), counts):
+            running += bucket
+            cumulative.append((bound, running))
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+    def quantile(self, q):
+        return bucket_quantile(self.get(), q)
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.sum = 0.0
+            self.count = 0
+
+
+class MetricsRegistry:
+    # Counters, gauges and histograms for the whole process. Timings on hot
+    # paths are taken only when sample() says so: while disabled that is a
+    # single attribute check, while enabled one message in sample_every is
+    # timed. Counts backed by fn are always exact.
+    def __init__(self, enabled=True, sample_every=64):
+        self.enabled = enabled
+        self.sample_every = sample_every
+        self.countdown = sample_every
+        self.metrics = {}  # (name, labels) -> metric, in registration order
+        self.lock = threading.Lock()
+
+    def sample(self):
+        if not self.enabled:
+            return False
+        # Racy between threads, which only shifts the next sample a little
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.sample_every
+        return True
+
+    def register(self, metric):
+        key = (metric.name, metric.labels)
+        with self.lock:
+            existing = self.metrics.get(key)
+            if existing is not None:
+                if existing.kind != metric.kind:
+                    raise ValueError(f"{metric.name} is already a {existing.kind}")
+                return existing
+            self.metrics[key] = metric
+        return metric
+
+    def counter(self, name, help, labels=None, fn=None):
+        return self.register(Counter(name, help, self.label_key(labels), fn))
+
+    def gauge(self, name, help, labels=None, fn=None):
+        return self.register(Gauge(name, help, self.label_key(labels), fn))
+
+    def histogram(self, name, help, labels=None, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, self.label_key(labels), buckets))
+
+    def unregister(self, name):
+        with self.lock:
+            for key in [key for key in self.metrics if key[0] == name]:
+                del self.metrics[key]
+
+    @staticmethod
+    def label_key(labels):
+        return tuple(sorted(labels.items())) if labels else ()
+
+    def collect(self):
+        # [(name, help, kind, [(labels, value)])] grouped by name. A metric
+        # whose fn fails or returns None is left out of this scrape.
+        with self.lock:
+            metrics = list(self.metrics.values())
+        families = {}
+        for metric in metrics:
+            try:
+                value = metric.get()
+            except Exception as e:
+                logging.debug(f"Metric {metric.name} failed: {e}")
+                continue
+            if value is None:
+                continue
+            family = families.get(metric.name)
+            if family is None:
+                family = families[metric.name] = (
+                    metric.name,
+                    metric.help,
+                    metric.kind,
+                    [],
+                )
+            family[3].append((metric.labels, value))
+        return list(families.values())
+
+    def render_prometheus(self):
+        lines = []
+        for name, help, kind, samples in self.collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if kind != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                for bound, cumulative in value["buckets"]:
+                    bucket_labels = labels + (("le", format_value(float(bound))),)
+                    lines.append(
+                        f"{name}_bucket{format_labels(bucket_labels)} {cumulative}"
+                    )
+                lines.append(
+                    f"{name}_sum{format_labels(labels)} {format_value(value['sum'])}"
+                )
+                lines.append(f"{name}_count{format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset_histograms(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            if metric.kind == "histogram":
+                metric.reset()
+
+
+class MetricsServer:
+    # Serves the registry as Prometheus text on http://host:port/metrics.
+    # Binds to localhost unless told otherwise.
+    def __init__(self, registry, port=9108, host="127.0.0.1"):
+        self.registry = registry
+        registry_ref = registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry_ref.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Metrics request: {format % args}")
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="metrics-server"
+        )
+        self.thread.daemon = True
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,418 @@
+import collections
+import logging
+import os
+import struct
+import threading
+import time
+
+# Spill file record, little endian:
+#   <u32 length of the rest> <u64 seq> <f64 expires, wall clock, 0 = never>
+#   <u16 topic length> <u16 device length> <u16 coalesce key length>
+#   topic, device and key utf-8, then the payload
+RECORD = struct.Struct("<IQdHHH")
+LENGTH = struct.Struct("<I")
+# Rough per-message cost in memory beyond topic and payload
+ENTRY_OVERHEAD = 96
+
+
+def encode_record(seq, expires, topic, payload, device, key):
+    topic = topic.encode()
+    device = (device or "").encode()
+    key = (key or "").encode()
+    body_size = RECORD.size - LENGTH.size + len(topic) + len(device) + len(key)
+    return (
+        RECORD.pack(
+            body_size + len(payload), seq, expires, len(topic), len(device), len(key)
+        )
+        + topic
+        + device
+        + key
+        + payload
+    )
+
+
+def decode_record(data):
+    length, seq, expires, topic_size, device_size, key_size = RECORD.unpack_from(data)
+    offset = RECORD.size
+    topic = data[offset : offset + topic_size].decode()
+    offset += topic_size
+    device = data[offset : offset + device_size].decode() or None
+    offset += device_size
+    key = data[offset : offset + key_size].decode() or None
+    offset += key_size
+    return seq, expires, topic, bytes(data[offset:]), device, key
+
+
+class StoreAndForward:
+    # Holds publishes while the transport is down and forwards them in
+    # order once it is back, at drain_rate messages per second so a long
+    # outage does not end in a flood. Up to max_memory_bytes are kept in
+    # memory, the rest is appended to spill_path and read back in order;
+    # without a spill file the oldest messages are dropped instead.
+    #
+    # Messages with a coalesce key replace the queued message with the same
+    # key, so only the latest command per device goes out. A ttl drops a
+    # message that waited longer than that. forward(topic, payload, device,
+    # tag) is called in submission order, one message at a time, and
+    # on_drop(topic, payload, device, tag) for every message that is
+    # replaced, expires or is dropped for space. Neither runs with the lock
+    # held, so both may block or call back into the outbox. tag is whatever
+    # the caller passed to submit(), such as a command's correlation ID; it
+    # is not written to the spill file, so it is None for messages recovered
+    # after a restart.
+    #
+    # While online and empty, submit() forwards on the calling thread. With
+    # direct=False every message goes through the drain thread instead, for
+    # a forward() that may block.
+    def __init__(
+        self,
+        forward,
+        spill_path=None,
+        max_memory_bytes=1024 * 1024,
+        drain_rate=50.0,
+        name="outbox",
+        clock=time.time,
+        on_drop=None,
+        direct=True,
+    ):
+        self.forward = forward
+        self.direct = direct
+        self.on_drop = on_drop
+        self.spill_path = spill_path
+        self.max_memory_bytes = max_memory_bytes
+        self.drain_rate = drain_rate
+        self.name = name
+        self.clock = clock
+
+        self.cond = threading.Condition()
+        self.online = False
+        self.closing = False
+        self.forwarding = False  # a forward() call is running
+        self.drops = []  # entries for on_drop, handed over outside the lock
+        self.thread = None
+
+        self.memory = collections.OrderedDict()  # seq -> entry, oldest first
+        self.memory_bytes = 0
+        self.latest = {}  # coalesce key -> seq of the message that counts
+        self.spilled_tags = {}  # seq -> tag of spilled messages
+        self.next_seq = 1
+
+        # Spill file: written at the end, read from read_offset
+        self.spill_file = None
+        self.read_offset = 0
+        self.spilled = 0  # records in the file not read back yet
+
+        self.submitted = 0
+        self.forwarded = 0
+        self.queued = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.dropped = 0
+        self.spilled_total = 0
+
+        if spill_path:
+            self.recover()
+
+    def submit(self, topic, payload, device=None, ttl=None, key=None, tag=None):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self.cond:
+            self.submitted += 1
+            direct = (
+                self.direct
+                and self.online
+                and not self.forwarding
+                and not self.memory
+                and not self.spilled
+            )
+            if direct:
+                # Nothing waiting or in flight, so nothing to overtake
+                self.forwarding = True
+            else:
+                self.hold(topic, payload, device, ttl, key, tag)
+        if direct:
+            try:
+                self.forward(topic, payload, device, tag)
+            finally:
+                self.forwarded_one()
+        else:
+            self.flush_drops()
+        return direct
+
+    def hold(self, topic, payload, device, ttl, key, tag):
+        seq = self.next_seq
+        self.next_seq += 1
+        expires = self.clock() + ttl if ttl else 0.0
+        if key is not None:
+            self.supersede(key)
+            self.latest[key] = seq
+        self.queued += 1
+        self.enqueue((seq, expires, topic, payload, device, key, tag))
+        self.ensure_thread()
+        self.cond.notify_all()
+
+    def forwarded_one(self):
+        with self.cond:
+            self.forwarding = False
+            self.forwarded += 1
+            self.cond.notify_all()
+
+    def supersede(self, key):
+        old_seq = self.latest.get(key)
+        if old_seq is None:
+            return
+        self.coalesced += 1
+        entry = self.memory.pop(old_seq, None)
+        if entry is not None:
+            self.memory_bytes -= self.entry_size(entry)
+            self.discard(entry)
+        # A spilled one is skipped when it is read back
+
+    def discard(self, entry):
+        # With the lock held; flush_drops() reports it once released
+        if self.on_drop is not None:
+            self.drops.append(entry)
+
+    def flush_drops(self):
+        if not self.drops:
+            return
+        with self.cond:
+            drops, self.drops = self.drops, []
+        for entry in drops:
+            try:
+                self.on_drop(entry[2], entry[3], entry[4], entry[6])
+            except Exception as e:
+                logging.error(f"{self.name}: drop callback failed: {e}")
+
+    @staticmethod
+    def entry_size(entry):
+        return len(entry[2]) + len(entry[3]) + ENTRY_OVERHEAD
+
+    def enqueue(self, entry):
+        size = self.entry_size(entry)
+        fits = self.memory_bytes + size <= self.max_memory_bytes
+        if not self.spilled and (fits or not self.memory):
+            self.memory[entry[0]] = entry
+            self.memory_bytes += size
+        elif self.spill_path:
+            self.spill(entry)
+        else:
+            while self.memory and self.memory_bytes + size > self.max_memory_bytes:
+                oldest = self.memory.popitem(last=False)[1]
+                self.forget(oldest)
+                self.discard(oldest)
+                self.dropped += 1
+            self.memory[entry[0]] = entry
+            self.memory_bytes += size
+
+    def forget(self, entry):
+        self.memory_bytes -= self.entry_size(entry)
+        key = entry[5]
+        if key is not None and self.latest.get(key) == entry[0]:
+            del self.latest[key]
+
+    def spill(self, entry):
+        if self.spill_file is None:
+            directory = os.path.dirname(self.spill_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.spill_file = open(self.spill_path, "ab")
+        self.spill_file.write(encode_record(*entry[:6]))
+        if entry[6] is not None:
+            self.spilled_tags[entry[0]] = entry[6]
+        # Flushed so a crash of this process keeps it, fsync would cost too much
+        self.spill_file.flush()
+        self.spilled += 1
+        self.spilled_total += 1
+
+    def read_spilled(self):
+        # Moves the next records from the file into memory, up to the limit
+        with open(self.spill_path, "rb") as f:
+            f.seek(self.read_offset)
+            while self.spilled and self.memory_bytes < self.max_memory_bytes:
+                header = f.read(LENGTH.size)
+                if len(header) < LENGTH.size:
+                    self.spilled = 0  # torn write at the end
+                    break
+                body = f.read(LENGTH.unpack(header)[0])
+                if len(body) < LENGTH.unpack(header)[0]:
+                    self.spilled = 0
+                    break
+                self.read_offset += LENGTH.size + len(body)
+                self.spilled -= 1
+                entry = decode_record(header + body)
+                entry += (self.spilled_tags.pop(entry[0], None),)
+                key = entry[5]
+                if key is not None and self.latest.get(key) != entry[0]:
+                    self.discard(entry)  # superseded while on disk
+                    continue
+                self.memory[entry[0]] = entry
+                self.memory_bytes += self.entry_size(entry)
+        if self.spilled:
+            self.save_offset()
+        else:
+            self.reset_spill()
+
+    def save_offset(self):
+        with open(self.spill_path + ".offset", "w") as f:
+            f.write(str(self.read_offset))
+
+    def reset_spill(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        self.spilled_tags.clear()
+        for path in (self.spill_path, self.spill_path + ".offset"):
+            if os.path.exists(path):
+                os.remove(path)
+        self.read_offset = 0
+        self.spilled = 0
+
+    def recover(self):
+        # Messages spilled before a restart are sent after the next connect
+        if not os.path.exists(self.spill_path):
+            return
+        try:
+            with open(self.spill_path + ".offset") as f:
+                self.read_offset = int(f.read())
+        except (OSError, ValueError):
+            self.read_offset = 0
+        end = self.read_offset
+        with open(self.spill_path, "rb") as f:
+            f.seek(self.read_offset)
+            while True:
+                header = f.read(LENGTH.size)
+                if len(header) < LENGTH.size:
+                    break
+                body = f.read(LENGTH.unpack(header)[0])
+                if len(body) < LENGTH.unpack(header)[0]:
+                    break
+                seq, _, _, _, _, key = decode_record(header + body)
+                end += LENGTH.size + len(body)
+                self.spilled += 1
+                self.next_seq = max(self.next_seq, seq + 1)
+                if key is not None:
+                    self.latest[key] = seq
+        if self.spilled:
+            # Appends go after the last complete record
+            os.truncate(self.spill_path, end)
+            logging.info(f"{self.name}: {self.spilled} spilled messages recovered")
+            self.ensure_thread()
+        else:
+            self.reset_spill()
+
+    def set_online(self, online):
+        with self.cond:
+            self.online = online
+            self.cond.notify_all()
+
+    def ensure_thread(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, name=f"{self.name}-drain", daemon=True
+            )
+            self.thread.start()
+
+    def next_entry(self):
+        if not self.memory and self.spilled:
+            self.read_spilled()
+        if not self.memory:
+            return None
+        entry = self.memory.popitem(last=False)[1]
+        self.forget(entry)
+        return entry
+
+    def run(self):
+        interval = 1.0 / self.drain_rate if self.drain_rate else 0.0
+        next_send = 0.0
+        while True:
+            with self.cond:
+                self.cond.wait_for(
+                    lambda: self.closing
+                    or (
+                        self.online
+                        and not self.forwarding
+                        and (self.memory or self.spilled)
+                    )
+                )
+                if self.closing:
+                    break
+                now = time.monotonic()
+                if now < next_send:
+                    self.cond.wait(next_send - now)
+                    continue
+                entry = self.next_entry()
+                if entry is not None:
+                    if entry[1] and self.clock() > entry[1]:
+                        self.expired += 1
+                        self.discard(entry)
+                        entry = None
+                    else:
+                        self.forwarding = True
+            self.flush_drops()
+            if entry is None:
+                continue
+            seq, expires, topic, payload, device, key, tag = entry
+            try:
+                self.forward(topic, payload, device, tag)
+            except Exception as e:
+                logging.error(f"{self.name}: forwarding failed: {e}")
+            finally:
+                self.forwarded_one()
+            # Time spent offline or idle does not add up to a burst
+            next_send = max(next_send, now) + interval
+        self.flush_drops()
+
+    def close(self):
+        # With a spill file, messages still queued in memory are written in
+        # front of the spilled ones and sent after the next start
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        if not self.spill_path or not (self.memory or self.spilled):
+            return
+        temp_path = self.spill_path + ".tmp"
+        directory = os.path.dirname(self.spill_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(temp_path, "wb") as out:
+            for entry in self.memory.values():
+                out.write(encode_record(*entry[:6]))
+            if self.spilled:
+                with open(self.spill_path, "rb") as f:
+                    f.seek(self.read_offset)
+                    while True:
+                        chunk = f.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+        os.replace(temp_path, self.spill_path)
+        if os.path.exists(self.spill_path + ".offset"):
+            os.remove(self.spill_path + ".offset")
+        logging.info(
+            f"{self.name}: {len(self)} unsent messages kept in {self.spill_path}"
+        )
+
+    def __len__(self):
+        return len(self.memory) + self.spilled
+
+    def stats(self):
+        with self.cond:
+            return {
+                "online": self.online,
+                "depth": len(self),
+                "memory_bytes": self.memory_bytes,
+                "spilled": self.spilled,
+                "submitted": self.submitted,
+                "forwarded": self.forwarded,
+                "queued": self.queued,
+                "coalesced": self.coalesced,
+                "expired": self.expired,
+                "dropped": self.dropped,
+                "spilled_total": self.spilled_total,
+            }
@@ -0,0 +1,210 @@
+import collections
+import logging
+import threading
+import time
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+
+class OutboundPublisher:
+    # Bounded publish queue with an in-flight window. send(topic, payload, key,
+    # done) hands one message to the transport and must call done(error)
+    # exactly once, from any thread, when the broker acknowledged or rejected
+    # it. key is an optional routing hint such as the device ID.
+    #
+    # A full queue drops its oldest message (DROP_OLDEST) or makes submit()
+    # wait up to block_timeout and then drops the new one (BLOCK). BLOCK
+    # waits on the submitting thread, so it must not be the GUI or event
+    # loop thread; the engine hands publishes to the outbox drain thread for
+    # that. on_drop(topic, payload, key, tag) is called outside the lock for
+    # every dropped message, with the tag given to submit().
+    def __init__(
+        self,
+        send,
+        window=32,
+        max_queue=1000,
+        policy=DROP_OLDEST,
+        block_timeout=1.0,
+        clock=time.monotonic,
+        on_ack=None,
+        on_drop=None,
+    ):
+        self.send = send
+        self.window = window
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.clock = clock
+        # Called with the ack latency in seconds, outside the lock
+        self.on_ack = on_ack
+        self.on_drop = on_drop
+
+        self.queue = collections.deque()
+        self.in_flight = 0
+        self.pumping = False
+        self.cond = threading.Condition()
+
+        self.submitted = 0
+        self.acked = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_latency = None
+        self.avg_latency = None
+        self.max_latency = 0.0
+        self.rate_second = int(self.clock())
+        self.rate_count = 0
+        self.publish_rate = 0
+
+    def submit(self, topic, payload, key=None, tag=None):
+        entry = (topic, payload, key, tag)
+        dropped = None
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                if self.policy == BLOCK:
+                    self.cond.wait_for(
+                        lambda: len(self.queue) < self.max_queue, self.block_timeout
+                    )
+                if len(self.queue) >= self.max_queue:
+                    self.dropped += 1
+                    if self.policy == DROP_OLDEST:
+                        dropped = self.queue.popleft()
+                    else:
+                        dropped = entry
+            if dropped is not entry:
+                self.queue.append(entry)
+                self.submitted += 1
+        if dropped is not None and self.on_drop is not None:
+            try:
+                self.on_drop(*dropped)
+            except Exception as e:
+                logging.error(f"Publish drop callback failed: {e}")
+        if dropped is entry:
+            return False
+        self.pump()
+        return True
+
+    def pump(self):
+        # Only one pump runs at a time. A transport that completes
+        # synchronously calls back into pump through on_done; that call
+        # returns at once and the running loop picks up the freed slot, so
+        # the stack does not grow with the queue.
+        with self.cond:
+            if self.pumping:
+                return
+            self.pumping = True
+        while True:
+            with self.cond:
+                if self.in_flight >= self.window or not self.queue:
+                    self.pumping = False
+                    return
+                topic, payload, key, tag = self.queue.popleft()
+                self.in_flight += 1
+                self.cond.notify_all()
+            done = Delivery(self, self.clock())
+
+            # The transport may complete synchronously, so no lock is held here
+            try:
+                self.send(topic, payload, key, done)
+            except Exception as e:
+                done(e)
+
+    def on_done(self, delivery, error):
+        now = self.clock()
+        latency = None
+        with self.cond:
+            if delivery.finished:
+                return
+            delivery.finished = True
+            self.in_flight -= 1
+            if error is None:
+                self.acked += 1
+                latency = now - delivery.started
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
+                if self.avg_latency is None:
+                    self.avg_latency = latency
+                else:
+                    self.avg_latency += (latency - self.avg_latency) * 0.1
+                second = int(now)
+                if second != self.rate_second:
+                    # Acks per second over the last complete second
+                    self.publish_rate = (
+                        self.rate_count if second == self.rate_second + 1 else 0
+                    )
+                    self.rate_second = second
+                    self.rate_count = 0
+                self.rate_count += 1
+            else:
+                self.failed += 1
+            self.cond.notify_all()
+        if latency is not None and self.on_ack:
+            self.on_ack(latency)
+        self.pump()
+
+    def stats(self):
+        with self.cond:
+            # No acks for a full second means the rate dropped to zero
+            if int(self.clock()) > self.rate_second + 1:
+                self.publish_rate = 0
+            return {
+                "queue_depth": len(self.queue),
+                "in_flight": self.in_flight,
+                "window": self.window,
+                "submitted": self.submitted,
+                "acked": self.acked,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "publish_rate": self.publish_rate,
+                "ack_latency_last": self.last_latency,
+                "ack_latency_avg": self.avg_latency,
+                "ack_latency_max": self.max_latency,
+            }
+
+
+class Delivery:
+    # The done callback of one message; only the first call counts, so a
+    # transport that reports twice cannot unbalance the window
+    __slots__ = ("publisher", "started", "finished")
+
+    def __init__(self, publisher, started):
+        self.publisher = publisher
+        self.started = started
+        self.finished = False
+
+    def __call__(self, error=None):
+        self.publisher.on_done(self, error)
+
+
+class PahoAckTracker:
+    # paho reports completion by message id through on_publish, which can fire
+    # before publish() has even returned the MQTTMessageInfo
+    def __init__(self):
+        self.pending = {}
+        self.early = set()
+        self.lock = threading.Lock()
+
+    def register(self, mid, done):
+        with self.lock:
+            if mid in self.early:
+                self.early.discard(mid)
+            else:
+                self.pending[mid] = done
+                return
+        done()
+
+    def on_publish(self, client, userdata, mid):
+        with self.lock:
+            done = self.pending.pop(mid, None)
+            if done is None:
+                self.early.add(mid)
+                return
+        done()
+
+    def fail_all(self, error):
+        with self.lock:
+            pending = list(self.pending.values())
+            self.pending.clear()
+            self.early.clear()
+        for done in pending:
+            done(error)
@@ -0,0 +1,144 @@
+import struct
+from multiprocessing import shared_memory
+
+# Shared memory layout, little endian:
+#   header  <u32 capacity> <u32 record size> <u64 write index>
+#           <u64 read index> <u8 wakeup pending>, padded to HEADER_SIZE
+#   records capacity slots of RECORD_SIZE bytes
+#   record  <u64 seq> <u8 kind> <u8 status> <u8 state> <u8 name length>
+#           <f32 value> <f64 timestamp> <name utf-8, NAME_SIZE bytes>
+# seq is index + 1 and is written with the record, so a reader never takes
+# a slot the writer has not finished.
+HEADER = struct.Struct("<IIQQB")
+HEADER_SIZE = 64
+WRITE_OFFSET = 8
+READ_OFFSET = 16
+WAKEUP_OFFSET = 24
+INDEX = struct.Struct("<Q")
+RECORD = struct.Struct("<QBBBBfd40s")
+RECORD_SIZE = RECORD.size
+NAME_SIZE = 40
+
+DEVICE = 1
+ROUND_TRIP = 2
+
+# Codes for the status and state strings the engine uses, anything else
+# travels over the worker's pipe instead
+STATUS_CODES = {None: 0, "Connected": 1, "Disconnected": 2}
+STATE_CODES = {None: 0, "OFF": 1, "ON": 2}
+STATUSES = {code: status for status, code in STATUS_CODES.items()}
+STATES = {code: state for state, code in STATE_CODES.items()}
+
+
+def name_fits(device):
+    # Names are stored whole or not at all, longer ones take the pipe too;
+    # utf-8 needs at most 4 bytes a character
+    return len(device) * 4 <= NAME_SIZE or len(device.encode()) <= NAME_SIZE
+
+
+class DeviceStateRing:
+    # Single producer, single consumer ring of device state records in
+    # multiprocessing shared memory. The worker process writes, the GUI
+    # reads the records in place with struct.unpack_from.
+    def __init__(self, memory, owner):
+        self.memory = memory
+        self.owner = owner
+        self.buf = memory.buf
+        self.capacity, record_size = HEADER.unpack_from(self.buf)[:2]
+        if record_size != RECORD_SIZE:
+            raise ValueError(f"Ring record size {record_size} != {RECORD_SIZE}")
+
+    @classmethod
+    def create(cls, capacity=4096):
+        memory = shared_memory.SharedMemory(
+            create=True, size=HEADER_SIZE + capacity * RECORD_SIZE
+        )
+        HEADER.pack_into(memory.buf, 0, capacity, RECORD_SIZE, 0, 0, 0)
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        # Spawned workers share the parent's resource tracker, so the
+        # segment stays registered once and is unlinked by its creator
+        return cls(shared_memory.SharedMemory(name), owner=False)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def write_index(self):
+        return INDEX.unpack_from(self.buf, WRITE_OFFSET)[0]
+
+    @property
+    def read_index(self):
+        return INDEX.unpack_from(self.buf, READ_OFFSET)[0]
+
+    @property
+    def depth(self):
+        return self.write_index - self.read_index
+
+    # Producer side
+
+    def free(self):
+        return self.capacity - self.depth
+
+    def write(self, kind, device, status=0, state=0, value=0.0, ts=0.0):
+        # False when full, the caller decides what to keep
+        index = self.write_index
+        if index - self.read_index >= self.capacity:
+            return False
+        name = device.encode()
+        if len(name) > NAME_SIZE:
+            raise ValueError(f"Device name longer than {NAME_SIZE} bytes: {device}")
+        offset = HEADER_SIZE + (index % self.capacity) * RECORD_SIZE
+        RECORD.pack_into(
+            self.buf,
+            offset,
+            index + 1,
+            kind,
+            status,
+            state,
+            len(name),
+            value,
+            ts,
+            name,
+        )
+        INDEX.pack_into(self.buf, WRITE_OFFSET, index + 1)
+        return True
+
+    def arm_wakeup(self):
+        # True if the consumer has to be woken up, as in IngestQueue
+        if self.buf[WAKEUP_OFFSET]:
+            return False
+        self.buf[WAKEUP_OFFSET] = 1
+        return True
+
+    # Consumer side
+
+    def read(self, max_batch):
+        # Yields (kind, device bytes, status, state, value, ts). Clears the
+        # wakeup flag first so a write racing with the read wakes us again.
+        self.buf[WAKEUP_OFFSET] = 0
+        read = self.read_index
+        end = min(self.write_index, read + max_batch)
+        buf = self.buf
+        capacity = self.capacity
+        try:
+            while read < end:
+                offset = HEADER_SIZE + (read % capacity) * RECORD_SIZE
+                seq, kind, status, state, length, value, ts, name = RECORD.unpack_from(
+                    buf, offset
+                )
+                if seq != read + 1:
+                    break
+                read += 1
+                yield kind, name[:length], status, state, value, ts
+        finally:
+            INDEX.pack_into(buf, READ_OFFSET, read)
+
+    def close(self):
+        self.buf = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
@@ -0,0 +1,138 @@
+import time
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import QObject, QTimer, Qt
+from metrics import bucket_quantile, format_labels
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    if seconds < 0.001:
+        return f"{seconds * 1e6:.0f} us"
+    if seconds < 1:
+        return f"{seconds * 1000:.1f} ms"
+    return f"{seconds:.2f} s"
+
+
+class EventLoopProbe(QObject):
+    # GUI thread latency: a timer due every interval_ms fires late by however
+    # long the event loop was busy with other work, painting included
+    def __init__(self, metrics, parent=None, interval_ms=100):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.interval = interval_ms / 1000
+        self.lag_seconds = metrics.histogram(
+            "mqtt_ui_event_loop_lag_seconds", "How late the GUI thread ran a timer"
+        )
+        self.last = time.perf_counter()
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.on_timeout)
+        self.timer.start()
+
+    def on_timeout(self):
+        now = time.perf_counter()
+        if self.metrics.enabled:
+            self.lag_seconds.observe(max(0.0, now - self.last - self.interval))
+        self.last = now
+
+
+class StatsPanel(QtWidgets.QDockWidget):
+    # Live view of the metrics registry, refreshed only while visible
+    def __init__(self, metrics, parent=None, refresh_ms=1000):
+        super().__init__("Statistics", parent)
+        self.setObjectName("stats_panel")
+        self.metrics = metrics
+
+        widget = QtWidgets.QWidget(self)
+        layout = QtWidgets.QVBoxLayout(widget)
+
+        controls = QtWidgets.QHBoxLayout()
+        self.enabled_checkBox = QtWidgets.QCheckBox("Instrumentation", widget)
+        self.enabled_checkBox.setChecked(metrics.enabled)
+        self.enabled_checkBox.toggled.connect(self.set_enabled)
+        controls.addWidget(self.enabled_checkBox)
+        controls.addWidget(QtWidgets.QLabel("Time 1 in", widget))
+        self.sample_spinBox = QtWidgets.QSpinBox(widget)
+        self.sample_spinBox.setRange(1, 10000)
+        self.sample_spinBox.setValue(metrics.sample_every)
+        self.sample_spinBox.valueChanged.connect(self.set_sample_every)
+        controls.addWidget(self.sample_spinBox)
+        controls.addStretch()
+        self.reset_pushButton = QtWidgets.QPushButton("Reset timings", widget)
+        self.reset_pushButton.clicked.connect(self.reset)
+        controls.addWidget(self.reset_pushButton)
+        layout.addLayout(controls)
+
+        self.metrics_treeWidget = QtWidgets.QTreeWidget(widget)
+        self.metrics_treeWidget.setColumnCount(2)
+        self.metrics_treeWidget.setHeaderLabels(["Metric", "Value"])
+        self.metrics_treeWidget.setRootIsDecorated(False)
+        self.metrics_treeWidget.setUniformRowHeights(True)
+        self.metrics_treeWidget.header().setSectionResizeMode(
+            0, QtWidgets.QHeaderView.ResizeToContents
+        )
+        layout.addWidget(self.metrics_treeWidget)
+
+        self.endpoint_label = QtWidgets.QLabel(widget)
+        self.endpoint_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.endpoint_label.hide()
+        layout.addWidget(self.endpoint_label)
+        self.setWidget(widget)
+
+        self.items = {}  # (name, labels) -> QTreeWidgetItem
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(refresh_ms)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+
+    def set_endpoint(self, address):
+        self.endpoint_label.setText(f"Prometheus: {address}")
+        self.endpoint_label.show()
+
+    def set_enabled(self, enabled):
+        self.metrics.enabled = enabled
+
+    def set_sample_every(self, value):
+        self.metrics.sample_every = value
+        self.metrics.countdown = min(self.metrics.countdown, value)
+
+    def reset(self):
+        self.metrics.reset_histograms()
+        self.refresh()
+
+    def on_visibility_changed(self, visible):
+        if visible:
+            self.refresh()
+            self.refresh_timer.start()
+        else:
+            self.refresh_timer.stop()
+
+    def refresh(self):
+        for name, help, kind, samples in self.metrics.collect():
+            for labels, value in samples:
+                item = self.items.get((name, labels))
+                if item is None:
+                    item = QtWidgets.QTreeWidgetItem(
+                        self.metrics_treeWidget, [name + format_labels(labels), ""]
+                    )
+                    item.setToolTip(0, help)
+                    self.items[(name, labels)] = item
+                item.setText(1, self.format_value(name, kind, value))
+
+    def format_value(self, name, kind, value):
+        if kind != "histogram":
+            return f"{value:g}" if isinstance(value, float) else str(value)
+        count = value["count"]
+        if not count:
+            return "no samples"
+        p50 = bucket_quantile(value, 0.5)
+        p99 = bucket_quantile(value, 0.99)
+        mean = value["sum"] / count
+        if not name.endswith("_seconds"):
+            return f"p50 {p50:.1f}  p99 {p99:.1f}  mean {mean:.1f}  n={count}"
+        return (
+            f"p50 {format_seconds(p50)}  p99 {format_seconds(p99)}  "
+            f"mean {format_seconds(mean)}  n={count}"
+        )
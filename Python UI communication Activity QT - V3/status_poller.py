@@ -0,0 +1,107 @@
+import heapq
+import math
+import random
+import time
+
+
+class StatusPoller:
+    # Decides which devices need a status request. A device that reported
+    # recently is left alone; once its last report is stale_after seconds old
+    # it is polled, and every unanswered poll doubles its interval up to
+    # max_backoff. Devices with a retained "online" presence message only get
+    # an occasional refresh every presence_interval seconds.
+    def __init__(
+        self,
+        stale_after=5.0,
+        max_backoff=60.0,
+        presence_interval=300.0,
+        discovery_interval=60.0,
+        tick=0.5,
+        jitter=0.2,
+        clock=time.monotonic,
+        rng=random.random,
+    ):
+        self.stale_after = stale_after
+        self.max_backoff = max_backoff
+        self.presence_interval = presence_interval
+        self.discovery_interval = discovery_interval
+        self.tick = tick
+        self.jitter = jitter
+        self.clock = clock
+        self.rng = rng
+
+        self.heap = []  # (due, version, device), stale entries are skipped
+        self.version = {}
+        self.quiet = {}
+        self.online = set()
+        self.next_discovery = self.clock()
+        self.polls_sent = 0
+        self.broadcasts_sent = 0
+
+    def __len__(self):
+        return len(self.version)
+
+    def schedule(self, device, delay):
+        # Spread due times so devices seen together are not polled together
+        due = self.clock() + delay * (1.0 + self.jitter * self.rng())
+        version = self.version.get(device, 0) + 1
+        self.version[device] = version
+        heapq.heappush(self.heap, (due, version, device))
+
+    def on_report(self, device):
+        self.quiet[device] = 0
+        if device in self.online:
+            self.schedule(device, self.presence_interval)
+        else:
+            self.schedule(device, self.stale_after)
+
+    def on_presence(self, device, online):
+        self.quiet[device] = 0
+        if online:
+            self.online.add(device)
+            self.schedule(device, self.presence_interval)
+        else:
+            # The broker told us it is gone, polling it would only add traffic
+            self.online.discard(device)
+            self.schedule(device, self.max_backoff)
+
+    def forget(self, device):
+        self.version.pop(device, None)
+        self.quiet.pop(device, None)
+        self.online.discard(device)
+
+    def discovery_due(self):
+        now = self.clock()
+        if now < self.next_discovery:
+            return False
+        self.next_discovery = now + self.discovery_interval
+        self.broadcasts_sent += 1
+        return True
+
+    def due(self):
+        # At most an even share of the fleet per tick, so replies trickle in
+        now = self.clock()
+        budget = max(1, math.ceil(len(self.version) * self.tick / self.stale_after))
+        devices = []
+        while self.heap and self.heap[0][0] <= now and len(devices) < budget:
+            _, version, device = heapq.heappop(self.heap)
+            if self.version.get(device) != version:
+                continue
+            devices.append(device)
+            if device in self.online:
+                self.schedule(device, self.presence_interval)
+            else:
+                quiet = self.quiet[device] = self.quiet.get(device, 0) + 1
+                self.schedule(
+                    device, min(self.max_backoff, self.stale_after * 2**quiet)
+                )
+        self.polls_sent += len(devices)
+        return devices
+
+    def stats(self):
+        return {
+            "devices": len(self.version),
+            "online": len(self.online),
+            "polls_sent": self.polls_sent,
+            "broadcasts_sent": self.broadcasts_sent,
+        }
@@ -0,0 +1,279 @@
+import collections
+import logging
+import os
+import sqlite3
+import threading
+import time
+from decoder import PayloadDecoder
+
+INBOUND = "in"
+OUTBOUND = "out"
+
+Record = collections.namedtuple("Record", "ts direction topic device payload")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    ts REAL NOT NULL,
+    direction TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    device TEXT,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_device_ts ON messages (device, ts);
+CREATE INDEX IF NOT EXISTS messages_ts ON messages (ts);
+"""
+
+
+class TelemetryStore:
+    # Append-only message log. Every segment_seconds of traffic goes into its
+    # own SQLite file in WAL mode, named after the segment's start time, so
+    # range queries only open the segments they overlap and retention is a
+    # file delete. append() is safe from any thread and never touches disk;
+    # a writer thread commits the backlog in batched transactions and
+    # applies retention between them, never to a segment it has open.
+    def __init__(
+        self,
+        path,
+        segment_seconds=3600,
+        retention_seconds=7 * 24 * 3600,
+        max_segments=200,
+        batch_size=500,
+        flush_interval=1.0,
+        max_backlog=100000,
+        presence_prefix="ESP32bootcamp_presence/",
+        clock=time.time,
+    ):
+        self.path = path
+        self.segment_seconds = segment_seconds
+        self.retention_seconds = retention_seconds
+        self.max_segments = max_segments
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.presence_prefix = presence_prefix
+        self.clock = clock
+        os.makedirs(path, exist_ok=True)
+
+        self.backlog = collections.deque()
+        self.max_backlog = max_backlog
+        self.lock = threading.Lock()  # backlog and its counters
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.flushed = threading.Condition()
+        self.connections = {}  # segment start -> sqlite3.Connection
+        # Device names are extracted on the writer thread, off the hot path
+        self.decoder = PayloadDecoder()
+
+        self.appended = 0
+        self.written = 0
+        self.dropped = 0  # the oldest entries go when the backlog is full
+        self.failed = 0  # rows of batches SQLite refused
+        self.batches = 0
+        self.segments_removed = 0
+        self.retention_due = True
+
+        self.thread = threading.Thread(target=self.run, name="telemetry-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append(self, direction, topic, payload, ts=None, device=None):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        entry = (ts or self.clock(), direction, topic, device, payload)
+        with self.lock:
+            if len(self.backlog) >= self.max_backlog:
+                self.backlog.popleft()
+                self.dropped += 1
+            self.backlog.append(entry)
+            self.appended += 1
+            depth = len(self.backlog)
+        if depth >= self.batch_size:
+            self.wakeup.set()
+
+    def settled(self):
+        # Everything appended is committed, dropped or failed; a batch the
+        # writer took off the backlog counts only once it is committed
+        return self.written + self.dropped + self.failed
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.write_backlog()
+            if self.retention_due:
+                self.retention_due = False
+                try:
+                    self.enforce_retention()
+                except OSError as e:
+                    logging.error(f"Telemetry retention failed: {e}")
+            with self.flushed:
+                self.flushed.notify_all()
+            if self.stopping:
+                break
+        for connection in self.connections.values():
+            connection.close()
+        self.connections.clear()
+
+    def write_backlog(self):
+        while True:
+            with self.lock:
+                count = min(len(self.backlog), self.batch_size)
+                batch = [self.backlog.popleft() for _ in range(count)]
+            if not batch:
+                return
+            try:
+                self.write_batch(batch)
+            except sqlite3.Error as e:
+                logging.error(f"Telemetry write failed: {e}")
+                with self.lock:
+                    self.failed += len(batch)
+                continue
+            with self.lock:
+                self.written += len(batch)
+                self.batches += 1
+
+    def write_batch(self, batch):
+        by_segment = collections.defaultdict(list)
+        for ts, direction, topic, device, payload in batch:
+            if device is None:
+                device = self.device_of(topic, payload)
+            by_segment[self.segment_start(ts)].append(
+                (ts, direction, topic, device, payload)
+            )
+        for start, rows in by_segment.items():
+            connection = self.connection_for(start)
+            with connection:
+                connection.executemany(
+                    "INSERT INTO messages VALUES (?, ?, ?, ?, ?)", rows
+                )
+
+    def device_of(self, topic, payload):
+        if topic.startswith(self.presence_prefix):
+            return topic[len(self.presence_prefix) :]
+        report = self.decoder.decode(payload)
+        return report.device if report is not None else None
+
+    def segment_start(self, ts):
+        return int(ts // self.segment_seconds * self.segment_seconds)
+
+    def segment_path(self, start):
+        return os.path.join(self.path, f"telemetry-{start}.db")
+
+    def connection_for(self, start):
+        connection = self.connections.get(start)
+        if connection is None:
+            connection = sqlite3.connect(self.segment_path(start))
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            # Late messages may still land in the previous segment
+            for old in sorted(self.connections)[:-1]:
+                self.connections.pop(old).close()
+            self.connections[start] = connection
+            self.retention_due = True
+        return connection
+
+    def segment_starts(self):
+        starts = []
+        for name in os.listdir(self.path):
+            if name.startswith("telemetry-") and name.endswith(".db"):
+                try:
+                    starts.append(int(name[len("telemetry-") : -len(".db")]))
+                except ValueError:
+                    pass
+        return sorted(starts)
+
+    def enforce_retention(self):
+        # Writer thread, between batches. Open segments are skipped, even
+        # when a late message reopened one past the horizon.
+        starts = self.segment_starts()
+        horizon = self.clock() - self.retention_seconds
+        expired = [start for start in starts if start + self.segment_seconds < horizon]
+        if len(starts) - len(expired) > self.max_segments:
+            expired = starts[: len(starts) - self.max_segments]
+        expired = [start for start in expired if start not in self.connections]
+        for start in expired:
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.segment_path(start) + suffix)
+                except FileNotFoundError:
+                    pass
+            self.segments_removed += 1
+
+    def flush(self, timeout=5.0):
+        # Block until everything appended so far is on disk
+        with self.lock:
+            target = self.appended
+        with self.flushed:
+            self.wakeup.set()
+            return self.flushed.wait_for(
+                lambda: self.settled() >= target or self.stopping,
+                timeout,
+            )
+
+    def query(self, device=None, since=None, until=None, direction=None, limit=None):
+        # Records in time order. Only segments overlapping [since, until] are
+        # opened and each one is searched through its (device, ts) index.
+        since = 0 if since is None else since
+        until = self.clock() if until is None else until
+        clauses = ["ts >= ?", "ts <= ?"]
+        params = [since, until]
+        if device is not None:
+            clauses.append("device = ?")
+            params.append(device)
+        if direction is not None:
+            clauses.append("direction = ?")
+            params.append(direction)
+        sql = (
+            "SELECT ts, direction, topic, device, payload FROM messages WHERE "
+            + " AND ".join(clauses)
+            + " ORDER BY ts"
+        )
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+
+        records = []
+        for start in self.segment_starts():
+            if start + self.segment_seconds < since or start > until:
+                continue
+            uri = f"file:{self.segment_path(start)}?mode=ro"
+            try:
+                connection = sqlite3.connect(uri, uri=True)
+            except sqlite3.OperationalError:
+                continue  # removed by retention in the meantime
+            try:
+                records.extend(Record(*row) for row in connection.execute(sql, params))
+            finally:
+                connection.close()
+            if limit is not None and len(records) >= limit:
+                return records[:limit]
+        return records
+
+    def recent(self, device, seconds=3600, direction=None):
+        now = self.clock()
+        return self.query(device, now - seconds, now, direction)
+
+    def close(self):
+        self.stopping = True
+        self.wakeup.set()
+        self.thread.join()
+
+    def stats(self):
+        starts = self.segment_starts()
+        size = 0
+        for start in starts:
+            for suffix in ("", "-wal"):
+                try:
+                    size += os.path.getsize(self.segment_path(start) + suffix)
+                except OSError:
+                    pass
+        return {
+            "backlog": len(self.backlog),
+            "appended": self.appended,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "segments": len(starts),
+            "segments_removed": self.segments_removed,
+            "bytes": size,
+        }
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The app is a flat set of modules, imported the way main.py does
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.join(APP_DIR, "benchmarks"))
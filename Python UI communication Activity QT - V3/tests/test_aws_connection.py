@@ -0,0 +1,197 @@
+import concurrent.futures
+import enum
+import sys
+import types
+
+import pytest
+
+from aws_connection import (
+    AwsConnectionManager,
+    CONNECTED,
+    CONNECTING,
+    DISCONNECTED,
+    FAILED,
+    RECONNECTING,
+    RESUBSCRIBE_REJECTED,
+)
+
+
+class ConnectReturnCode(enum.IntEnum):
+    ACCEPTED = 0
+
+
+class FakeConnection:
+    # Futures are completed by the test, as awscrt would on its threads
+    def __init__(self, kwargs):
+        self.kwargs = kwargs
+        self.connects = []
+        self.disconnects = []
+        self.resubscribes = []
+
+    def connect(self):
+        future = concurrent.futures.Future()
+        self.connects.append(future)
+        return future
+
+    def disconnect(self):
+        future = concurrent.futures.Future()
+        self.disconnects.append(future)
+        return future
+
+    def resubscribe_existing_topics(self):
+        future = concurrent.futures.Future()
+        self.resubscribes.append(future)
+        return future, 1
+
+
+class FakeBuilder:
+    def __init__(self):
+        self.connections = []
+
+    def mtls_from_path(self, **kwargs):
+        connection = FakeConnection(kwargs)
+        self.connections.append(connection)
+        return connection
+
+
+class FakeTimer:
+    def __init__(self, delay, callback):
+        self.delay = delay
+        self.callback = callback
+        self.started = False
+        self.cancelled = False
+
+    def start(self):
+        self.started = True
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture(autouse=True)
+def fake_awscrt(monkeypatch):
+    # on_connection_resumed imports awscrt.mqtt for ConnectReturnCode
+    mqtt = types.ModuleType("awscrt.mqtt")
+    mqtt.ConnectReturnCode = ConnectReturnCode
+    awscrt = types.ModuleType("awscrt")
+    awscrt.mqtt = mqtt
+    monkeypatch.setitem(sys.modules, "awscrt", awscrt)
+    monkeypatch.setitem(sys.modules, "awscrt.mqtt", mqtt)
+
+
+@pytest.fixture
+def manager():
+    builder = FakeBuilder()
+    timers = []
+
+    def timer_factory(delay, callback):
+        timers.append(FakeTimer(delay, callback))
+        return timers[-1]
+
+    statuses = []
+    manager = AwsConnectionManager(
+        builder=builder,
+        on_status=lambda status, detail: statuses.append((status, detail)),
+        timer_factory=timer_factory,
+    )
+    manager.configure("example.iot", 8883, "client", "cert", "key", "ca")
+    manager.builder_used = builder
+    manager.timers = timers
+    manager.statuses = statuses
+    return manager
+
+
+def connection_of(manager):
+    return manager.builder_used.connections[-1]
+
+
+def test_connect_reports_connecting_then_connected(manager):
+    manager.connect()
+    assert manager.statuses == [(CONNECTING, "example.iot")]
+    assert not manager.connected
+
+    connection_of(manager).connects[-1].set_result({"session_present": False})
+    assert manager.connected
+    assert manager.statuses[-1] == (CONNECTED, "example.iot")
+    assert manager.metrics["attempts"] == 1
+    assert manager.metrics["connect_seconds"] is not None
+
+
+def test_failed_attempt_retries_with_backoff(manager):
+    manager.max_attempts = 2
+    manager.connect()
+    connection_of(manager).connects[-1].set_exception(OSError("refused"))
+    assert manager.statuses[-1][0] == RECONNECTING
+    assert len(manager.timers) == 1 and manager.timers[0].started
+
+    # The timer fires and the second attempt fails too: no more retries
+    manager.timers[0].callback()
+    connection_of(manager).connects[-1].set_exception(OSError("refused"))
+    assert manager.statuses[-1] == (FAILED, "refused")
+    assert len(manager.timers) == 1
+    assert not manager.want_connected
+
+
+def test_disconnect_during_handshake_closes_the_connection(manager):
+    manager.connect()
+    manager.disconnect()
+    assert manager.statuses[-1] == (DISCONNECTED, "")
+    connection = connection_of(manager)
+    connection.connects[-1].set_result({})
+    assert not manager.connected
+    assert len(connection.disconnects) == 1
+
+
+def test_interrupt_and_resume(manager):
+    manager.connect()
+    connection = connection_of(manager)
+    connection.connects[-1].set_result({})
+
+    manager.on_connection_interrupted(connection, "socket closed")
+    assert not manager.connected
+    assert manager.statuses[-1][0] == RECONNECTING
+    assert manager.metrics["interruptions"] == 1
+
+    # Session kept by the broker: nothing to resubscribe
+    manager.on_connection_resumed(connection, ConnectReturnCode.ACCEPTED, True)
+    assert manager.connected
+    assert manager.statuses[-1] == (CONNECTED, "connection resumed")
+    assert manager.metrics["reconnects"] == 1
+    assert connection.resubscribes == []
+
+
+def test_resume_without_session_resubscribes(manager):
+    manager.connect()
+    connection = connection_of(manager)
+    connection.connects[-1].set_result({})
+    manager.on_connection_resumed(connection, ConnectReturnCode.ACCEPTED, False)
+    assert len(connection.resubscribes) == 1
+
+    connection.resubscribes[0].set_result({"topics": [("a/b", 1), ("c/d", 1)]})
+    assert manager.statuses[-1] == (CONNECTED, "connection resumed")
+    assert manager.metrics["resubscribe_seconds"] is not None
+
+
+def test_rejected_resubscribe_keeps_the_connection_up(manager):
+    manager.connect()
+    connection = connection_of(manager)
+    connection.connects[-1].set_result({})
+    manager.on_connection_resumed(connection, ConnectReturnCode.ACCEPTED, False)
+
+    connection.resubscribes[0].set_result({"topics": [("a/b", 1), ("c/d", None)]})
+    assert manager.statuses[-1] == (RESUBSCRIBE_REJECTED, "c/d")
+    assert manager.connected
+
+
+def test_engine_keeps_aws_online_after_a_rejected_resubscribe(tmp_path):
+    from engine import MQTTEngine
+
+    engine = MQTTEngine(groups_path=str(tmp_path / "groups.json"))
+    statuses = []
+    engine.on("connection_status", statuses.append)
+    engine.aws_manager.connected = True
+    engine.on_aws_status(CONNECTED, "connection resumed")
+    engine.on_aws_status(RESUBSCRIBE_REJECTED, "c/d")
+    assert statuses == [CONNECTED]
+    assert engine.aws_outbox.online
+    engine.close()
@@ -0,0 +1,132 @@
+import threading
+
+import pytest
+
+import capture
+from capture import CaptureReplayer, CaptureWriter, read_capture
+
+
+def write_capture(path, records):
+    writer = CaptureWriter(path)
+    for ts, topic, payload in records:
+        writer.write(topic, payload, ts)
+    writer.close()
+    return writer
+
+
+RECORDS = [
+    (1.0, "ESP32bootcamp_com", b'{"device": "ESP32-1"}'),
+    (1.5, "ESP32bootcamp_presence/ESP32-1", b"online"),
+    (2.25, "ESP32bootcamp_com", b""),
+    (3.0, "fleet/ESP32-2/state", "ON"),
+]
+EXPECTED = [
+    (ts, topic, payload if isinstance(payload, bytes) else payload.encode())
+    for ts, topic, payload in RECORDS
+]
+
+
+@pytest.mark.parametrize("name", ["traffic.cap", "traffic.cap.gz"])
+def test_round_trip(tmp_path, name):
+    path = str(tmp_path / name)
+    writer = write_capture(path, RECORDS)
+    assert writer.count == 4
+    assert len(writer.topics) == 3
+    assert list(read_capture(path)) == EXPECTED
+
+
+def test_topics_go_inline_once_ids_run_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture, "MAX_TOPICS", 2)
+    path = str(tmp_path / "inline.cap")
+    writer = write_capture(path, RECORDS)
+    # Two topics got ids, the third travels with its message
+    assert list(writer.topics) == [
+        "ESP32bootcamp_com",
+        "ESP32bootcamp_presence/ESP32-1",
+    ]
+    assert list(read_capture(path)) == EXPECTED
+
+
+def test_truncated_file_keeps_complete_records(tmp_path):
+    path = str(tmp_path / "cut.cap")
+    write_capture(path, RECORDS)
+    data = open(path, "rb").read()
+    # Cut inside the last payload and inside the last header
+    for cut in (len(data) - 1, len(data) - len(b"ON") - 3):
+        with open(path, "wb") as f:
+            f.write(data[:cut])
+        assert list(read_capture(path)) == EXPECTED[:3]
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / "other.cap"
+    path.write_bytes(b"hello")
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
+
+
+def test_closed_writer_ignores_late_writes(tmp_path):
+    path = str(tmp_path / "late.cap")
+    writer = write_capture(path, RECORDS[:1])
+    writer.write("t", b"late", 9.0)
+    assert list(read_capture(path)) == EXPECTED[:1]
+
+
+class FakeQueue:
+    def __init__(self, max_depth=100):
+        self.max_depth = max_depth
+        self.depth = 0
+        self.pushed = []
+
+    def push(self, topic, payload, ts):
+        self.pushed.append((topic, payload))
+
+
+def test_replay_at_max_speed(tmp_path):
+    path = str(tmp_path / "replay.cap")
+    write_capture(path, RECORDS)
+    queue = FakeQueue()
+    done = []
+    replayer = CaptureReplayer(
+        path, queue, speed=0, on_done=lambda r, error: done.append(error)
+    ).start()
+    replayer.join(5.0)
+    assert queue.pushed == [(topic, payload) for _, topic, payload in EXPECTED]
+    assert replayer.replayed == 4
+    assert done == [None]
+
+
+def test_replay_keeps_recorded_spacing(tmp_path):
+    path = str(tmp_path / "paced.cap")
+    write_capture(path, [(0.0, "t", b"a"), (0.2, "t", b"b")])
+    replayer = CaptureReplayer(path, FakeQueue(), speed=2.0).start()
+    replayer.join(5.0)
+    assert replayer.elapsed >= 0.1
+
+
+def test_stop_during_high_water_wait_pushes_nothing(tmp_path):
+    path = str(tmp_path / "full.cap")
+    write_capture(path, RECORDS)
+    queue = FakeQueue(max_depth=4)
+    queue.depth = 2  # at the high-water mark of max_depth // 2
+    stopped = threading.Event()
+    replayer = CaptureReplayer(
+        path, queue, speed=0, on_done=lambda r, error: stopped.set()
+    ).start()
+    assert not stopped.wait(0.05)
+    replayer.stop()
+    assert stopped.wait(5.0)
+    assert queue.pushed == []
+
+
+def test_replay_resumes_once_the_queue_drains(tmp_path):
+    path = str(tmp_path / "drain.cap")
+    write_capture(path, RECORDS)
+    queue = FakeQueue(max_depth=4)
+    queue.depth = 2
+    replayer = CaptureReplayer(path, queue, speed=0).start()
+    replayer.join(0.05)
+    assert queue.pushed == []
+    queue.depth = 0
+    replayer.join(5.0)
+    assert len(queue.pushed) == 4
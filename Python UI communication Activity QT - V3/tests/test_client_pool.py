@@ -0,0 +1,154 @@
+import threading
+import zlib
+
+import pytest
+
+from client_pool import MQTT_ERR_NO_CONN, ShardedClientPool
+from fleet import LoopbackBroker, LoopbackMessage, MessageInfo
+
+
+def settle(broker):
+    # The broker routes on one thread in order, so once this marker is
+    # through, everything queued before it has been delivered
+    done = threading.Event()
+    broker.inbox.put((LoopbackMessage("$SYS/settle", b"", False), done.set))
+    assert done.wait(2.0)
+
+
+@pytest.fixture
+def broker():
+    broker = LoopbackBroker()
+    broker.start()
+    yield broker
+    broker.stop()
+
+
+def make_pool(broker, size, **kwargs):
+    received = []
+    connects = []
+    pool = ShardedClientPool(
+        size=size,
+        client_factory=broker.client_factory,
+        on_message=lambda client, shard, msg: received.append((shard, msg)),
+        on_connect=lambda shard, rc: connects.append((shard, rc)),
+        **kwargs,
+    )
+    pool.connect("loopback", 1883)
+    settle(broker)
+    pool.received = received
+    pool.connects = connects
+    return pool
+
+
+def test_publishes_are_routed_by_crc32_of_the_key(broker):
+    pool = make_pool(broker, 4)
+    devices = [f"ESP32-{i}" for i in range(1, 21)]
+    errors = []
+
+    def done(error=None):
+        errors.append(error)
+
+    for device in devices:
+        pool.publish(device, "control", b"ON", 1, done)
+    pool.publish(None, "control", b"ALL", 1, done)
+    settle(broker)
+
+    expected = [0] * 4
+    for device in devices:
+        expected[zlib.crc32(device.encode()) % 4] += 1
+    expected[0] += 1  # no key goes to shard 0
+    assert [stats.published for stats in pool.stats] == expected
+    # Every publish was acknowledged without an error
+    assert errors == [None] * 21
+    # Stable: the same device always lands on the same shard
+    assert pool.shard_for("ESP32-7") == zlib.crc32(b"ESP32-7") % 4
+
+
+def test_shared_subscription_spreads_messages_over_shards(broker):
+    pool = make_pool(broker, 3)
+    pool.subscribe("ESP32bootcamp_com", qos=1)
+    assert broker.subscriptions == [
+        ("ESP32bootcamp_com", "bootcamp", client.deliver) for client in pool.clients
+    ]
+
+    for i in range(6):
+        broker.publish("ESP32bootcamp_com", f"reply {i}")
+    settle(broker)
+    # Each message once, round-robin within the share group
+    assert len(pool.received) == 6
+    assert sorted(shard for shard, _ in pool.received) == [0, 0, 1, 1, 2, 2]
+
+
+def test_single_client_subscribes_without_share_prefix(broker):
+    pool = make_pool(broker, 1)
+    pool.subscribe("ESP32bootcamp_com")
+    assert pool.subscription_topic("ESP32bootcamp_com") == "ESP32bootcamp_com"
+    assert broker.subscriptions == [
+        ("ESP32bootcamp_com", None, pool.clients[0].deliver)
+    ]
+
+
+def test_non_shared_subscription_gets_retained_presence_on_shard_0(broker):
+    broker.publish("presence/ESP32-1", "online", retain=True)
+    settle(broker)
+    pool = make_pool(broker, 3)
+    pool.subscribe("presence/+", qos=1, shared=False)
+    settle(broker)
+
+    assert broker.subscriptions == [("presence/+", None, pool.clients[0].deliver)]
+    assert [(shard, msg.payload) for shard, msg in pool.received] == [(0, b"online")]
+
+
+def test_subscriptions_are_replayed_after_a_reconnect(broker):
+    pool = make_pool(broker, 2)
+    pool.subscribe("ESP32bootcamp_com")
+    pool.subscribe("presence/+", qos=1, shared=False)
+
+    # The broker lost the session of both shards
+    broker.subscriptions.clear()
+    for client in pool.clients:
+        client.loop_start()
+    settle(broker)
+    assert pool.connects[-2:] == [(0, 0), (1, 0)]
+    assert sorted(broker.subscriptions, key=lambda entry: entry[:2]) == sorted(
+        [("ESP32bootcamp_com", "bootcamp", client.deliver) for client in pool.clients]
+        + [("presence/+", None, pool.clients[0].deliver)],
+        key=lambda entry: entry[:2],
+    )
+
+    broker.publish("presence/ESP32-2", "offline")
+    broker.publish("ESP32bootcamp_com", "reply")
+    settle(broker)
+    assert [msg.payload for _, msg in pool.received] == [b"offline", b"reply"]
+
+
+def test_unsubscribe_uses_the_topic_it_subscribed_with(broker):
+    pool = make_pool(broker, 2)
+    pool.subscribe("ESP32bootcamp_com")
+    pool.subscribe("presence/+", shared=False)
+    pool.unsubscribe("ESP32bootcamp_com")
+    pool.unsubscribe("presence/+")
+    assert broker.subscriptions == []
+    assert pool.subscriptions == {}
+
+
+def test_disconnected_publish_fails_at_qos_0_and_waits_at_qos_1(broker):
+    pool = make_pool(broker, 1)
+    client = pool.clients[0]
+    client.publish = lambda topic, payload, qos=0, retain=False: MessageInfo(
+        MQTT_ERR_NO_CONN, 7
+    )
+    results = []
+
+    def done(error=None):
+        results.append(error)
+
+    pool.publish("ESP32-1", "control", b"ON", 0, done)
+    assert results == [MQTT_ERR_NO_CONN]
+    assert pool.stats[0].errors == 1
+
+    # paho keeps QoS 1 messages and sends them after the reconnect
+    pool.publish("ESP32-1", "control", b"ON", 1, done)
+    assert results == [MQTT_ERR_NO_CONN]
+    pool.acks[0].on_publish(client, 0, 7)
+    assert results == [MQTT_ERR_NO_CONN, None]
@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+import commands
+from commands import (
+    CBOR_UINTS,
+    MSGPACK_UINTS,
+    CommandEncoder,
+    build_command,
+    device_mask,
+    pack_uint,
+)
+
+
+def test_payloads_are_cached_per_device_action_and_format():
+    encoder = CommandEncoder()
+    first = encoder.encode("ESP32-1", "ON")
+    assert encoder.encode("ESP32-1", "ON") is first
+    assert (encoder.hits, encoder.misses) == (1, 1)
+    assert json.loads(first) == build_command("ESP32-1", "ON")
+    encoder.clear()
+    encoder.encode("ESP32-1", "ON")
+    assert encoder.misses == 2
+
+
+@pytest.mark.parametrize("command_id", [1, 42, 2**31 - 1])
+def test_json_id_is_spliced_into_the_cached_payload(command_id):
+    encoder = CommandEncoder()
+    encoder.encode("ESP32-1", "OFF")
+    payload = encoder.encode("ESP32-1", "OFF", command_id)
+    assert encoder.hits == 1
+    assert json.loads(payload) == build_command("ESP32-1", "OFF", command_id)
+
+
+@pytest.mark.parametrize(
+    "value, msgpack_bytes, cbor_bytes",
+    [
+        (5, b"\x05", b"\x05"),
+        (100, b"\x64", b"\x18\x64"),
+        (200, b"\xcc\xc8", b"\x18\xc8"),
+        (300, b"\xcd\x01\x2c", b"\x19\x01\x2c"),
+        (70000, b"\xce\x00\x01\x11\x70", b"\x1a\x00\x01\x11\x70"),
+        (
+            2**40,
+            b"\xcf" + (2**40).to_bytes(8, "big"),
+            b"\x1b" + (2**40).to_bytes(8, "big"),
+        ),
+    ],
+)
+def test_unsigned_integers_use_the_shortest_header(value, msgpack_bytes, cbor_bytes):
+    assert pack_uint(value, MSGPACK_UINTS) == msgpack_bytes
+    assert pack_uint(value, CBOR_UINTS) == cbor_bytes
+
+
+def test_binary_id_splice_bumps_the_map_header():
+    # Works on the cached bytes alone, so no codec is needed to check it
+    encoder = CommandEncoder()
+    encoder.device_formats["ESP32-1"] = "msgpack"
+    encoder.device_formats["ESP32-2"] = "cbor"
+    encoder.cache[("ESP32-1", "ON", "msgpack")] = b"\x85<body>"
+    encoder.cache[("ESP32-2", "ON", "cbor")] = b"\xa5<body>"
+    assert encoder.encode("ESP32-1", "ON", 300) == b"\x86<body>\xa2id\xcd\x01\x2c"
+    assert encoder.encode("ESP32-2", "ON", 7) == b"\xa6<body>\x62id\x07"
+
+
+@pytest.mark.parametrize(
+    "wire_format, module", [("msgpack", "msgpack"), ("cbor", "cbor2")]
+)
+def test_binary_payloads_round_trip(wire_format, module):
+    codec = pytest.importorskip(module)
+    loads = codec.unpackb if module == "msgpack" else codec.loads
+    encoder = CommandEncoder()
+    encoder.set_device_format("ESP32-1", wire_format)
+    for command_id in (None, 0, 23, 24, 255, 256, 65536, 2**31 - 1):
+        payload = encoder.encode("ESP32-1", "ON", command_id)
+        assert loads(payload) == build_command("ESP32-1", "ON", command_id)
+    assert encoder.misses == 1
+
+
+def test_negotiate_picks_the_most_compact_shared_format(monkeypatch):
+    monkeypatch.setattr(commands, "available_formats", lambda: ["json", "cbor"])
+    encoder = CommandEncoder()
+    assert encoder.negotiate("ESP32-1", ["json", "msgpack", "cbor"]) == "cbor"
+    assert encoder.negotiate("ESP32-2", ["json", "msgpack"]) == "json"
+    assert encoder.negotiate("ESP32-3", []) == "json"
+    assert encoder.format_for("ESP32-1") == "cbor"
+    assert encoder.format_for("ESP32-9") == "json"
+
+
+def test_broadcasts_stay_json(monkeypatch):
+    monkeypatch.setattr(commands, "available_formats", lambda: ["json", "cbor"])
+    encoder = CommandEncoder()
+    encoder.set_device_format("ALL", "cbor")
+    assert encoder.format_for("ALL") == "json"
+
+
+def test_unavailable_format_is_refused(monkeypatch):
+    monkeypatch.setattr(commands, "available_formats", lambda: ["json"])
+    with pytest.raises(ValueError):
+        CommandEncoder().set_device_format("ESP32-1", "msgpack")
+
+
+def test_device_mask():
+    assert device_mask(["ESP32-1", "ESP32-3", "ESP32-64"]) == format(
+        (1 << 63) | 0b101, "x"
+    )
+    assert device_mask(["ESP32-1", "porch"]) is None
+    assert device_mask(["ESP32-01"]) is None
+
+
+def test_group_uses_one_mask_payload_when_it_fits():
+    encoder = CommandEncoder()
+    [(payload, devices)] = encoder.encode_group(
+        "porch", ["ESP32-1", "ESP32-2", "ESP32-1"], "ON", command_id=9
+    )
+    command = json.loads(payload)
+    assert devices == ["ESP32-1", "ESP32-2"]
+    assert (command["device"], command["group"], command["mask"]) == (
+        "GROUP",
+        "porch",
+        "3",
+    )
+    assert command["id"] == 9
+
+
+def test_group_device_lists_are_split_by_size_and_count():
+    encoder = CommandEncoder()
+    devices = [f"lamp-{i}" for i in range(150)]
+    chunks = encoder.encode_group(
+        "all", devices, "OFF", max_payload=512, max_devices=64
+    )
+    assert [device for _, chunk in chunks for device in chunk] == devices
+    for payload, chunk in chunks:
+        assert len(payload) <= 512
+        assert len(chunk) <= 64
+        assert json.loads(payload)["devices"] == chunk
+    assert encoder.encode_group("all", [], "OFF") == []
@@ -0,0 +1,59 @@
+from dedup import DedupCache
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_only_flagged_repeats_are_dropped():
+    cache = DedupCache(clock=Clock())
+    assert not cache.is_duplicate("com", b"ON")
+    # A device may send the same report twice on purpose
+    assert not cache.is_duplicate("com", b"ON")
+    assert cache.is_duplicate("com", b"ON", dup=True)
+    assert cache.is_duplicate("com", b"ON", retain=True)
+    # A flagged message seen for the first time gets through
+    assert not cache.is_duplicate("com", b"OFF", dup=True)
+    assert cache.stats() == {"size": 2, "checked": 5, "flagged": 3, "hits": 2}
+
+
+def test_topic_is_part_of_the_fingerprint():
+    cache = DedupCache(clock=Clock())
+    cache.is_duplicate("a", b"ON")
+    assert not cache.is_duplicate("b", b"ON", dup=True)
+
+
+def test_entries_older_than_the_window_are_forgotten():
+    clock = Clock()
+    cache = DedupCache(window=60.0, clock=clock)
+    cache.is_duplicate("com", b"ON")
+    clock.now = 60.0
+    assert cache.is_duplicate("com", b"ON", dup=True)
+    clock.now = 121.0
+    assert not cache.is_duplicate("com", b"ON", dup=True)
+
+    # Expired entries are evicted as newer ones come in
+    cache.is_duplicate("com", b"A")
+    clock.now = 200.0
+    cache.is_duplicate("com", b"B")
+    assert cache.stats()["size"] == 1
+
+
+def test_capacity_evicts_the_oldest():
+    cache = DedupCache(capacity=3, clock=Clock())
+    for payload in (b"1", b"2", b"3", b"4"):
+        cache.is_duplicate("com", payload)
+    assert cache.stats()["size"] == 3
+    assert not cache.is_duplicate("com", b"1", dup=True)
+    assert cache.is_duplicate("com", b"4", dup=True)
+
+
+def test_clear():
+    cache = DedupCache(clock=Clock())
+    cache.is_duplicate("com", b"ON")
+    cache.clear()
+    assert not cache.is_duplicate("com", b"ON", dup=True)
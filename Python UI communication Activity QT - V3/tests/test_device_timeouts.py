@@ -0,0 +1,78 @@
+from device_timeouts import ExpiryWheel
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_wheel(default_timeout=10.0, tick=1.0):
+    clock = Clock()
+    return ExpiryWheel(default_timeout, tick, clock), clock
+
+
+def test_device_expires_once_its_slot_has_passed():
+    wheel, clock = make_wheel()
+    wheel.touch("ESP32-1")
+    assert "ESP32-1" in wheel
+    # Deadline 10.0 is in slot 10, which is due once the clock reaches 11
+    assert wheel.expire(10.5) == []
+    assert wheel.expire(11.0) == ["ESP32-1"]
+    assert "ESP32-1" not in wheel
+    assert len(wheel) == 0
+    assert wheel.expire(30.0) == []
+
+
+def test_touch_moves_the_deadline():
+    wheel, clock = make_wheel()
+    wheel.touch("ESP32-1", now=0.0)
+    wheel.touch("ESP32-1", now=5.0)
+    assert wheel.expire(12.0) == []
+    assert wheel.expire(16.0) == ["ESP32-1"]
+    assert wheel.slots == {}
+
+
+def test_remove_forgets_the_device():
+    wheel, clock = make_wheel()
+    wheel.touch("ESP32-1")
+    wheel.touch("ESP32-2")
+    wheel.remove("ESP32-1")
+    wheel.remove("unknown")
+    assert wheel.expire(20.0) == ["ESP32-2"]
+
+
+def test_device_timeout_overrides_group_and_default():
+    wheel, clock = make_wheel()
+    wheel.set_group_timeout("porch", 30.0)
+    wheel.assign_group("ESP32-1", "porch")
+    wheel.assign_group("ESP32-2", "porch")
+    wheel.set_timeout("ESP32-2", 2.0)
+    assert wheel.timeout_for("ESP32-1") == 30.0
+    assert wheel.timeout_for("ESP32-2") == 2.0
+    assert wheel.timeout_for("ESP32-3") == 10.0
+
+    for device in ("ESP32-1", "ESP32-2", "ESP32-3"):
+        wheel.touch(device)
+    assert wheel.expire(3.0) == ["ESP32-2"]
+    assert wheel.expire(11.0) == ["ESP32-3"]
+    assert wheel.expire(31.0) == ["ESP32-1"]
+
+
+def test_long_gap_visits_only_occupied_slots():
+    wheel, clock = make_wheel(tick=0.5)
+    for i in range(5):
+        wheel.touch(f"ESP32-{i}", now=i)
+    # A gap of a million slots takes the sparse path and still finds all
+    assert sorted(wheel.expire(500000.0)) == [f"ESP32-{i}" for i in range(5)]
+    assert wheel.next_slot == 1000000
+
+
+def test_deadline_in_the_past_lands_in_the_next_slot():
+    wheel, clock = make_wheel(default_timeout=1.0)
+    wheel.expire(100.0)
+    wheel.touch("ESP32-1", now=50.0)
+    assert wheel.slot_of["ESP32-1"] == 100
+    assert wheel.expire(101.0) == ["ESP32-1"]
@@ -0,0 +1,137 @@
+import pytest
+
+from latency import LatencyHistogram, RoundTripTracker
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.parametrize("bits", [3, 5, 7])
+def test_buckets_tile_the_value_range(bits):
+    histogram = LatencyHistogram(max_seconds=1.0, significant_bits=bits)
+    previous_index = -1
+    for value in range(0, 200000, 7):
+        index = histogram.index_of(value)
+        highest = histogram.highest_value_at(index)
+        # Indexes never go back and each value is inside its bucket
+        assert index >= previous_index
+        assert histogram.index_of(highest) == index
+        assert histogram.index_of(highest + 1) == index + 1
+        assert highest >= value
+        previous_index = index
+
+
+@pytest.mark.parametrize("bits", [3, 5, 7])
+def test_relative_error_is_bounded(bits):
+    histogram = LatencyHistogram(max_seconds=60.0, significant_bits=bits)
+    bound = 1.0 / histogram.half
+    for value in (1, 31, 32, 33, 1000, 65535, 65536, 1234567, 59999999):
+        highest = histogram.highest_value_at(histogram.index_of(value))
+        assert (highest - value) / value <= bound
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram(significant_bits=5)
+    for value in range(32):
+        assert histogram.index_of(value) == value
+        assert histogram.highest_value_at(value) == value
+
+
+def test_percentiles_and_summary():
+    histogram = LatencyHistogram(significant_bits=7)
+    assert histogram.percentile(50) is None
+    for ms in range(1, 1001):
+        histogram.record(ms / 1000.0)
+    assert histogram.count == 1000
+    assert histogram.percentile(50) == pytest.approx(0.5, rel=1 / 64)
+    assert histogram.percentile(99) == pytest.approx(0.99, rel=1 / 64)
+    # Never above the largest value seen
+    assert histogram.percentile(100) == 1.0
+    summary = histogram.summary()
+    assert summary["min"] == 0.001
+    assert summary["max"] == 1.0
+    assert summary["mean"] == pytest.approx(0.5005)
+
+
+def test_out_of_range_values_are_clamped():
+    histogram = LatencyHistogram(max_seconds=1.0)
+    histogram.record(-0.5)
+    histogram.record(5.0)
+    assert histogram.summary()["min"] == 0.0
+    assert histogram.summary()["max"] == 1.0
+    assert sum(histogram.counts) == 2
+
+
+def test_reset_clears_everything():
+    histogram = LatencyHistogram()
+    histogram.record(0.25)
+    histogram.reset()
+    assert histogram.count == 0
+    assert sum(histogram.counts) == 0
+    assert histogram.summary()["max"] is None
+
+
+def test_round_trip_matching():
+    clock = Clock()
+    tracker = RoundTripTracker(clock=clock)
+    first = tracker.send("ESP32-1", "ON")
+    second = tracker.send("ESP32-2", "OFF")
+    assert second == first + 1
+    clock.now = 0.25
+    assert tracker.on_reply("ESP32-1", first) == 0.25
+    # Only the addressed device can answer, and only once
+    assert tracker.on_reply("ESP32-1", second) is None
+    assert tracker.on_reply("ESP32-1", first) is None
+    assert tracker.device_summary("ESP32-1")["count"] == 1
+    stats = tracker.stats()
+    assert (stats["matched"], stats["unmatched"], stats["pending"]) == (1, 2, 1)
+
+
+def test_broadcast_stays_pending_for_every_device():
+    clock = Clock()
+    tracker = RoundTripTracker(clock=clock)
+    command_id = tracker.send("ALL", "status")
+    clock.now = 0.1
+    assert tracker.on_reply("ESP32-1", command_id) == pytest.approx(0.1)
+    assert tracker.on_reply("ESP32-2", command_id) == pytest.approx(0.1)
+    assert tracker.stats()["pending"] == 1
+    # A broadcast timing out is not a lost reply
+    clock.now = 100.0
+    tracker.expire()
+    assert tracker.stats()["pending"] == 0
+    assert tracker.lost == 0
+
+
+def test_cancelled_commands_are_not_lost():
+    clock = Clock()
+    tracker = RoundTripTracker(timeout=30.0, clock=clock)
+    dropped = tracker.send("ESP32-1", "ON")
+    tracker.send("ESP32-1", "OFF")
+    tracker.cancel(dropped)
+    tracker.cancel(dropped)
+    clock.now = 31.0
+    tracker.expire()
+    assert tracker.cancelled == 1
+    assert tracker.lost == 1
+    assert tracker.device_summary("ESP32-1")["lost"] == 1
+
+
+def test_pending_table_is_bounded():
+    tracker = RoundTripTracker(max_pending=3, clock=Clock())
+    for _ in range(5):
+        tracker.send("ESP32-1", "ON")
+    assert tracker.stats()["pending"] == 3
+    assert tracker.lost == 2
+
+
+def test_ids_wrap_before_the_firmware_long_overflows():
+    tracker = RoundTripTracker()
+    tracker.ids = iter([0x7FFFFFFF, 0x80000000])
+    assert tracker.next_id() == 0x7FFFFFFF
+    assert tracker.next_id() == 1
+    assert tracker.next_id() == 2
@@ -0,0 +1,103 @@
+import json
+
+from message_index import ENTRY_OVERHEAD, INBOUND, OUTBOUND, MessageIndex, message_terms
+
+
+def report(device, state, kind="com"):
+    return json.dumps({"type": kind, "device": device, "state": state}).encode()
+
+
+def fill(index, count, topic="ESP32bootcamp_com"):
+    for i in range(count):
+        device = f"ESP32-{i % 3 + 1}"
+        index.add(INBOUND, topic, report(device, "ON" if i % 2 else "OFF"), i)
+
+
+def test_terms_come_from_topic_direction_and_payload_fields():
+    terms = message_terms(INBOUND, "Fleet/A", report("ESP32-7", "ON"))
+    assert terms == {
+        "dir:in",
+        "topic:fleet/a",
+        "type:com",
+        "device:esp32-7",
+        "state:on",
+    }
+    group = json.dumps({"device": "GROUP", "devices": ["ESP32-1", "ESP32-2"]})
+    assert {"device:group", "device:esp32-1", "device:esp32-2"} <= message_terms(
+        OUTBOUND, "ctl", group.encode()
+    )
+    # Non-JSON payloads are found by topic and direction only
+    assert message_terms(INBOUND, "t", b"ON") == {"dir:in", "topic:t"}
+    assert message_terms(INBOUND, "t", b"{broken") == {"dir:in", "topic:t"}
+
+
+def test_search_ands_words_newest_first():
+    index = MessageIndex(capacity=100)
+    fill(index, 12)
+    seqs, total = index.search("device:esp32-1 state:on")
+    # ESP32-1 is i % 3 == 0, ON is odd i
+    assert seqs == [9, 3]
+    assert total == 2
+    assert index.entry(9)[1:3] == (INBOUND, "ESP32bootcamp_com")
+    assert json.loads(index.entry(9)[3])["device"] == "ESP32-1"
+
+
+def test_bare_words_prefixes_and_case():
+    index = MessageIndex(capacity=100)
+    fill(index, 6)
+    index.add(OUTBOUND, "ESP32bootcamp_control", report("ESP32-10", "ON", "control"))
+    assert index.search("ESP32-2")[0] == [4, 1]
+    assert index.search("esp32-1*")[0] == [6, 3, 0]
+    assert index.search("control")[0] == [6]
+    assert index.search("dir:out")[0] == [6]
+    assert index.search("missing") == ([], 0)
+    assert index.search("   ") == ([], 0)
+
+
+def test_single_term_total_and_limit():
+    index = MessageIndex(capacity=100)
+    fill(index, 30)
+    seqs, total = index.search("dir:in", limit=5)
+    assert seqs == [29, 28, 27, 26, 25]
+    assert total == 30
+    # With several words the total is unknown once the limit is hit
+    seqs, total = index.search("dir:in type:com", limit=5)
+    assert seqs == [29, 28, 27, 26, 25]
+    assert total is None
+
+
+def test_capacity_evicts_oldest_and_searches_skip_them():
+    index = MessageIndex(capacity=8, initial=2)
+    fill(index, 20)
+    assert len(index) == 8
+    assert index.entry(11) is None
+    assert index.entry(12) is not None
+    seqs, total = index.search("device:esp32-1")
+    assert seqs == [18, 15, 12]
+    assert all(seq >= 12 for seq in index.search("dir:in")[0])
+    assert index.stats()["evicted"] == 12
+    # Sweeps run every capacity // 4 evictions and trim the postings
+    assert index.stats()["postings"] < 20 * 4
+
+
+def test_byte_budget_evicts_too():
+    payload = b"x" * 100
+    index = MessageIndex(capacity=1000, max_bytes=5 * (100 + ENTRY_OVERHEAD))
+    for i in range(8):
+        index.add(INBOUND, "t", payload, i)
+    assert len(index) == 5
+    assert index.bytes == 5 * (100 + ENTRY_OVERHEAD)
+    assert index.search("topic:t")[0] == [7, 6, 5, 4, 3]
+
+
+def test_slots_grow_on_demand_up_to_capacity():
+    index = MessageIndex(capacity=100, initial=4)
+    assert index.allocated == 4
+    fill(index, 5)
+    assert index.allocated == 8
+    fill(index, 60)
+    assert index.allocated == 100
+    fill(index, 200)
+    assert index.allocated == 100
+    assert len(index.payloads) == 100
+    assert len(index) == 100
@@ -0,0 +1,185 @@
+import threading
+import time
+
+import pytest
+
+from outbox import StoreAndForward
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class Sink:
+    # forward and on_drop targets
+    def __init__(self):
+        self.sent = []
+        self.threads = []
+        self.drops = []
+
+    def forward(self, topic, payload, device, tag):
+        self.sent.append((payload, device, tag))
+        self.threads.append(threading.current_thread())
+
+    def on_drop(self, topic, payload, device, tag):
+        self.drops.append((payload, tag))
+
+
+@pytest.fixture
+def sink():
+    return Sink()
+
+
+def make_outbox(sink, **kwargs):
+    kwargs.setdefault("drain_rate", 0)
+    outbox = StoreAndForward(sink.forward, on_drop=sink.on_drop, **kwargs)
+    return outbox
+
+
+def payloads(sink):
+    return [payload for payload, _, _ in sink.sent]
+
+
+def test_online_and_empty_forwards_on_the_calling_thread(sink):
+    outbox = make_outbox(sink)
+    outbox.set_online(True)
+    assert outbox.submit("t", "hello", "ESP32-1", tag=7)
+    assert sink.sent == [(b"hello", "ESP32-1", 7)]
+    assert sink.threads == [threading.current_thread()]
+    assert outbox.thread is None
+    outbox.close()
+
+
+def test_held_messages_drain_in_order_once_online(sink):
+    outbox = make_outbox(sink)
+    for i in range(20):
+        assert not outbox.submit("t", b"%d" % i)
+    assert len(outbox) == 20
+    outbox.set_online(True)
+    wait_until(lambda: len(sink.sent) == 20)
+    assert payloads(sink) == [b"%d" % i for i in range(20)]
+    assert outbox.stats()["forwarded"] == 20
+    outbox.close()
+
+
+def test_without_direct_everything_goes_through_the_drain_thread(sink):
+    outbox = make_outbox(sink, direct=False)
+    outbox.set_online(True)
+    assert not outbox.submit("t", b"a")
+    wait_until(lambda: sink.sent)
+    assert sink.threads[0] is outbox.thread
+    outbox.close()
+
+
+def test_expired_messages_are_dropped_with_their_tag(sink):
+    clock = Clock()
+    outbox = make_outbox(sink, clock=clock)
+    outbox.submit("t", b"short", ttl=5, tag=1)
+    outbox.submit("t", b"long", ttl=60, tag=2)
+    outbox.submit("t", b"forever", tag=3)
+    clock.now += 10
+    outbox.set_online(True)
+    wait_until(lambda: len(sink.sent) == 2)
+    assert payloads(sink) == [b"long", b"forever"]
+    assert sink.drops == [(b"short", 1)]
+    assert outbox.stats()["expired"] == 1
+    outbox.close()
+
+
+def test_coalesce_keeps_only_the_latest_per_key(sink):
+    outbox = make_outbox(sink)
+    outbox.submit("t", b"ON", "ESP32-1", key="control:ESP32-1", tag=1)
+    outbox.submit("t", b"other", "ESP32-2", key="control:ESP32-2", tag=2)
+    outbox.submit("t", b"OFF", "ESP32-1", key="control:ESP32-1", tag=3)
+    assert sink.drops == [(b"ON", 1)]
+    outbox.set_online(True)
+    wait_until(lambda: len(sink.sent) == 2)
+    assert payloads(sink) == [b"other", b"OFF"]
+    assert outbox.stats()["coalesced"] == 1
+    outbox.close()
+
+
+def test_without_spill_file_the_oldest_are_dropped(sink):
+    outbox = make_outbox(sink, max_memory_bytes=400)
+    for i in range(10):
+        outbox.submit("t", b"x" * 50, tag=i)
+    dropped = outbox.stats()["dropped"]
+    assert dropped > 0
+    assert [tag for _, tag in sink.drops] == list(range(dropped))
+    outbox.set_online(True)
+    wait_until(lambda: len(sink.sent) == 10 - dropped)
+    assert [tag for _, _, tag in sink.sent] == list(range(dropped, 10))
+    outbox.close()
+
+
+def test_spilled_messages_come_back_in_order(sink, tmp_path):
+    outbox = make_outbox(
+        sink, spill_path=str(tmp_path / "out.spill"), max_memory_bytes=400
+    )
+    for i in range(50):
+        outbox.submit("t", b"%03d" % i + b"x" * 50, "ESP32-1", tag=i)
+    stats = outbox.stats()
+    assert stats["spilled"] > 0 and stats["dropped"] == 0
+    outbox.set_online(True)
+    wait_until(lambda: len(sink.sent) == 50)
+    assert [tag for _, _, tag in sink.sent] == list(range(50))
+    assert [payload[:3] for payload in payloads(sink)] == [
+        b"%03d" % i for i in range(50)
+    ]
+    assert not (tmp_path / "out.spill").exists()
+    outbox.close()
+
+
+def test_superseded_spilled_message_is_skipped(sink, tmp_path):
+    outbox = make_outbox(
+        sink, spill_path=str(tmp_path / "out.spill"), max_memory_bytes=200
+    )
+    for i in range(5):
+        outbox.submit("t", b"filler%d" % i + b"x" * 60, tag=i)
+    outbox.submit("t", b"old", key="status:ALL", tag=10)
+    assert outbox.stats()["spilled"] > 0
+    outbox.submit("t", b"new", key="status:ALL", tag=11)
+    outbox.set_online(True)
+    wait_until(lambda: len(sink.sent) == 6)
+    assert payloads(sink)[-1] == b"new"
+    assert b"old" not in payloads(sink)
+    assert sink.drops == [(b"old", 10)]
+    outbox.close()
+
+
+def test_unsent_messages_survive_a_restart(sink, tmp_path):
+    path = str(tmp_path / "out.spill")
+    outbox = make_outbox(sink, spill_path=path, max_memory_bytes=300)
+    for i in range(12):
+        outbox.submit("t", b"%02d" % i + b"y" * 40, "ESP32-3", key=f"k{i % 4}", tag=i)
+    outbox.close()
+    assert sink.sent == []
+
+    restarted = Sink()
+    outbox = make_outbox(restarted, spill_path=path)
+    # Superseded ones still in memory were not written back
+    assert 4 <= len(outbox) < 12
+    outbox.set_online(True)
+    # Coalesced across the restart: only the last of each key counts
+    wait_until(lambda: len(restarted.sent) == 4)
+    assert [payload[:2] for payload in payloads(restarted)] == [
+        b"08",
+        b"09",
+        b"10",
+        b"11",
+    ]
+    # Tags do not outlive the process
+    assert {tag for _, _, tag in restarted.sent} == {None}
+    assert {device for _, device, _ in restarted.sent} == {"ESP32-3"}
+    outbox.close()
@@ -0,0 +1,117 @@
+import pytest
+
+from topic_router import TopicRouter, split_filter
+
+
+def handler(name, calls=None):
+    def handle(topic, payload):
+        if calls is not None:
+            calls.append((name, topic, payload))
+
+    handle.__name__ = name
+    return handle
+
+
+def names(handlers):
+    return sorted(h.__name__ for h in handlers)
+
+
+@pytest.fixture
+def router():
+    router = TopicRouter()
+    for topic_filter in ("a/b/c", "a/+/c", "a/#", "+/b/+", "#", "a/+"):
+        router.add(topic_filter, handler(topic_filter))
+    return router
+
+
+def test_exact_and_single_level_wildcards(router):
+    assert names(router.match("a/b/c")) == ["#", "+/b/+", "a/#", "a/+/c", "a/b/c"]
+    assert names(router.match("a/x/c")) == ["#", "a/#", "a/+/c"]
+    assert names(router.match("z/b/y")) == ["#", "+/b/+"]
+    # "+" fills exactly one level
+    assert names(router.match("a/b/c/d")) == ["#", "a/#"]
+    assert names(router.match("a/b")) == ["#", "a/#", "a/+"]
+
+
+def test_multi_level_wildcard_matches_its_parent(router):
+    assert names(router.match("a")) == ["#", "a/#"]
+
+
+def test_dollar_topics_skip_leading_wildcards(router):
+    router.add("$SYS/#", handler("$SYS/#"))
+    assert names(router.match("$SYS/broker/load")) == ["$SYS/#"]
+    assert names(router.match("$SYS")) == ["$SYS/#"]
+    # Only the first level is special
+    assert names(router.match("a/$x")) == ["#", "a/#", "a/+"]
+
+
+def test_malformed_filters_are_rejected():
+    router = TopicRouter()
+    for topic_filter in ("a/#/b", "a/b+", "a#", "+a/b"):
+        with pytest.raises(ValueError):
+            router.add(topic_filter, handler("x"))
+    assert split_filter("a/+/#") == ["a", "+", "#"]
+    assert router.filters == {}
+
+
+def test_dispatch_calls_every_handler_and_counts():
+    calls = []
+    router = TopicRouter()
+    router.add("fleet/+/state", handler("state", calls))
+    router.add("fleet/#", handler("all", calls))
+    assert router.dispatch("fleet/ESP32-1/state", b"ON")
+    assert not router.dispatch("other", b"x")
+    assert sorted(calls) == [
+        ("all", "fleet/ESP32-1/state", b"ON"),
+        ("state", "fleet/ESP32-1/state", b"ON"),
+    ]
+    assert router.stats()["routed"] == 1
+    assert router.stats()["unrouted"] == 1
+
+
+def test_adding_the_same_handler_twice_keeps_one():
+    router = TopicRouter()
+    h = handler("h")
+    router.add("a/+", h)
+    router.add("a/+", h)
+    assert router.match("a/b") == [h]
+    assert router.filters == {"a/+": [h]}
+
+
+def test_cache_is_invalidated_by_add_and_remove():
+    router = TopicRouter()
+    first = handler("first")
+    router.add("a/+", first)
+    assert router.match("a/b") == [first]
+    assert "a/b" in router.cache
+
+    second = handler("second")
+    router.add("a/b", second)
+    assert router.cache == {}
+    assert names(router.match("a/b")) == ["first", "second"]
+
+    router.remove("a/+", first)
+    assert router.cache == {}
+    assert router.match("a/b") == [second]
+
+
+def test_remove_prunes_empty_branches():
+    router = TopicRouter()
+    h = handler("h")
+    router.add("a/b/c/d", h)
+    router.add("a/x", h)
+    router.remove("a/b/c/d", h)
+    assert list(router.root.children["a"].children) == ["x"]
+    router.remove("a/x")
+    assert router.root.children == {}
+    assert router.filters == {}
+    # Removing what is not there is a no-op
+    router.remove("never/added", h)
+
+
+def test_cache_is_bounded():
+    router = TopicRouter(cache_size=4)
+    router.add("#", handler("all"))
+    for i in range(10):
+        router.match(f"t/{i}")
+    assert len(router.cache) <= 4
@@ -0,0 +1,123 @@
+class TopicNode:
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+
+def split_filter(topic_filter):
+    levels = topic_filter.split("/")
+    for index, level in enumerate(levels):
+        if level == "#" and index != len(levels) - 1:
+            raise ValueError(f"'#' must be the last level: {topic_filter}")
+        if level not in ("+", "#") and ("+" in level or "#" in level):
+            raise ValueError(f"Wildcards must fill a whole level: {topic_filter}")
+    return levels
+
+
+class TopicRouter:
+    # Subscription filters stored as a trie of topic levels, with "+" and "#"
+    # as ordinary children. Matching walks the topic once and only branches
+    # into the wildcard children, so the cost depends on the topic depth and
+    # not on how many filters are registered.
+    def __init__(self, cache_size=4096):
+        self.root = TopicNode()
+        self.filters = {}  # filter -> handlers, for listing and removal
+        # Resolved handler lists for recently seen topics, cleared on changes
+        self.cache = {}
+        self.cache_size = cache_size
+        self.routed = 0
+        self.unrouted = 0
+
+    def add(self, topic_filter, handler):
+        node = self.root
+        for level in split_filter(topic_filter):
+            node = node.children.setdefault(level, TopicNode())
+        if handler not in node.handlers:
+            node.handlers.append(handler)
+            self.filters.setdefault(topic_filter, []).append(handler)
+            self.cache.clear()
+
+    def remove(self, topic_filter, handler=None):
+        # Without a handler every handler of the filter is removed
+        path = [self.root]
+        for level in split_filter(topic_filter):
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        node = path[-1]
+        if handler is None:
+            node.handlers.clear()
+        elif handler in node.handlers:
+            node.handlers.remove(handler)
+        handlers = [h for h in self.filters.get(topic_filter, ()) if h in node.handlers]
+        if handlers:
+            self.filters[topic_filter] = handlers
+        else:
+            self.filters.pop(topic_filter, None)
+        # Prune empty branches so the trie does not grow with churn
+        levels = topic_filter.split("/")
+        for depth in range(len(levels), 0, -1):
+            child = path[depth]
+            if child.handlers or child.children:
+                break
+            del path[depth - 1].children[levels[depth - 1]]
+        self.cache.clear()
+
+    def match(self, topic):
+        handlers = self.cache.get(topic)
+        if handlers is not None:
+            return handlers
+        handlers = []
+        levels = topic.split("/")
+        # Topics starting with "$" (broker internals) never match a leading
+        # wildcard, as in the MQTT spec
+        system = topic.startswith("$")
+        nodes = [self.root]
+        for depth, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                children = node.children
+                if not (system and depth == 0):
+                    multi = children.get("#")
+                    if multi is not None:
+                        handlers.extend(multi.handlers)
+                    single = children.get("+")
+                    if single is not None:
+                        next_nodes.append(single)
+                exact = children.get(level)
+                if exact is not None:
+                    next_nodes.append(exact)
+            nodes = next_nodes
+            if not nodes:
+                break
+        for node in nodes:
+            handlers.extend(node.handlers)
+            # "a/#" also matches "a" itself
+            multi = node.children.get("#")
+            if multi is not None:
+                handlers.extend(multi.handlers)
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[topic] = handlers
+        return handlers
+
+    def dispatch(self, topic, payload):
+        handlers = self.match(topic)
+        if not handlers:
+            self.unrouted += 1
+            return False
+        self.routed += 1
+        for handler in handlers:
+            handler(topic, payload)
+        return True
+
+    def stats(self):
+        return {
+            "filters": len(self.filters),
+            "routed": self.routed,
+            "unrouted": self.unrouted,
+            "cached_topics": len(self.cache),
+        }
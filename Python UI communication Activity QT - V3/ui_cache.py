@@ -0,0 +1,78 @@
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+
+CACHE_DIR = "__uicache__"
+
+
+def cached_module_path(ui_path, cache_dir=None):
+    # The module name carries the content hash, so an edited .ui file gets a
+    # new module and the stale one is simply never imported again
+    with open(ui_path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(ui_path)), CACHE_DIR)
+    stem = os.path.splitext(os.path.basename(ui_path))[0]
+    return os.path.join(cache_dir, f"{stem}_{digest}.py")
+
+
+def compile_ui(ui_path, module_path):
+    from PyQt5 import uic
+
+    source = io.StringIO()
+    with open(ui_path) as f:
+        uic.compileUi(f, source)
+    os.makedirs(os.path.dirname(module_path), exist_ok=True)
+    # Write then rename so a second instance never imports a half-written file
+    tmp_path = f"{module_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(source.getvalue())
+    os.replace(tmp_path, module_path)
+
+    # Drop modules compiled from older versions of the same .ui file
+    stem = os.path.basename(module_path).rsplit("_", 1)[0]
+    for name in os.listdir(os.path.dirname(module_path)):
+        if (
+            name.startswith(stem + "_")
+            and name.endswith(".py")
+            and name != os.path.basename(module_path)
+        ):
+            try:
+                os.remove(os.path.join(os.path.dirname(module_path), name))
+            except OSError:
+                pass
+
+
+def load_ui_class(ui_path, cache_dir=None):
+    module_path = cached_module_path(ui_path, cache_dir)
+    if not os.path.exists(module_path):
+        compile_ui(ui_path, module_path)
+    name = os.path.splitext(os.path.basename(module_path))[0]
+    spec = importlib.util.spec_from_file_location(name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for attr, value in vars(module).items():
+        if attr.startswith("Ui_") and isinstance(value, type):
+            return value
+    raise ImportError(f"No Ui_ class in {module_path}")
+
+
+def load_ui(ui_path, widget, cache_dir=None):
+    # Same result as uic.loadUi(ui_path, widget): every named child becomes an
+    # attribute of widget. Falls back to parsing the XML if the cache can't be
+    # written (read-only install, ...).
+    try:
+        ui_class = load_ui_class(ui_path, cache_dir)
+    except (OSError, ImportError, SyntaxError) as e:
+        from PyQt5 import uic
+
+        logging.warning(f"UI cache unavailable, parsing {ui_path}: {e}")
+        uic.loadUi(ui_path, widget)
+        return None
+    ui = ui_class()
+    ui.setupUi(widget)
+    for name, child in vars(ui).items():
+        setattr(widget, name, child)
+    return ui
@@ -1,10 +1,15 @@
-from PyQt5 import QtWidgets, uic, QtGui
+from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QMainWindow
-from datetime import datetime
 import json
 import logging
-from PyQt5.QtCore import QTimer
+from PyQt5.QtCore import QTimer, Qt, QSortFilterProxyModel
 from PyQt5.QtCore import pyqtSignal
+from log_model import LogListModel
+from ui_cache import load_ui
+from device_table import DeviceTableModel, DEVICE_COLUMN, LIGHT_COLUMN
+from stats_panel import StatsPanel, EventLoopProbe
+from history_panel import HistoryPanel
+from message_index import MessageIndex, INBOUND, OUTBOUND
 
 
 class MQTTView(QMainWindow):
@@ -12,86 +17,57 @@ class MQTTView(QMainWindow):
     update_topic_log_signal = pyqtSignal(str, str)
     update_device_status_signal = pyqtSignal(str, str, str)
 
-    def __init__(self, controller):
+    def __init__(self, controller, history_size=100000):
         super().__init__()
-        uic.loadUi("qtUiMqttBootcamProjectDesign.ui", self)
+        # Compiled once into __uicache__, widgets become attributes like loadUi
+        load_ui("qtUiMqttBootcamProjectDesign.ui", self)
 
         self.controller = controller
 
         # Initialize button states
         self.button_states = {"mqtt_connection": "OFF", "task_schedule": "OFF"}
 
-        # Find and assign widgets
-        self.mqtt_server_input = self.findChild(
-            QtWidgets.QLineEdit, "MQTT_server_input"
-        )
-        self.mqtt_port_input = self.findChild(QtWidgets.QLineEdit, "MQTT_port_input")
-        self.publish_topic_input = self.findChild(
-            QtWidgets.QLineEdit, "publish_topic_input"
-        )
-        self.subscribe_topic_input = self.findChild(
-            QtWidgets.QLineEdit, "subscribe_topic_input"
-        )
+        # Names used by the controller that differ from the .ui object names
+        self.mqtt_server_input = self.MQTT_server_input
+        self.mqtt_port_input = self.MQTT_port_input
 
-        self.client_id_input = self.findChild(QtWidgets.QLineEdit, "client_id_input")
-        self.message_payload_textEdit = self.findChild(
-            QtWidgets.QTextEdit, "message_payload_textEdit"
-        )
-        self.activity_log_textBrowser = self.findChild(
-            QtWidgets.QTextBrowser, "activity_log_textBrowser"
-        )
-        self.published_log_textBrowser = self.findChild(
-            QtWidgets.QTextBrowser, "published_log_textBrowser"
+        # Bounded log models, rows are formatted only when they are painted
+        self.activity_log_model = LogListModel(capacity=2000)
+        self.published_log_model = LogListModel(
+            capacity=5000, date_format="%Y-%m-%d %H:%M:%S"
         )
-        self.subscribed_log_textBrowser = self.findChild(
-            QtWidgets.QTextBrowser, "subscribed_log_textBrowser"
+        self.subscribed_log_model = LogListModel(
+            capacity=5000, date_format="%Y-%m-%d %H:%M:%S"
         )
+        self.setup_log_view(self.activity_log_listView, self.activity_log_model)
+        self.setup_log_view(self.published_log_listView, self.published_log_model)
+        self.setup_log_view(self.subscribed_log_listView, self.subscribed_log_model)
 
-        # Find and assign buttons
-        self.mqtt_connection_pushButton = self.findChild(
-            QtWidgets.QPushButton, "mqtt_connection_pushButton"
-        )
-        self.task_schedule_pushButton = self.findChild(
-            QtWidgets.QPushButton, "task_schedule_pushButton"
-        )
-        self.publish_pushButton = self.findChild(
-            QtWidgets.QPushButton, "publish_pushButton"
-        )
-        self.master_control_pushButton_ON = self.findChild(
-            QtWidgets.QPushButton, "master_control_pushButton_ON"
-        )
-        self.master_control_pushButton_OFF = self.findChild(
-            QtWidgets.QPushButton, "master_control_pushButton_OFF"
-        )
-        self.master_control_pushButton_request_status = self.findChild(
-            QtWidgets.QPushButton, "master_control_pushButton_request_status"
-        )
-        self.update_pub_pushButton = self.findChild(
-            QtWidgets.QPushButton, "update_pub_pushButton"
-        )
-        self.update_sub_pushButton = self.findChild(
-            QtWidgets.QPushButton, "update_sub_pushButton"
+        # The panes keep the latest few thousand messages, the index a
+        # searchable history behind View > Message history. Its ring grows
+        # with the traffic up to history_size messages.
+        self.message_index = MessageIndex(
+            capacity=history_size, max_bytes=256 * 1024 * 1024
         )
+        self.history_panel = HistoryPanel(self.message_index, self)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.history_panel)
+        self.history_panel.hide()
+        self.actionHistory.toggled.connect(self.history_panel.setVisible)
+        self.history_panel.visibilityChanged.connect(self.actionHistory.setChecked)
 
-        # Find and assign radio buttons
-        self.aws_radioButton = self.findChild(QtWidgets.QRadioButton, "aws_radioButton")
-        self.local_radioButton = self.findChild(
-            QtWidgets.QRadioButton, "local_radioButton"
+        # Device table, rows are added as devices are discovered
+        self.device_model = DeviceTableModel()
+        self.device_proxy_model = QSortFilterProxyModel(self)
+        self.device_proxy_model.setSourceModel(self.device_model)
+        self.device_proxy_model.setFilterKeyColumn(DEVICE_COLUMN)
+        self.device_proxy_model.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.device_tableView.setModel(self.device_proxy_model)
+        self.device_tableView.verticalHeader().setSectionResizeMode(
+            QtWidgets.QHeaderView.Fixed
+        )
+        self.device_tableView.horizontalHeader().setSectionResizeMode(
+            QtWidgets.QHeaderView.Stretch
         )
-
-        # Assign device buttons dynamically
-        self.device_buttons = {}
-        self.device_status_labels = {}
-        for i in range(1, 7):
-            self.device_buttons[f"esp32_{i}_pushButton"] = self.findChild(
-                QtWidgets.QPushButton, f"esp32_{i}_pushButton"
-            )
-            self.device_status_labels[f"esp32_{i}_id_status_label"] = self.findChild(
-                QtWidgets.QLabel, f"esp32_{i}_id_status_label"
-            )
-
-            # Initialize button state
-            self.button_states[f"ESP32-{i}"] = "OFF"
 
         # Connect signals to slots
         self.mqtt_connection_pushButton.clicked.connect(self.toggle_mqtt_connection)
@@ -109,10 +85,11 @@ class MQTTView(QMainWindow):
         self.update_pub_pushButton.clicked.connect(self.update_publish_topic)
         self.update_sub_pushButton.clicked.connect(self.update_subscribe_topic)
 
-        for i in range(1, 7):
-            self.device_buttons[f"esp32_{i}_pushButton"].clicked.connect(
-                lambda _, d=i: self.toggle_device(f"ESP32-{d}")
-            )
+        self.device_filter_input.textChanged.connect(
+            self.device_proxy_model.setFilterFixedString
+        )
+        self.device_tableView.clicked.connect(self.on_device_table_clicked)
+        self.device_tableView.customContextMenuRequested.connect(self.show_device_menu)
 
         # Preload task schedule message
         self.message_payload_textEdit.setPlainText(
@@ -139,11 +116,73 @@ class MQTTView(QMainWindow):
         self.controller.control_schedule(new_state)
         self.button_states["task_schedule"] = new_state
 
+    def on_device_table_clicked(self, proxy_index):
+        if proxy_index.column() != LIGHT_COLUMN:
+            return
+        source_index = self.device_proxy_model.mapToSource(proxy_index)
+        self.toggle_device(self.device_model.device_at(source_index.row()))
+
     def toggle_device(self, device):
-        current_state = self.button_states[device]
+        current_state = self.device_model.state_of(device)
         new_state = "OFF" if current_state == "ON" else "ON"
         self.controller.control_device(device, new_state)
 
+    def selected_devices(self):
+        rows = self.device_tableView.selectionModel().selectedRows()
+        return [
+            self.device_model.device_at(
+                self.device_proxy_model.mapToSource(index).row()
+            )
+            for index in sorted(rows, key=lambda index: index.row())
+        ]
+
+    def show_device_menu(self, position):
+        devices = self.selected_devices()
+        if not devices:
+            return
+        menu = QtWidgets.QMenu(self)
+        for text, action in (
+            ("Turn ON", "ON"),
+            ("Turn OFF", "OFF"),
+            ("Status", "status"),
+        ):
+            menu.addAction(
+                f"{text} ({len(devices)})",
+                lambda action=action: self.controller.control_devices(devices, action),
+            )
+        menu.addSeparator()
+        menu.addAction("Save as group...", lambda: self.save_group(devices))
+        menu.exec_(self.device_tableView.viewport().mapToGlobal(position))
+
+    def save_group(self, devices):
+        name, ok = QtWidgets.QInputDialog.getText(self, "Save group", "Group name:")
+        if ok and name.strip():
+            self.controller.define_group(name.strip(), devices)
+
+    def update_groups_menu(self, groups, scenes):
+        # Rebuilt whenever a group or scene is defined
+        self.menuGroups.clear()
+        for group in sorted(groups):
+            submenu = self.menuGroups.addMenu(f"{group} ({len(groups[group])})")
+            for text, action in (("ON", "ON"), ("OFF", "OFF"), ("Status", "status")):
+                submenu.addAction(
+                    text,
+                    lambda group=group, action=action: self.controller.control_group(
+                        group, action
+                    ),
+                )
+            submenu.addSeparator()
+            submenu.addAction(
+                "Remove", lambda group=group: self.controller.remove_group(group)
+            )
+        if scenes:
+            self.menuGroups.addSection("Scenes")
+            for scene in sorted(scenes):
+                self.menuGroups.addAction(
+                    scene, lambda scene=scene: self.controller.apply_scene(scene)
+                )
+        self.menuGroups.setEnabled(bool(groups or scenes))
+
     def publish_message(self):
         message = self.message_payload_textEdit.toPlainText()
         self.controller.send_message(message)
@@ -151,19 +190,30 @@ class MQTTView(QMainWindow):
     def control_master(self, action):
         self.controller.control_master(action)
 
+    def setup_log_view(self, list_view, log_model):
+        list_view.setModel(log_model)
+        list_view.setUniformItemSizes(True)
+        list_view.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        list_view.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+
+        # Follow new rows only while the user is looking at the bottom
+        def follow_tail(*_):
+            scroll_bar = list_view.verticalScrollBar()
+            if scroll_bar.value() == scroll_bar.maximum():
+                list_view.scrollToBottom()
+
+        log_model.rowsInserted.connect(follow_tail)
+
     def log_message(self, message):
-        print(" I am log message")
-        self.activity_log_textBrowser.append(message)
+        self.activity_log_model.append(message)
 
-    def update_topic_log(self, message, topic_type):
-        now = datetime.now()
-        formatted_now = now.strftime("%Y-%m-%d %H:%M:%S")
+    def update_topic_log(self, message, topic_type, topic=None):
         if topic_type == "publish":
-            self.published_log_textBrowser.append(f"{formatted_now}\n{message}\n")
-            self.published_log_textBrowser.moveCursor(QtGui.QTextCursor.End)
+            self.published_log_model.append(message)
+            self.message_index.add(OUTBOUND, topic, message)
         else:
-            self.subscribed_log_textBrowser.append(f"{formatted_now}\n{message}\n")
-            self.subscribed_log_textBrowser.moveCursor(QtGui.QTextCursor.End)
+            self.subscribed_log_model.append(message)
+            self.message_index.add(INBOUND, topic, message)
 
     def update_publish_topic(self):
         topic = self.publish_topic_input.text()
@@ -180,55 +230,36 @@ class MQTTView(QMainWindow):
             self.controller.update_subscribe_topic(topic)
 
     def update_device_status(self, device, status, state):
-        device_key = device.lower().replace("-", "_")
-        label = self.device_status_labels.get(f"{device_key}_id_status_label")
-        if label:
-            color = "green" if status == "Connected" else "red"
-            label.setText(status)
-            label.setStyleSheet(f"color: {color};")
-            self.button_states[device] = state
-            self.update_device_button(device, state)
-
-    def update_device_button(self, device, state):
-        try:
-            print("update_device_button_start")
-            device_key = device.lower().replace("-", "_")
-            button = self.device_buttons.get(f"{device_key}_pushButton")
-            print("update_device_button_processed button")
-
-            if button:
-                self.update_button_state(button, state)
-                print("update_device_button_end")
-        except Exception as e:
-            logging.error(f"Failed to change the button color: {e}")
-            logging.exception("Exception occurred")  # This will print the stack trace
+        self.device_model.update_device(device, status, state)
+
+    def update_round_trip(self, device, summary):
+        self.device_model.update_round_trip(device, summary)
+
+    def update_fleet_round_trip(self, stats):
+        fleet = stats["fleet"]
+        if not fleet["count"]:
+            return
+        self.statusBar().showMessage(
+            f"Command round trip: p50 {fleet['p50'] * 1000:.1f} ms, "
+            f"p99 {fleet['p99'] * 1000:.1f} ms, max {fleet['max'] * 1000:.1f} ms "
+            f"over {fleet['count']} replies, {stats['lost']} lost"
+        )
+
+    def setup_stats_panel(self, metrics):
+        # The registry belongs to the engine, which exists after the view
+        self.device_model.instrument(metrics)
+        self.event_loop_probe = EventLoopProbe(metrics, self)
+        self.stats_panel = StatsPanel(metrics, self)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.stats_panel)
+        self.stats_panel.hide()
+        self.actionStatistics.toggled.connect(self.stats_panel.setVisible)
+        self.stats_panel.visibilityChanged.connect(self.actionStatistics.setChecked)
 
     def update_button_state(self, button, state):
-        if state == "OFF":
-            button.setStyleSheet(
-                """
-                QPushButton {
-                    background-color: red;
-                    color: white;
-                    border: 1px solid darkred;
-                    padding: 5px;
-                }
-                QPushButton:hover {
-                    background-color: darkred;
-                }
-            """
-            )
-        else:
-            button.setStyleSheet(
-                """
-                QPushButton {
-                    background-color: cyan;
-                    color: black;
-                    border: 1px solid darkcyan;
-                    padding: 5px;
-                }
-                QPushButton:hover {
-                    background-color: darkcyan;
-                }
-            """
-            )
+        # Colours come from the QPushButton[state=...] rules in the .ui
+        # stylesheet, so only a changed property triggers a re-polish
+        if button.property("state") == state:
+            return
+        button.setProperty("state", state)
+        button.style().unpolish(button)
+        button.style().polish(button)